@@ -296,11 +296,56 @@
   }
   
   let chatSocket = null;
+  // Chat session resume: a reconnect (to any server worker) replays missed frames
+  let chatSessionToken = sessionStorage.getItem('tegaChatSession');
+  let lastSeq = parseInt(sessionStorage.getItem('tegaChatLastSeq') || '0', 10);
+  // Documents uploaded in this chat session; follow-up questions name them
+  // so the relevant passages are found without uploading the file again.
+  // Kept with the session (per tab), never across sessions or logins.
+  let recentDocuments = JSON.parse(sessionStorage.getItem('tegaChatDocuments') || '[]');
+  localStorage.removeItem('tegaChatDocuments');  // where older versions kept them
   let reconnectAttempts = 0;
   let reconnectInterval = null;
   let isIntentionallyClosed = false;
   
+  // Chat history is loaded a page at a time, older pages as the user scrolls up
+  let historyCursor = null;
+  let historyLoading = false;
+  let historyExhausted = false;
+  
+  async function loadChatHistory() {
+    if (historyLoading || historyExhausted) return;
+    historyLoading = true;
+    try {
+      let url = '/api/chat-history/';
+      if (historyCursor) url += `?before=${encodeURIComponent(historyCursor)}`;
+      const response = await fetch(url, { credentials: 'same-origin' });
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      const page = await response.json();
+      
+      // Insert above what is already shown, keeping the current scroll position
+      const previousHeight = chatMessages.scrollHeight;
+      const fragment = document.createDocumentFragment();
+      page.messages.forEach((message) => {
+        fragment.appendChild(createMessageElement(message.text, message.role === 'user'));
+      });
+      chatMessages.insertBefore(fragment, chatMessages.firstChild);
+      chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+      
+      historyCursor = page.next_cursor;
+      historyExhausted = !historyCursor;
+    } catch (error) {
+      console.error('Failed to load chat history:', error);
+    } finally {
+      historyLoading = false;
+    }
+  }
+  
   if (chatMessages) {
+    loadChatHistory();
+    chatMessages.addEventListener('scroll', () => {
+      if (chatMessages.scrollTop < 80) loadChatHistory();
+    });
     connectWebSocket();
   }
   
@@ -309,7 +354,10 @@
     
     try {
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-      const wsUrl = `${protocol}//${window.location.host}/ws/chat/`;
+      let wsUrl = `${protocol}//${window.location.host}/ws/chat/`;
+      if (chatSessionToken) {
+        wsUrl += `?session=${encodeURIComponent(chatSessionToken)}&last_seq=${lastSeq}`;
+      }
       chatSocket = new WebSocket(wsUrl);
       
       chatSocket.onopen = function(e) {
@@ -327,6 +375,55 @@
       chatSocket.onmessage = function(e) {
         try {
           const data = JSON.parse(e.data);
+          if (data.type === 'pong') return;
+          if (data.type === 'session') {
+            chatSessionToken = data.session;
+            if (!data.resumed) {
+              lastSeq = 0;
+              recentDocuments = [];
+              sessionStorage.removeItem('tegaChatDocuments');
+            }
+            sessionStorage.setItem('tegaChatSession', chatSessionToken);
+            sessionStorage.setItem('tegaChatLastSeq', lastSeq);
+            return;
+          }
+          if (data.seq) {
+            if (data.seq <= lastSeq) return;
+            lastSeq = data.seq;
+            sessionStorage.setItem('tegaChatLastSeq', lastSeq);
+          }
+          if (data.type && data.type.startsWith('upload_')) {
+            handleUploadFrame(data);
+            return;
+          }
+          if (data.type === 'upstream') {
+            // The server lost (or regained) the AI engine; messages sent
+            // meanwhile are queued and delivered when it is back
+            const statusEl = document.querySelector('.chat-status');
+            if (statusEl) statusEl.textContent = data.state === 'connected' ? '● Online' : '● Tega is reconnecting...';
+            return;
+          }
+          if (data.type === 'rate_limited' || data.type === 'frame_too_large') {
+            addMessage(data.error, false);
+            return;
+          }
+          if (data.type === 'document') {
+            recentDocuments = [data.id, ...recentDocuments.filter(id => id !== data.id)].slice(0, 3);
+            sessionStorage.setItem('tegaChatDocuments', JSON.stringify(recentDocuments));
+            return;
+          }
+          if (data.type === 'file_progress') {
+            updateFileProgress(data);
+            return;
+          }
+          if (data.type === 'delta') {
+            appendStreamDelta(data.id, data.text || '');
+            return;
+          }
+          if (data.type === 'done') {
+            finishStreamMessage(data.id);
+            return;
+          }
           const message = data.message || data.response || data.text || e.data;
           addMessage(message, false);
         } catch (error) {
@@ -342,6 +439,16 @@
       
       chatSocket.onclose = function(e) {
         console.log('WebSocket connection closed');
+        failPendingUploads('Connection lost during upload');
+        if (e.code === 4001) {
+          // Another tab resumed this session; start a fresh one
+          chatSessionToken = null;
+          lastSeq = 0;
+          sessionStorage.removeItem('tegaChatSession');
+          sessionStorage.removeItem('tegaChatLastSeq');
+          sessionStorage.removeItem('tegaChatDocuments');
+          recentDocuments = [];
+        }
         const statusEl = document.querySelector('.chat-status');
         if (statusEl) statusEl.textContent = '● Reconnecting...';
         
@@ -411,12 +518,11 @@
     return html;
   }
 
-  // UNIFIED addMessage function with text-to-speech support
-  function addMessage(text, isUser = false) {
-    if (!chatMessages) return;
-    
+  // Builds a chat message element (with its read aloud button) without inserting it
+  function createMessageElement(text, isUser = false, streaming = false) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${isUser ? 'user-message' : 'tega-message'}`;
+    messageDiv.rawText = text;
     
     const avatarDiv = document.createElement('div');
     avatarDiv.className = `message-avatar ${isUser ? 'user-avatar' : ''}`;
@@ -427,12 +533,17 @@
       const img = document.createElement('img');
       img.src = document.querySelector('.logo-icon img')?.src || '/static/icons/Logo.svg';
       avatarDiv.appendChild(img);
-      playMessageSound();
     }
     
     const bubbleDiv = document.createElement('div');
     bubbleDiv.className = 'message-bubble';
-    bubbleDiv.innerHTML = parseMarkdown(text);
+    if (streaming) {
+      // Plain text while streaming; markdown is rendered once when the reply is done
+      bubbleDiv.style.whiteSpace = 'pre-wrap';
+      bubbleDiv.appendChild(document.createTextNode(text));
+    } else {
+      bubbleDiv.innerHTML = parseMarkdown(text);
+    }
     
     if (isUser) {
       messageDiv.appendChild(bubbleDiv);
@@ -449,18 +560,178 @@
       readBtn.addEventListener('click', function(e) {
         e.preventDefault();
         e.stopPropagation();
-        speakText(text);
+        speakText(messageDiv.rawText);
       });
       messageDiv.appendChild(readBtn);
+    }
+    
+    return messageDiv;
+  }
+
+  // UNIFIED addMessage function with text-to-speech support
+  // Pass streaming=true to create an empty Tega bubble that deltas are appended to.
+  function addMessage(text, isUser = false, streaming = false) {
+    if (!chatMessages) return;
+    
+    const messageDiv = createMessageElement(text, isUser, streaming);
+    if (!isUser) {
+      playMessageSound();
       
       // Auto-read if enabled
-      if (readAloudEnabled) {
+      if (readAloudEnabled && !streaming) {
         setTimeout(() => speakText(text), 500);
       }
     }
     
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv;
+  }
+
+  // Streaming replies: deltas are appended to one bubble per message id
+  // and written to the DOM at most once per animation frame.
+  const streamingMessages = {};
+
+  function appendStreamDelta(id, text) {
+    let entry = streamingMessages[id];
+    if (!entry) {
+      const messageDiv = addMessage('', false, true);
+      if (!messageDiv) return;
+      const bubble = messageDiv.querySelector('.message-bubble');
+      entry = { messageDiv, bubble, textNode: bubble.firstChild, pending: '', frame: null };
+      streamingMessages[id] = entry;
+    }
+    entry.messageDiv.rawText += text;
+    entry.pending += text;
+    if (!entry.frame) {
+      entry.frame = requestAnimationFrame(() => {
+        entry.frame = null;
+        entry.textNode.appendData(entry.pending);
+        entry.pending = '';
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+      });
+    }
+  }
+
+  function finishStreamMessage(id) {
+    const entry = streamingMessages[id];
+    if (!entry) return;
+    delete streamingMessages[id];
+    if (entry.frame) cancelAnimationFrame(entry.frame);
+
+    const fullText = entry.messageDiv.rawText;
+    entry.bubble.style.whiteSpace = '';
+    entry.bubble.innerHTML = parseMarkdown(fullText);
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+
+    if (readAloudEnabled) {
+      setTimeout(() => speakText(fullText), 500);
+    }
+  }
+
+  // Status bubble for the file currently being read on the server
+  let fileProgressBubble = null;
+
+  function updateFileProgress(data) {
+    if (!fileProgressBubble) return;
+    const status = data.page >= data.pages
+      ? `Read all ${data.pages} pages of ${data.name}. Thinking...`
+      : `Reading ${data.name}: page ${data.page} of ${data.pages}...`;
+    const excerpt = data.excerpt || '';
+    fileProgressBubble.style.whiteSpace = 'pre-line';
+    fileProgressBubble.textContent = excerpt ? `${status}\n\n${excerpt}…` : status;
+  }
+
+  // ============================================
+  // CHUNKED FILE UPLOADS
+  // ============================================
+  // Files are streamed as binary frames: [4-byte header length][JSON header][bytes].
+  // The server acks every chunk; we keep only a small window of chunks in flight.
+  const UPLOAD_CHUNK_SIZE = 64 * 1024;
+  const pendingUploads = {};
+  let uploadCounter = 0;
+
+  function encodeUploadFrame(header, payload) {
+    const headerBytes = new TextEncoder().encode(JSON.stringify(header));
+    const payloadBytes = payload ? new Uint8Array(payload) : new Uint8Array(0);
+    const frame = new Uint8Array(4 + headerBytes.length + payloadBytes.length);
+    new DataView(frame.buffer).setUint32(0, headerBytes.length);
+    frame.set(headerBytes, 4);
+    frame.set(payloadBytes, 4 + headerBytes.length);
+    return frame.buffer;
+  }
+
+  function hex(buffer) {
+    return Array.from(new Uint8Array(buffer), byte => byte.toString(16).padStart(2, '0')).join('');
+  }
+
+  function waitForUpload(upload) {
+    return new Promise((resolve, reject) => {
+      if (upload.error) return reject(upload.error);
+      upload.waiters.push({ resolve, reject });
+    });
+  }
+
+  function handleUploadFrame(data) {
+    const upload = pendingUploads[data.id];
+    if (!upload) return;
+    if (data.type === 'upload_ready') {
+      upload.ready = data;
+    } else if (data.type === 'upload_ack') {
+      upload.acked = data.offset;
+    } else if (data.type === 'upload_error') {
+      upload.error = new Error(data.error || 'Upload failed');
+    }
+    const waiters = upload.waiters.splice(0);
+    waiters.forEach(w => upload.error ? w.reject(upload.error) : w.resolve());
+  }
+
+  function failPendingUploads(reason) {
+    Object.keys(pendingUploads).forEach(id => {
+      handleUploadFrame({ type: 'upload_error', id, error: reason });
+    });
+  }
+
+  async function uploadFile(file, messageForAI) {
+    const id = `up-${Date.now()}-${++uploadCounter}`;
+    const upload = { ready: null, acked: 0, error: null, waiters: [] };
+    pendingUploads[id] = upload;
+
+    // The server checks the upload against this (crypto.subtle needs a secure context)
+    const digest = window.crypto && crypto.subtle
+      ? file.arrayBuffer().then(data => crypto.subtle.digest('SHA-256', data)).then(hex).catch(() => null)
+      : Promise.resolve(null);
+
+    try {
+      chatSocket.send(encodeUploadFrame({ op: 'start', id, name: file.name, type: file.type, size: file.size }));
+      while (!upload.ready) await waitForUpload(upload);
+
+      const chunkSize = upload.ready.chunk_size || UPLOAD_CHUNK_SIZE;
+      const windowBytes = chunkSize * (upload.ready.window || 4);
+      let offset = 0;
+
+      while (offset < file.size) {
+        // Backpressure: wait for acks before running too far ahead of the server
+        while (offset - upload.acked >= windowBytes) await waitForUpload(upload);
+        if (upload.error) throw upload.error;
+
+        const end = Math.min(offset + chunkSize, file.size);
+        const payload = await file.slice(offset, end).arrayBuffer();
+        chatSocket.send(encodeUploadFrame({ op: 'chunk', id, offset }, payload));
+        offset = end;
+      }
+
+      while (upload.acked < file.size) await waitForUpload(upload);
+      chatSocket.send(encodeUploadFrame({
+        op: 'end',
+        id,
+        message: messageForAI,
+        unique_id: window.uniqueId || null,
+        sha256: await digest
+      }));
+    } finally {
+      delete pendingUploads[id];
+    }
   }
 
   function sendMessage() {
@@ -483,59 +754,49 @@
     }
     
     if (attachedFile) {
-      addMessage('Processing file...', false);
+      const processingMessage = addMessage('Processing file...', false);
+      fileProgressBubble = processingMessage ? processingMessage.querySelector('.message-bubble') : null;
       
-      const reader = new FileReader();
-      reader.onload = function(e) {
-        const base64Content = e.target.result.split(',')[1];
-        
-        let messageForAI = userMessage;
-        if (!messageForAI) {
-          if (attachedFile.type === 'application/pdf') {
-            messageForAI = 'Please read and analyze this PDF document. Help me understand its content.';
-          } else if (attachedFile.type === 'text/plain') {
-            messageForAI = 'Please read and analyze this text file. Help me understand its content.';
-          } else {
-            messageForAI = `Please analyze this file: ${attachedFile.name}`;
-          }
-        }
-        
-        if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-          const messageData = {
-            message: messageForAI,
-            type: 'chat',
-            unique_id: window.uniqueId || null,
-            file: {
-              name: attachedFile.name,
-              type: attachedFile.type,
-              content: base64Content
-            }
-          };
-          
-          chatSocket.send(JSON.stringify(messageData));
-          console.log('File sent:', attachedFile.name);
+      let messageForAI = userMessage;
+      if (!messageForAI) {
+        const extension = attachedFile.name.split('.').pop().toLowerCase();
+        if (extension === 'pdf') {
+          messageForAI = 'Please read and analyze this PDF document. Help me understand its content.';
+        } else if (extension === 'txt') {
+          messageForAI = 'Please read and analyze this text file. Help me understand its content.';
+        } else if (extension === 'docx') {
+          messageForAI = 'Please read and analyze this Word document. Help me understand its content.';
+        } else if (extension === 'csv') {
+          messageForAI = 'Please read and analyze this spreadsheet. Help me understand its content.';
         } else {
-          addMessage('Sorry, connection lost. Please refresh the page.', false);
+          messageForAI = `Please analyze this file: ${attachedFile.name}`;
         }
-        
-        fileInput.value = '';
-        const filePreview = document.getElementById('file-preview');
-        if (filePreview) filePreview.style.display = 'none';
-      };
-      reader.onerror = function(error) {
-        console.error('Error reading file:', error);
-        addMessage('Sorry, there was an error reading the file.', false);
+      }
+      
+      const resetFileInput = () => {
         fileInput.value = '';
         const filePreview = document.getElementById('file-preview');
         if (filePreview) filePreview.style.display = 'none';
       };
-      reader.readAsDataURL(attachedFile);
+      
+      if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
+        uploadFile(attachedFile, messageForAI)
+          .then(() => console.log('File sent:', attachedFile.name))
+          .catch(error => {
+            console.error('Error uploading file:', error);
+            addMessage(`Sorry, there was an error sending the file. ${error.message || ''}`, false);
+          });
+      } else {
+        addMessage('Sorry, connection lost. Please refresh the page.', false);
+      }
+      resetFileInput();
     } else {
       if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
         const messageData = JSON.stringify({
           message: userMessage,
           type: 'chat',
-          unique_id: window.uniqueId || null
+          unique_id: window.uniqueId || null,
+          documents: recentDocuments
         });
         chatSocket.send(messageData);
       } else {
@@ -571,9 +832,12 @@
     fileInput.addEventListener('change', (e) => {
       const file = e.target.files[0];
       if (file) {
-        const validTypes = ['application/pdf', 'text/plain'];
-        if (!validTypes.includes(file.type)) {
-          alert('Please upload only PDF or TXT files.');
+        // Browsers report no MIME type for some of these (e.g. .md), so
+        // check the extension; the server identifies the real format
+        const validExtensions = ['pdf', 'txt', 'docx', 'md', 'markdown', 'html', 'htm', 'csv'];
+        const extension = file.name.includes('.') ? file.name.split('.').pop().toLowerCase() : '';
+        if (!validExtensions.includes(extension)) {
+          alert('Please upload a PDF, Word (DOCX), Markdown, HTML, CSV or TXT file.');
           fileInput.value = '';
           return;
         }
@@ -621,36 +885,6 @@
       tunde: { name: 'Tunde', type: 'Self-Paced Mastery', icon: '🐢' }
     };
 
-    function detectPersona(answers){
-      const scores = { chidi:0, ngozi:0, tunde:0 };
-      switch(answers.learningStyle){
-        case 'visual-active': scores.chidi += 3; break;
-        case 'audio-patient': scores.ngozi += 3; break;
-        case 'slow-steady': scores.tunde += 3; break;
-        case 'mixed': scores.chidi += 1; scores.ngozi += 1; scores.tunde += 1; break;
-      }
-      switch(answers.focusTime){
-        case '5': scores.chidi += 3; break;
-        case '15': scores.chidi += 1; scores.tunde += 1; break;
-        case '30': scores.tunde += 2; break;
-        case 'flex': scores.chidi += 2; break;
-      }
-      switch(answers.readingLevel){
-        case 'struggle': scores.ngozi += 3; scores.chidi += 1; break;
-        case 'slow': scores.ngozi += 2; scores.tunde += 2; break;
-        case 'ok': scores.tunde += 1; break;
-        case 'confident': break;
-      }
-      switch(answers.learningGoal){
-        case 'school': scores.chidi += 1; scores.tunde += 1; break;
-        case 'life-skills': scores.ngozi += 3; break;
-        case 'catch-up': scores.tunde += 2; break;
-        case 'confidence': scores.ngozi += 1; scores.tunde += 1; break;
-      }
-      const detected = Object.entries(scores).sort((a,b)=>b[1]-a[1])[0][0];
-      return detected;
-    }
-
     personaForm.addEventListener('submit', function(e){
       try {
         const fd = new FormData(personaForm);
@@ -678,4 +912,51 @@
       }
     });
   }
+  // Offline mode: the service worker (/sw.js) caches lessons and dashboards
+  // and queues progress events until the connection is back (miva/offline.py)
+  function getCookie(name){
+    const match = document.cookie.match(new RegExp('(^|; )' + name + '=([^;]+)'));
+    return match ? decodeURIComponent(match[2]) : null;
+  }
+
+  function newEventId(){
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+  }
+
+  // Record a learning event (lesson_started, lesson_completed, quiz_completed);
+  // detail adds fields such as a quiz's graded answers
+  function reportProgress(kind, detail){
+    const csrftoken = getCookie('csrftoken');
+    return fetch('/api/progress/batch/', {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: Object.assign({ 'Content-Type': 'application/json' }, csrftoken ? { 'X-CSRFToken': csrftoken } : {}),
+      body: JSON.stringify({ events: [Object.assign({}, detail, { id: newEventId(), kind, at: Date.now() })] })
+    }).catch((err) => console.warn('Could not record progress:', err));
+  }
+
+  window.TegaProgress = { report: reportProgress };
+
+  // Signing out ends the chat session, and with it the documents follow-ups may use
+  function forgetChatSession(){
+    ['tegaChatSession', 'tegaChatLastSeq', 'tegaChatDocuments'].forEach((key) => sessionStorage.removeItem(key));
+  }
+  document.addEventListener('click', (e) => {
+    const link = e.target.closest && e.target.closest('a[href]');
+    if (link && new URL(link.href, window.location.href).pathname === '/logout/') forgetChatSession();
+  });
+  window.TegaChat = { forget: forgetChatSession };
+
+  if ('serviceWorker' in navigator && window.isSecureContext) {
+    window.addEventListener('load', () => {
+      navigator.serviceWorker.register('/sw.js').catch((err) => console.warn('Offline mode unavailable:', err));
+    });
+    // Browsers without Background Sync send the queue when the page sees the connection return
+    window.addEventListener('online', () => {
+      navigator.serviceWorker.ready.then((registration) => {
+        if (registration.active) registration.active.postMessage({ type: 'flush' });
+      });
+    });
+  }
 })();
@@ -45,18 +45,33 @@
     speak(text, rate, pitch);
   }
 
-  // CHIDI: XP & streak system (simple localStorage impl)
-  const XP_KEY = 'chidiXP';
-  const STREAK_KEY = 'chidiStreak';
-  const LAST_VISIT_KEY = 'chidiLastVisitDate';
+  // CHIDI: XP & streak are tracked on the server (rendered into the page);
+  // starting a lesson is reported so it counts towards XP and the streak
+  function getCookie(name){
+    const match = document.cookie.match(new RegExp('(^|; )' + name + '=([^;]+)'));
+    return match ? decodeURIComponent(match[2]) : null;
+  }
+
+  function showStats(stats){
+    const xpEl = document.getElementById('xp-points');
+    if(xpEl) xpEl.textContent = stats.total_points + ' XP';
+    const streakEl = document.getElementById('streak-days');
+    if(streakEl) streakEl.textContent = stats.streak_days + (stats.streak_days === 1 ? ' Day' : ' Days');
+  }
 
-  function earnXP(amount){
-    const current = parseInt(localStorage.getItem(XP_KEY)) || 0;
-    const next = current + amount;
-    localStorage.setItem(XP_KEY, next);
-    const el = document.getElementById('xp-points');
-    if(el) el.textContent = next + ' XP';
-    floatToast('+'+amount+' XP ✨');
+  function earnXP(kind){
+    const csrftoken = getCookie('csrftoken');
+    return fetch('/api/progress/', {
+      method: 'POST',
+      credentials: 'same-origin',
+      keepalive: true,
+      headers: Object.assign({'Content-Type': 'application/json'}, csrftoken ? {'X-CSRFToken': csrftoken} : {}),
+      body: JSON.stringify({ kind: kind || 'lesson_started' })
+    }).then(r => r.ok ? r.json() : null).then(stats => {
+      if(!stats) return;
+      showStats(stats);
+      floatToast('XP earned ✨');
+    }).catch(()=>{});
   }
 
   function floatToast(text){
@@ -68,37 +83,11 @@
     setTimeout(()=>{el.style.opacity='0'; el.style.transform='translate(-50%,-40%)'; setTimeout(()=>el.remove(),200);}, 1400);
   }
 
-  function updateStreak(){
-    const today = new Date().toDateString();
-    const last = localStorage.getItem(LAST_VISIT_KEY);
-    let streak = parseInt(localStorage.getItem(STREAK_KEY)) || 0;
-    const yesterday = new Date(Date.now() - 86400000).toDateString();
-    if(last === today) {
-      // already counted
-    } else if(last === yesterday){
-      streak += 1;
-    } else {
-      streak = 1;
-    }
-    localStorage.setItem(STREAK_KEY, ''+streak);
-    localStorage.setItem(LAST_VISIT_KEY, today);
-    const el = document.getElementById('streak-days');
-    if(el) el.textContent = streak + ' Days';
-  }
-
-  function loadXP(){
-    const xp = parseInt(localStorage.getItem(XP_KEY)) || 0;
-    const el = document.getElementById('xp-points');
-    if(el) el.textContent = xp + ' XP';
-  }
-
   function initChidi(){
-    loadXP();
-    updateStreak();
     const startBtn = document.getElementById('chidi-start-lesson');
     if(startBtn){
       startBtn.addEventListener('click', ()=>{
-        earnXP(10);
+        earnXP('lesson_started');
   window.location.href = '/micro-lesson/';
       });
     }
@@ -229,6 +229,8 @@
     const selectedAnswer = e.target.dataset.answer;
     const correctAnswer = '6';
 
+    reportProgress('quiz_completed');
+
     optionBtns.forEach(btn => {
       btn.disabled = true;
       if (btn.dataset.answer === correctAnswer) {
@@ -380,6 +382,14 @@
     } catch (e) {
       console.error('Failed to save progress:', e);
     }
+
+    // Count the lesson towards the learner's XP, streak and badges
+    reportProgress('lesson_completed');
+  }
+
+  // Queued by the service worker while offline (see TegaProgress in app.js)
+  function reportProgress(kind) {
+    if (window.TegaProgress) window.TegaProgress.report(kind);
   }
 
   // Initialize when page loads
@@ -103,95 +103,6 @@ if (document.getElementById('personaForm')) {
   });
 }
 
-// Persona detection algorithm
-function detectPersona(answers) {
-  const scores = {
-    chidi: 0,
-    ngozi: 0,
-    tunde: 0
-  };
-  
-  // Scoring based on learning style
-  switch(answers.learningStyle) {
-    case 'visual-active':
-      scores.chidi += 3;
-      break;
-    case 'audio-patient':
-      scores.ngozi += 3;
-      break;
-    case 'slow-steady':
-      scores.tunde += 3;
-      break;
-    case 'mixed':
-      scores.chidi += 1;
-      scores.ngozi += 1;
-      scores.tunde += 1;
-      break;
-  }
-  
-  // Scoring based on focus time
-  switch(answers.focusTime) {
-    case '5':
-      scores.chidi += 3;
-      break;
-    case '15':
-      scores.chidi += 1;
-      scores.tunde += 1;
-      break;
-    case '30':
-      scores.tunde += 2;
-      break;
-    case 'flex':
-      scores.chidi += 2;
-      break;
-  }
-  
-  // Scoring based on reading level
-  switch(answers.readingLevel) {
-    case 'struggle':
-      scores.ngozi += 3;
-      scores.chidi += 1;
-      break;
-    case 'slow':
-      scores.ngozi += 2;
-      scores.tunde += 2;
-      break;
-    case 'ok':
-      scores.tunde += 1;
-      break;
-    case 'confident':
-      // No specific persona benefit
-      break;
-  }
-  
-  // Scoring based on learning goal
-  switch(answers.learningGoal) {
-    case 'school':
-      scores.chidi += 1;
-      scores.tunde += 1;
-      break;
-    case 'life-skills':
-      scores.ngozi += 3;
-      break;
-    case 'catch-up':
-      scores.tunde += 2;
-      break;
-    case 'confidence':
-      scores.ngozi += 1;
-      scores.tunde += 1;
-      break;
-  }
-  
-  // Determine highest scoring persona
-  const sortedPersonas = Object.entries(scores).sort((a, b) => b[1] - a[1]);
-  const detectedPersona = sortedPersonas[0][0];
-  
-  console.log('Persona Scores:', scores);
-  console.log('Detected Persona:', detectedPersona);
-  
-  return detectedPersona;
-}
-
 // Save user profile to localStorage
 function saveUserProfile(persona, answers) {
   const profile = {
@@ -293,17 +204,6 @@ window.TegaPersona = {
     return match ? decodeURIComponent(match[2]) : null;
   }
 
-  // Safe persona detector fallback (if detectPersona exists elsewhere it will be used)
-  function detectPersonaFromAnswers(answers) {
-    if (typeof detectPersona === 'function') {
-      try { return detectPersona(answers); } catch(e){}
-    }
-    // simple fallback: prefer ngozi if readingLevel is 'struggle' or learningGoal life-skills
-    if (answers.readingLevel === 'struggle' || answers.learningGoal === 'life-skills') return 'ngozi';
-    if (answers.focusTime === '5') return 'chidi';
-    return 'tunde';
-  }
-
   // Auto-submit + redirect behavior is opt-in per-template.
   // Templates that want immediate redirect when an option is chosen should
   // add `data-auto-redirect="true"` to the <form id="personaForm">.
@@ -328,7 +228,7 @@ window.TegaPersona = {
       learningGoal: fd.get('learningGoal') || ''
     };
 
-    const persona = detectPersonaFromAnswers(answers);
+    const persona = detectPersona(answers);
 
     // set hidden field if present
     const hidden = document.getElementById('persona-field');
@@ -0,0 +1,51 @@
+// Persona detection shared by every questionnaire page (see miva.assets.BUNDLES).
+// Instant preview only: the server re-scores the answers with miva/personas.py,
+// which is authoritative. The weights mirror SCORING_TABLE there and the tests
+// check that both score the same.
+
+const PERSONA_ORDER = ['chidi', 'ngozi', 'tunde'];
+
+// Form field -> answer -> points for [chidi, ngozi, tunde]
+const PERSONA_WEIGHTS = {
+  learningStyle: {
+    'visual-active': [3, 0, 0],
+    'audio-patient': [0, 3, 0],
+    'slow-steady': [0, 0, 3],
+    'mixed': [1, 1, 1]
+  },
+  focusTime: {
+    '5': [3, 0, 0],
+    '15': [1, 0, 1],
+    '30': [0, 0, 2],
+    'flex': [2, 0, 0]
+  },
+  readingLevel: {
+    'struggle': [1, 3, 0],
+    'slow': [0, 2, 2],
+    'ok': [0, 0, 1],
+    'confident': [0, 0, 0]
+  },
+  learningGoal: {
+    'school': [1, 0, 1],
+    'life-skills': [0, 3, 0],
+    'catch-up': [0, 0, 2],
+    'confidence': [0, 1, 1]
+  }
+};
+
+function scorePersonas(answers) {
+  const scores = { chidi: 0, ngozi: 0, tunde: 0 };
+  Object.keys(PERSONA_WEIGHTS).forEach(field => {
+    const table = PERSONA_WEIGHTS[field];
+    if (!Object.prototype.hasOwnProperty.call(table, answers[field])) return;
+    const points = table[answers[field]];
+    PERSONA_ORDER.forEach((persona, i) => { scores[persona] += points[i]; });
+  });
+  return scores;
+}
+
+// Highest scoring persona; ties go to the one listed first, as on the server
+function detectPersona(answers) {
+  const scores = scorePersonas(answers);
+  return PERSONA_ORDER.reduce((best, persona) => scores[persona] > scores[best] ? persona : best);
+}
@@ -0,0 +1,252 @@
+/* Tega — service worker: offline lessons and queued progress (see miva/offline.py).
+   Served at /sw.js with the PRECACHE manifest defined in front of this file. */
+const CACHE_PREFIX = 'tega-';
+const PAGES_CACHE = CACHE_PREFIX + 'pages-' + PRECACHE.version;
+const ASSETS_CACHE = CACHE_PREFIX + 'assets-' + PRECACHE.version;
+const CACHED_AT = 'X-Tega-Cached-At';
+const SYNC_TAG = 'progress-sync';
+
+const QUEUE_DB = 'tega-offline';
+const QUEUE_STORE = 'progress';
+const META_STORE = 'meta';
+
+const lessons = new Set(PRECACHE.lessons);
+const dashboards = new Set(PRECACHE.dashboards);
+const pages = PRECACHE.lessons.concat(PRECACHE.dashboards);
+
+self.addEventListener('install', (event) => {
+  event.waitUntil(precache().then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', (event) => {
+  // Caches from earlier versions are never read again
+  event.waitUntil(
+    caches.keys()
+      .then((keys) => Promise.all(keys
+        .filter((key) => key.startsWith(CACHE_PREFIX) && key !== PAGES_CACHE && key !== ASSETS_CACHE)
+        .map((key) => caches.delete(key))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', (event) => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+
+  if (request.method === 'POST' && url.pathname === PRECACHE.sync_url) {
+    event.respondWith(queueProgress(event));
+  } else if (request.method !== 'GET') {
+    return;
+  } else if (request.mode === 'navigate' && url.pathname === PRECACHE.logout_url) {
+    event.respondWith(logout(event));
+  } else if (lessons.has(url.pathname)) {
+    event.respondWith(cacheFirst(event, PAGES_CACHE, PRECACHE.revalidate_after));
+  } else if (dashboards.has(url.pathname)) {
+    event.respondWith(networkFirst(event, PAGES_CACHE));
+  } else if (url.pathname.startsWith(PRECACHE.content_url)) {
+    // Question sets: revalidated on every use, which costs a 304 when unchanged
+    event.respondWith(cacheFirst(event, PAGES_CACHE, 0));
+  } else if (url.pathname.startsWith(PRECACHE.static_url)) {
+    event.respondWith(cacheFirst(event, ASSETS_CACHE, PRECACHE.hashed ? Infinity : PRECACHE.revalidate_after));
+  }
+});
+
+self.addEventListener('sync', (event) => {
+  // A rejected flush is retried by the browser later
+  if (event.tag === SYNC_TAG) event.waitUntil(flush());
+});
+
+self.addEventListener('message', (event) => {
+  if (event.data && event.data.type === 'flush') {
+    event.waitUntil(flush().catch(() => null));
+  }
+});
+
+// -- Caching -------------------------------------------------------------
+
+function precache() {
+  return Promise.all([
+    caches.open(ASSETS_CACHE).then((cache) => Promise.all(PRECACHE.assets.map((url) => store(cache, url)))),
+    caches.open(PAGES_CACHE).then((cache) => Promise.all(pages.map((url) => store(cache, url)))),
+  ]);
+}
+
+// Fetch a URL into the cache; pages that need a login are skipped until there is one
+function store(cache, url) {
+  return fetch(url, { cache: 'no-cache', credentials: 'same-origin' })
+    .then((response) => put(cache, url, response))
+    .catch(() => null);
+}
+
+// Cache a good response (stamped with the time) and return it; forget the key on a redirect
+function put(cache, key, response) {
+  if (response.redirected || response.type === 'opaqueredirect') {
+    return cache.delete(key).then(() => response);
+  }
+  if (!response.ok) return Promise.resolve(response);
+  const copy = response.clone();
+  return copy.blob().then((body) => {
+    const headers = new Headers(copy.headers);
+    headers.set(CACHED_AT, String(Date.now()));
+    return cache.put(key, new Response(body, { status: copy.status, statusText: copy.statusText, headers }));
+  }).then(() => response);
+}
+
+function isStale(response, maxAge) {
+  const cachedAt = Number(response.headers.get(CACHED_AT) || 0);
+  return Date.now() - cachedAt >= maxAge * 1000;
+}
+
+function fromNetwork(event, cache, request) {
+  return fetch(request).then((response) => put(cache, request, response)).then((response) => {
+    if (request.mode === 'navigate' && response.ok && !response.redirected) {
+      // Signed in and online: fill in pages precache skipped and send queued progress
+      event.waitUntil(Promise.all([topUp(), flush().catch(() => null)]));
+    }
+    return response;
+  });
+}
+
+// Serve from the cache; refetch in the background once older than maxAge seconds
+function cacheFirst(event, cacheName, maxAge) {
+  // Pages vary on Cookie; the cache only ever holds the signed-in learner's
+  return caches.open(cacheName).then((cache) => cache.match(event.request, { ignoreVary: true }).then((cached) => {
+    if (!cached) {
+      return fromNetwork(event, cache, event.request).catch(() => fallback(cache, event.request));
+    }
+    if (isStale(cached, maxAge)) {
+      event.waitUntil(fromNetwork(event, cache, event.request).catch(() => null));
+    }
+    return cached;
+  }));
+}
+
+function networkFirst(event, cacheName) {
+  return caches.open(cacheName).then((cache) => fromNetwork(event, cache, event.request)
+    .catch(() => fallback(cache, event.request)));
+}
+
+// Offline and not cached: the same page with other query parameters will do
+function fallback(cache, request) {
+  return cache.match(request, { ignoreSearch: true, ignoreVary: true }).then((cached) => {
+    if (cached) return cached;
+    return request.mode === 'navigate' ? offlinePage() : Response.error();
+  });
+}
+
+function offlinePage() {
+  return new Response(
+    '<!doctype html><meta charset="utf-8"><meta name="viewport" content="width=device-width">' +
+    '<title>Offline - Tega</title><p>You\'re offline. Lessons you have opened before still work; ' +
+    'this page will load once you\'re back online.</p>',
+    { status: 503, headers: { 'Content-Type': 'text/html; charset=utf-8' } }
+  );
+}
+
+let toppedUp = false;
+
+function topUp() {
+  if (toppedUp) return Promise.resolve();
+  toppedUp = true;
+  return caches.open(PAGES_CACHE).then((cache) => Promise.all(pages.map((url) =>
+    cache.match(url, { ignoreVary: true }).then((cached) => cached || store(cache, url)))));
+}
+
+function logout(event) {
+  // Send this learner's queued progress while the session is still theirs,
+  // then leave nothing of theirs behind for the next person on the device
+  return flush().catch(() => null)
+    .then(() => fetch(event.request))
+    .then((response) => {
+      event.waitUntil(Promise.all([caches.delete(PAGES_CACHE), clearQueue()]));
+      return response;
+    })
+    .catch(() => offlinePage());
+}
+
+// -- Progress queue ------------------------------------------------------
+
+function openQueue() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(QUEUE_DB, 1);
+    open.onupgradeneeded = () => {
+      open.result.createObjectStore(QUEUE_STORE, { keyPath: 'id' });
+      open.result.createObjectStore(META_STORE);
+    };
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+// Run work(store) in one transaction; resolves with the result of the request it returns
+function withStore(name, mode, work) {
+  return openQueue().then((db) => new Promise((resolve, reject) => {
+    const tx = db.transaction(name, mode);
+    const request = work(tx.objectStore(name));
+    tx.oncomplete = () => { db.close(); resolve(request ? request.result : undefined); };
+    tx.onerror = tx.onabort = () => { db.close(); reject(tx.error); };
+  }));
+}
+
+function clearQueue() {
+  return withStore(QUEUE_STORE, 'readwrite', (store) => store.clear()).catch(() => null);
+}
+
+// Every event goes through the queue, so one sent while offline goes out with the next
+function queueProgress(event) {
+  const request = event.request;
+  const token = request.headers.get('X-CSRFToken');
+  return request.clone().json()
+    .then((data) => {
+      const events = data && Array.isArray(data.events) ? data.events : [];
+      return withStore(QUEUE_STORE, 'readwrite', (store) => { events.forEach((item) => store.put(item)); });
+    })
+    .then(() => token && withStore(META_STORE, 'readwrite', (store) => store.put(token, 'csrftoken')))
+    .then(() => flush())
+    .then((result) => jsonResponse(result || { success: true, accepted: [], rejected: [] }, 200))
+    .catch(() => {
+      if (self.registration.sync) event.waitUntil(self.registration.sync.register(SYNC_TAG).catch(() => null));
+      return jsonResponse({ success: true, queued: true }, 202);
+    });
+}
+
+function jsonResponse(data, status) {
+  return new Response(JSON.stringify(data), { status, headers: { 'Content-Type': 'application/json' } });
+}
+
+let flushing = null;
+
+// Send the queue in batches of PRECACHE.sync_batch; one flush at a time
+function flush() {
+  if (!flushing) {
+    flushing = sendQueued().finally(() => { flushing = null; });
+  }
+  return flushing;
+}
+
+function sendQueued() {
+  return Promise.all([
+    withStore(QUEUE_STORE, 'readonly', (store) => store.getAll()),
+    withStore(META_STORE, 'readonly', (store) => store.get('csrftoken')),
+  ]).then(([queued, token]) => {
+    if (!queued.length) return null;
+    const batch = queued.sort((a, b) => a.at - b.at).slice(0, PRECACHE.sync_batch);
+    return fetch(PRECACHE.sync_url, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: Object.assign({ 'Content-Type': 'application/json' }, token ? { 'X-CSRFToken': token } : {}),
+      body: JSON.stringify({ events: batch })
+    })
+      .then((response) => {
+        // A redirect means the session has gone: keep the queue for the next login
+        if (!response.ok || response.redirected) throw new Error('Progress sync failed: HTTP ' + response.status);
+        return response.json();
+      })
+      .then((result) => {
+        const done = result.accepted.concat(result.rejected);
+        return withStore(QUEUE_STORE, 'readwrite', (store) => { done.forEach((id) => store.delete(id)); })
+          .then(() => (done.length && queued.length > batch.length ? sendQueued() : result));
+      });
+  });
+}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -121,6 +123,47 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [
     BASE_DIR / 'assets',
 ]
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'miva.assets.BundleFinder',  # per-page bundles, see miva/assets.py
+]
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# Per-page JS/CSS bundles are built from ASSET_SOURCE_DIR into ASSET_BUNDLE_DIR.
+# `manage.py build_assets` collects everything into STATIC_ROOT with
+# content-hashed names and gzip/brotli copies; once it has run, whitenoise
+# serves those with far-future immutable caching.
+ASSET_SOURCE_DIR = BASE_DIR / 'assets'
+ASSET_BUNDLE_DIR = BASE_DIR / '.cache' / 'bundles'
+STATIC_ASSETS_BUILT = (STATIC_ROOT / 'staticfiles.json').exists()
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage' if STATIC_ASSETS_BUILT
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# Offline mode: the service worker at /sw.js precaches the lesson and dashboard
+# pages listed in miva/offline.py and queues progress while offline.
+# `manage.py build_precache` (run after build_assets) writes the versioned
+# manifest; without it one is built when the worker is first requested.
+OFFLINE_PRECACHE_MANIFEST = STATIC_ROOT / 'precache.json'
+OFFLINE_REVALIDATE_SECONDS = int(os.environ.get('OFFLINE_REVALIDATE_SECONDS', '3600'))
+OFFLINE_EVENT_MAX_AGE_DAYS = 14  # queued events older than this are recorded as of this many days ago
+
+# Lesson question sets are compiled into memory per process (miva/lessons.py);
+# each process checks at most this often whether a curriculum import changed them
+LESSON_BANK_CHECK_SECONDS = int(os.environ.get('LESSON_BANK_CHECK_SECONDS', '5'))
+
+# Spaced-repetition reviews (miva/reviews.py): the nightly rebalance_reviews
+# command keeps each learner at or below this many reviews due per day
+REVIEW_DAILY_LIMIT = int(os.environ.get('REVIEW_DAILY_LIMIT', '50'))
 
 # Login settings
 LOGIN_URL = 'login'
@@ -129,12 +172,205 @@ LOGOUT_REDIRECT_URL = 'index'
 
 # Channels settings
 ASGI_APPLICATION = 'epsilon.asgi.application'
+
+# Channel layer backend, selected from the environment:
+#   memory        - single Daphne process (default)
+#   redis         - channels_redis, for several processes behind a load balancer
+#   redis-pubsub  - channels_redis pub/sub layer
+#   any dotted path to a channel layer class
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'memory')
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+_CHANNEL_LAYER_CLASSES = {
+    'memory': 'channels.layers.InMemoryChannelLayer',
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'redis-pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+}
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': _CHANNEL_LAYER_CLASSES.get(CHANNEL_LAYER_BACKEND, CHANNEL_LAYER_BACKEND)
+    }
+}
+if CHANNEL_LAYER_BACKEND != 'memory':
+    CHANNEL_LAYERS['default']['CONFIG'] = {'hosts': [REDIS_URL]}
+
+# Cache backend (template fragments, learner data): local memory by default,
+# or CACHE_BACKEND=redis to share it between workers via REDIS_URL
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+_CACHE_CLASSES = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'dummy': 'django.core.cache.backends.dummy.DummyCache',
+}
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_CLASSES.get(CACHE_BACKEND, CACHE_BACKEND),
+        'LOCATION': REDIS_URL if CACHE_BACKEND == 'redis' else 'tega-default',
     }
 }
 
+# Public pages (index, questionnaires) are cached whole for anonymous visitors,
+# in seconds (0 disables); see miva/httpcache.py
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', '600'))
+
+# Static dashboard fragments are cached per persona and locale (0 disables).
+# The version is part of every fragment's key: set it per deploy (e.g. to the
+# release's commit) so changed templates are not served from the old cache.
+DASHBOARD_FRAGMENT_TIMEOUT = int(os.environ.get('DASHBOARD_FRAGMENT_TIMEOUT', '900'))
+DASHBOARD_FRAGMENT_VERSION = os.environ.get('DASHBOARD_FRAGMENT_VERSION', '1')
+
+# Chat session replay log, used to resume a chat on any worker after a reconnect
+CHAT_SESSION_STORE = os.environ.get(
+    'CHAT_SESSION_STORE', 'memory' if CHANNEL_LAYER_BACKEND == 'memory' else 'redis'
+)
+CHAT_SESSION_TTL = 3600  # seconds a disconnected session can be resumed
+CHAT_SESSION_MAX_FRAMES = 500
+CHAT_RESUME_GRACE_SECONDS = 30  # keep relaying a reply that was mid-stream when the socket dropped
+
+# External AI engine (shared, pooled upstream connections)
+AI_ENGINE_URL = os.environ.get('AI_ENGINE_URL', 'wss://epsilonmivaaiengine.onrender.com/ws/chat')
+AI_ENGINE_POOL_SIZE = int(os.environ.get('AI_ENGINE_POOL_SIZE', '256'))
+# Sessions multiplexed on one connection. Replies without a correlation_id are
+# dropped when sessions share a connection, so keep this at 1 (a connection per
+# chat socket) until the engine echoes the id; then raise it (e.g. 256) and
+# lower AI_ENGINE_POOL_SIZE (e.g. 4)
+AI_ENGINE_STREAMS_PER_CONNECTION = int(os.environ.get('AI_ENGINE_STREAMS_PER_CONNECTION', '1'))
+AI_ENGINE_ACQUIRE_TIMEOUT = float(os.environ.get('AI_ENGINE_ACQUIRE_TIMEOUT', '10'))
+# Reconnects back off exponentially (with jitter) from RECONNECT_BASE up to
+# RECONNECT_MAX seconds; chat messages sent meanwhile are queued, up to QUEUE_LIMIT
+AI_ENGINE_RECONNECT_BASE = float(os.environ.get('AI_ENGINE_RECONNECT_BASE', '0.5'))
+AI_ENGINE_RECONNECT_MAX = float(os.environ.get('AI_ENGINE_RECONNECT_MAX', '30'))
+AI_ENGINE_QUEUE_LIMIT = int(os.environ.get('AI_ENGINE_QUEUE_LIMIT', '20'))
+AI_ENGINE_REPLY_TIMEOUT = float(os.environ.get('AI_ENGINE_REPLY_TIMEOUT', '60'))  # seconds to the first reply
+# After BREAKER_THRESHOLD consecutive failures no worker connects for BREAKER_RESET seconds
+AI_ENGINE_BREAKER_THRESHOLD = int(os.environ.get('AI_ENGINE_BREAKER_THRESHOLD', '5'))
+AI_ENGINE_BREAKER_RESET_SECONDS = float(os.environ.get('AI_ENGINE_BREAKER_RESET_SECONDS', '30'))
+
+# Streaming replies: upstream fragments are coalesced into one browser frame per interval
+CHAT_STREAM_FLUSH_INTERVAL = 0.04  # seconds
+CHAT_STREAM_IDLE_TIMEOUT = 5.0  # close a stream with no end marker after this much silence
+
+# Learner preferences and questionnaire results are read through the cache
+LEARNER_CACHE_TIMEOUT = 3600  # seconds; entries are also deleted on every write
+
+# Chat history: written in batches off the hot path, read back a page at a time
+CHAT_HISTORY_BATCH_SIZE = 50
+CHAT_HISTORY_FLUSH_INTERVAL = 1.0  # seconds
+CHAT_HISTORY_PAGE_SIZE = 30
+CHAT_HISTORY_MAX_PAGE_SIZE = 100
+
+# Chunked chat uploads (binary WebSocket frames)
+CHAT_UPLOAD_MAX_BYTES = int(os.environ.get('CHAT_UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+CHAT_UPLOAD_CHUNK_BYTES = 64 * 1024
+CHAT_UPLOAD_WINDOW = 4  # unacknowledged chunks the browser may have in flight
+CHAT_UPLOAD_SPOOL_BYTES = 1024 * 1024  # kept in memory before spilling to disk
+# Larger text frames are refused: decoding them would stall the event loop
+# (the decoders hold the GIL, even in a thread); files use the binary upload
+CHAT_TEXT_FRAME_MAX_BYTES = 256 * 1024
+# JSON library for WebSocket frames: auto (orjson, then msgspec, then stdlib), orjson, msgspec or json
+CHAT_JSON_CODEC = os.environ.get('CHAT_JSON_CODEC', 'auto')
+
+# Per-learner token buckets: each refills at per_minute and holds at most burst.
+# Shared between workers with CHAT_RATE_LIMIT_STORE=redis; drop a budget to disable it.
+CHAT_RATE_LIMIT_STORE = os.environ.get('CHAT_RATE_LIMIT_STORE', 'memory')
+# Anonymous sockets are also charged to a bucket for their client address,
+# this many times the size of a learner's, shared by everyone behind it
+CHAT_RATE_LIMIT_ADDRESS_SCALE = int(os.environ.get('CHAT_RATE_LIMIT_ADDRESS_SCALE', '10'))
+CHAT_RATE_LIMITS = {
+    'messages': {
+        'per_minute': int(os.environ.get('CHAT_RATE_MESSAGES_PER_MINUTE', '20')),
+        'burst': 10,
+    },
+    'upload_bytes': {
+        'per_minute': 30 * 1024 * 1024,
+        'burst': 3 * CHAT_UPLOAD_MAX_BYTES,
+    },
+    'extraction_seconds': {
+        'per_minute': 30,  # half of one extraction worker per learner, sustained
+        'burst': 90,
+    },
+}
+
+# PDF text extraction (process pool)
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', str(min(2, os.cpu_count() or 1))))
+PDF_EXTRACTION_QUEUE_LIMIT = int(os.environ.get('PDF_EXTRACTION_QUEUE_LIMIT', '8'))
+PDF_EXTRACTION_TIMEOUT = float(os.environ.get('PDF_EXTRACTION_TIMEOUT', '60'))
+PDF_EXTRACTION_MAX_PAGES = int(os.environ.get('PDF_EXTRACTION_MAX_PAGES', '300'))
+PDF_EXTRACTION_BATCH_PAGES = 8
+# 'auto' uses the PDFium fast path (if installed) for documents with at least
+# PDF_FAST_PATH_MIN_PAGES pages; or force 'pypdf2' / 'pdfium'
+PDF_EXTRACTION_BACKEND = os.environ.get('PDF_EXTRACTION_BACKEND', 'auto')
+PDF_FAST_PATH_MIN_PAGES = int(os.environ.get('PDF_FAST_PATH_MIN_PAGES', '40'))
+
+# Other document types (DOCX, Markdown, HTML, CSV, text)
+DOCUMENT_EXTRACTION_MAX_CHARS = 500000  # longer documents are truncated
+CSV_EXTRACTION_MAX_ROWS = 2000
+# Largest word/document.xml a DOCX may inflate to; bigger ones are refused unread
+DOCX_MAX_XML_BYTES = int(os.environ.get('DOCX_MAX_XML_BYTES', str(50 * 1024 * 1024)))
+
+# Long documents are split into chunks of about DOCUMENT_CHUNK_CHARS and only
+# the chunks most relevant to the question (BM25) are forwarded to the AI
+# engine, up to DOCUMENT_CONTEXT_MAX_TOKENS (estimated at 4 characters a token)
+DOCUMENT_CONTEXT_MAX_TOKENS = int(os.environ.get('DOCUMENT_CONTEXT_MAX_TOKENS', '6000'))
+# Follow-up questions about documents uploaded earlier in the chat session get
+# a much smaller budget, as they are added to every such message
+DOCUMENT_FOLLOWUP_MAX_TOKENS = int(os.environ.get('DOCUMENT_FOLLOWUP_MAX_TOKENS', '1000'))
+DOCUMENT_CHUNK_CHARS = int(os.environ.get('DOCUMENT_CHUNK_CHARS', '1500'))
+
+# Signed-in learners' documents stay searchable across chat turns
+DOCUMENT_INDEX_PATH = os.environ.get('DOCUMENT_INDEX_PATH', str(BASE_DIR / '.cache' / 'document_index.sqlite3'))
+DOCUMENT_INDEX_MAX_AGE_DAYS = int(os.environ.get('DOCUMENT_INDEX_MAX_AGE_DAYS', '30'))
+DOCUMENT_INDEX_MAX_BYTES_PER_USER = int(os.environ.get('DOCUMENT_INDEX_MAX_BYTES_PER_USER', str(20 * 1024 * 1024)))
+
+# Content-addressed cache of extracted document text
+DOCUMENT_CACHE_DIR = os.environ.get('DOCUMENT_CACHE_DIR', str(BASE_DIR / '.cache' / 'documents'))
+DOCUMENT_CACHE_MEMORY_BYTES = int(os.environ.get('DOCUMENT_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+DOCUMENT_CACHE_DISK_BYTES = int(os.environ.get('DOCUMENT_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+
+# Metrics (Prometheus text format) at /metrics/: staff users, or scrapers
+# sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Event loop watchdog (opt-in): records scheduling lag every
+# LOOP_MONITOR_INTERVAL seconds and logs the stack of any callback that holds
+# the loop for longer than LOOP_MONITOR_SLOW_SECONDS
+LOOP_MONITOR = os.environ.get('LOOP_MONITOR', '').lower() in ('1', 'true', 'yes')
+LOOP_MONITOR_INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', '0.1'))
+LOOP_MONITOR_SLOW_SECONDS = float(os.environ.get('LOOP_MONITOR_SLOW_SECONDS', '0.25'))
+LOOP_MONITOR_WINDOW = 600  # lag samples kept for the rolling distribution
+
+# Logging: the chat path logs through 'miva.*' loggers. Each INFO message
+# template is capped at LOG_PER_SECOND records a second (plus a random
+# LOG_SAMPLE_RATE of the rest); warnings and errors are never dropped.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'miva.log.SamplingFilter',
+            'per_second': int(os.environ.get('LOG_PER_SECOND', '5')),
+            'sample_rate': float(os.environ.get('LOG_SAMPLE_RATE', '0')),
+        },
+    },
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'miva': {
+            'handlers': ['console'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
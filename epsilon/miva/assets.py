@@ -0,0 +1,213 @@
+"""
+Per-page JS/CSS bundles for the static files in assets/.
+
+Each bundle in BUNDLES concatenates and minifies the source files a page
+needs, so a page loads one stylesheet and one script. Templates refer to
+them as ``{% static 'bundles/<name>' %}``; BundleFinder builds them on
+demand (into ASSET_BUNDLE_DIR), so they work under ``runserver`` with no
+build step and are picked up by ``collectstatic``.
+
+``manage.py build_assets`` runs collectstatic with whitenoise's manifest
+storage, which gives every file a content-hashed name and writes gzip (and,
+with the Brotli package, brotli) siblings; whitenoise serves the hashed names
+with far-future immutable caching.
+
+The minifiers are deliberately conservative: comments and indentation go,
+strings, regular expressions and line breaks in JS stay as they are, so
+automatic semicolon insertion never changes meaning.
+"""
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.files.storage import FileSystemStorage
+
+
+BUNDLE_PREFIX = 'bundles'
+
+# Bundle name -> source files in assets/, in load order
+BUNDLES = {
+    'site.css': ['styles.css'],
+    'adventure.css': ['styles.css', 'adventure.css'],
+    'app.js': ['personas.js', 'app.js'],
+    'student.js': ['personas.js', 'app.js', 'persona-detection.js'],
+    'micro-lesson.js': ['personas.js', 'app.js', 'micro-lesson.js'],
+    'adult.js': ['personas.js', 'adult-detection.js'],
+    'path.js': ['personas.js', 'path.js'],
+    'persona-dashboard.js': ['personas.js', 'persona-detection.js'],
+}
+
+# A '/' after one of these (or at the start) begins a regex, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'delete', 'void', 'throw', 'new')
+
+
+def minify_js(source):
+    """Drop comments, indentation, trailing spaces and blank lines from JS."""
+    out = []
+    i = 0
+    length = len(source)
+    at_line_start = True
+
+    def last_significant():
+        return ''.join(out[-12:]).rstrip()
+
+    while i < length:
+        char = source[i]
+        if char == '\n':
+            while out and out[-1] in (' ', '\t'):
+                out.pop()
+            if not at_line_start:
+                out.append('\n')
+            at_line_start = True
+            i += 1
+            continue
+        if char in ' \t\r':
+            if not at_line_start and out and out[-1] not in (' ', '\t'):
+                out.append(' ')
+            i += 1
+            continue
+        if char == '/' and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = length if end == -1 else end
+            continue
+        if char == '/' and source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            if '\n' in source[i:end] and not at_line_start:
+                # A line break where automatic semicolon insertion may need one
+                out.append('\n')
+                at_line_start = True
+            elif not at_line_start and out[-1] not in (' ', '\t'):
+                out.append(' ')  # keep the tokens on either side apart
+            i = end
+            continue
+
+        at_line_start = False
+        if char in '\'"`':
+            end = _string_end(source, i, char)
+            out.append(source[i:end])
+            i = end
+            continue
+        if char == '/':
+            previous = last_significant()
+            if not previous or previous[-1] in REGEX_PRECEDERS or re.search(
+                r'(?:^|[^\w$])(?:%s)$' % '|'.join(REGEX_KEYWORDS), previous
+            ):
+                end = _regex_end(source, i)
+                out.append(source[i:end])
+                i = end
+                continue
+        out.append(char)
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def _string_end(source, start, quote):
+    i = start + 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+            continue
+        if source[i] == quote:
+            return i + 1
+        if source[i] == '\n' and quote != '`':
+            return i
+        i += 1
+    return len(source)
+
+
+def _regex_end(source, start):
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            return i
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            while i < len(source) and (source[i].isalnum() or source[i] == '_'):
+                i += 1  # flags
+            return i
+        i += 1
+    return len(source)
+
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(source):
+    """Drop comments and collapse whitespace in CSS (strings are kept as they are)."""
+    parts = CSS_STRING.split(source)
+    for index in range(0, len(parts), 2):
+        code = CSS_COMMENT.sub('', parts[index])
+        code = CSS_SPACE.sub(' ', code)
+        code = CSS_PUNCTUATION.sub(r'\1', code)
+        code = code.replace(': ', ':').replace(';}', '}')
+        parts[index] = code
+    return ''.join(parts).strip() + '\n'
+
+
+def source_path(name):
+    return Path(settings.ASSET_SOURCE_DIR) / name
+
+
+def bundle_source(name):
+    """The unminified concatenation of a bundle's files."""
+    texts = [source_path(part).read_text(encoding='utf-8') for part in BUNDLES[name]]
+    if name.endswith('.js'):
+        # A file ending without a semicolon must not run into the next one
+        return ';\n'.join(text.rstrip() for text in texts) + '\n'
+    return '\n'.join(texts)
+
+
+def build_bundle(name, directory=None):
+    """Write the minified bundle (if any source changed) and return its path."""
+    directory = Path(directory or settings.ASSET_BUNDLE_DIR)
+    target = directory / name
+    sources = [source_path(part) for part in BUNDLES[name]]
+    if target.exists() and target.stat().st_mtime >= max(path.stat().st_mtime for path in sources):
+        return str(target)
+    text = bundle_source(name)
+    text = minify_js(text) if name.endswith('.js') else minify_css(text)
+    directory.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(f'.{name}.{os.getpid()}.tmp')
+    partial.write_text(text, encoding='utf-8')
+    os.replace(partial, target)
+    return str(target)
+
+
+class BundleFinder(BaseFinder):
+    """Static files finder that serves BUNDLES as ``bundles/<name>``, building them as needed."""
+
+    def __init__(self, app_names=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage = FileSystemStorage(location=settings.ASSET_BUNDLE_DIR)
+        self.storage.prefix = BUNDLE_PREFIX
+
+    def check(self, **kwargs):
+        return []
+
+    def find(self, path, find_all=False, **kwargs):
+        prefix, _, name = path.partition('/')
+        if prefix != BUNDLE_PREFIX or name not in BUNDLES:
+            return [] if find_all else None
+        built = build_bundle(name)
+        return [built] if find_all else built
+
+    def list(self, ignore_patterns):
+        for name in BUNDLES:
+            build_bundle(name)
+            yield name, self.storage
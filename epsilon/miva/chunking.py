@@ -0,0 +1,244 @@
+"""
+Chunking and relevance selection for uploaded documents.
+
+Forwarding a whole book to the AI engine makes one huge frame that is slow to
+send and gets truncated by the model anyway. Instead the extracted text is
+split into chunks on page and paragraph boundaries, the chunks are ranked
+against the learner's question with BM25, and only the best ones that fit a
+token budget are forwarded, in document order with page markers kept::
+
+    [Showing 12 of 340 sections of this document, chosen for relevance to the question]
+    --- Page 4 ---
+    ...
+    [...]
+    --- Page 17 ---
+    ...
+
+Documents that already fit the budget are forwarded unchanged.
+"""
+import math
+import re
+from collections import Counter, namedtuple
+
+from django.conf import settings
+
+from . import metrics
+
+
+# Rough size of a token for English text; only used to apply the budget
+CHARS_PER_TOKEN = 4
+
+PAGE_MARKER = re.compile(r'^--- Page (\d+)(?:: [^\n]*)? ---$', re.M)
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r'\w+', re.U)
+
+# Words that say nothing about which part of a document a question is about,
+# including the boilerplate the chat page sends with an attachment
+STOPWORDS = frozenset('''
+    a about above after again all also am an and any are as at be because been before
+    being below between both but by can could did do does doing down during each few
+    for from further had has have having he her here hers him his how i if in into is
+    it its itself just me more most my no nor not now of off on once only or other our
+    out over own same she should so some such than that the their them then there these
+    they this those through to too under until up very was we were what when where
+    which while who whom why will with would you your yours
+    please read analyze analyse help understand content document file pdf text tell
+    explain give summarize summarise
+'''.split())
+
+Chunk = namedtuple('Chunk', ['index', 'page', 'text'])
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def tokenize(text):
+    return [word for word in WORD.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+def _pages(text):
+    """Yield ``(page number or None, text)`` for each page marker section."""
+    matches = list(PAGE_MARKER.finditer(text))
+    if not matches:
+        yield None, text
+        return
+    if text[:matches[0].start()].strip():
+        yield None, text[:matches[0].start()]
+    for current, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following is not None else len(text)
+        yield int(current.group(1)), text[current.end():end]
+
+
+def _pieces(paragraph, max_chars):
+    """Split an over-long paragraph on sentences, then hard at ``max_chars``."""
+    piece = ''
+    for sentence in SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            if piece:
+                yield piece
+                piece = ''
+            yield sentence[:max_chars]
+            sentence = sentence[max_chars:]
+        if piece and len(piece) + len(sentence) + 1 > max_chars:
+            yield piece
+            piece = ''
+        piece = f'{piece} {sentence}' if piece else sentence
+    if piece:
+        yield piece
+
+
+def split(text, chunk_chars=1500):
+    """
+    Split extracted text into chunks of roughly ``chunk_chars`` characters.
+    Chunks never span a page marker; paragraphs are kept whole where they fit.
+    """
+    chunks = []
+    for page, page_text in _pages(text):
+        current = []
+        size = 0
+        for paragraph in PARAGRAPH_BREAK.split(page_text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            for piece in _pieces(paragraph, chunk_chars):
+                if current and size + len(piece) > chunk_chars:
+                    chunks.append(Chunk(len(chunks), page, '\n\n'.join(current)))
+                    current = []
+                    size = 0
+                current.append(piece)
+                size += len(piece) + 2
+        if current:
+            chunks.append(Chunk(len(chunks), page, '\n\n'.join(current)))
+    return chunks
+
+
+class BM25Index:
+    """Okapi BM25 over a list of chunks, built in memory for one message."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        self.document_frequency = Counter()
+        for counts in self.term_counts:
+            self.document_frequency.update(counts.keys())
+
+    def idf(self, term):
+        total = len(self.term_counts)
+        frequency = self.document_frequency.get(term, 0)
+        return math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+    def scores(self, query):
+        """BM25 score of every chunk for ``query``, in chunk order."""
+        terms = {term: self.idf(term) for term in set(tokenize(query)) if term in self.document_frequency}
+        scores = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            score = 0.0
+            for term, idf in terms.items():
+                frequency = counts.get(term, 0)
+                if frequency:
+                    score += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+
+def select(chunks, query, max_tokens):
+    """
+    The chunks to forward for ``query``: the highest scoring ones that fit in
+    ``max_tokens``, returned in document order. With no usable query terms
+    the document is read from the start.
+    """
+    scores = BM25Index(chunks).scores(query)
+    # Best score first; ties (including "no match at all") keep document order
+    ranked = sorted(chunks, key=lambda chunk: (-scores[chunk.index], chunk.index))
+    chosen = []
+    budget = max_tokens
+    for chunk in ranked:
+        cost = estimate_tokens(chunk.text)
+        if cost <= budget:
+            chosen.append(chunk)
+            budget -= cost
+        if budget <= 0:
+            break
+    return sorted(chosen, key=lambda chunk: chunk.index)
+
+
+def render(chosen, header):
+    """Join selected chunks under ``header``, with page markers and a [...] wherever text was skipped."""
+    parts = [header]
+    previous = None
+    for chunk in chosen:
+        if previous is not None and chunk.index != previous.index + 1:
+            parts.append('[...]')
+        if chunk.page is not None and (previous is None or chunk.page != previous.page):
+            parts.append(f'--- Page {chunk.page} ---')
+        parts.append(chunk.text)
+        previous = chunk
+    return '\n'.join(parts)
+
+
+class ContextSelector:
+    """
+    Trims extracted document text to the parts relevant to a question, and
+    counts how much it saved (per message in metrics.DOCUMENT_BYTES_SAVED).
+    """
+
+    def __init__(self, max_tokens=6000, chunk_chars=1500):
+        self.max_tokens = max_tokens
+        self.chunk_chars = chunk_chars
+
+        self.messages = 0
+        self.trimmed_messages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def select(self, text, question):
+        """Return the document text to forward with ``question``."""
+        result = text
+        if estimate_tokens(text) > self.max_tokens:
+            chunks = split(text, self.chunk_chars)
+            if chunks:
+                chosen = select(chunks, question, self.max_tokens)
+                result = render(chosen, (
+                    f'[Showing {len(chosen)} of {len(chunks)} sections of this document, '
+                    'chosen for relevance to the question]'
+                ))
+                self.trimmed_messages += 1
+
+        size_in = len(text.encode('utf-8'))
+        size_out = len(result.encode('utf-8'))
+        self.messages += 1
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+        metrics.DOCUMENT_BYTES_SAVED.observe(size_in - size_out)
+        return result
+
+    def stats(self):
+        """Messages seen and trimmed, and bytes of document text saved."""
+        return {
+            'messages': self.messages,
+            'trimmed_messages': self.trimmed_messages,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'max_tokens': self.max_tokens,
+        }
+
+
+_selector = None
+
+
+def get_selector():
+    """Return the process-wide ContextSelector, creating it from settings."""
+    global _selector
+    if _selector is None:
+        _selector = ContextSelector(
+            max_tokens=settings.DOCUMENT_CONTEXT_MAX_TOKENS,
+            chunk_chars=settings.DOCUMENT_CHUNK_CHARS,
+        )
+    return _selector
@@ -0,0 +1,198 @@
+"""
+JSON codec for WebSocket frames.
+
+Every frame the chat path handles is JSON: browser messages, replies relayed
+from the AI engine, the session replay log and upload headers. ``loads`` and
+``dumps`` use the fastest library installed (orjson, then msgspec, then the
+standard library; CHAT_JSON_CODEC picks one explicitly) and always take and
+return ``str``, so callers don't care which one is in use.
+
+Frames from the browser are decoded with ``decode_frame``, which checks them
+against the schemas below and returns ``(kind, data)``::
+
+    ping    {"type": "ping"}                                   keepalive
+    chat    {"type": "chat", "message": ..., "documents": [...]}
+    file    {"message": ..., "file": {"name", "type", "content"}}  inline base64 upload
+    error   {"error": ...}                                     sent to the browser only
+
+Fields not named in a schema are passed through untouched.
+"""
+import json
+from collections import namedtuple
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # optional: fastest encoder/decoder
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # optional
+    msgspec = None
+
+
+class FrameError(ValueError):
+    """Raised when a frame is not valid JSON or does not match its schema."""
+
+
+Codec = namedtuple('Codec', ['name', 'loads', 'dumps'])
+
+
+def _stdlib_codec():
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    return Codec('json', json.loads, encoder.encode)
+
+
+def _orjson_codec():
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    return Codec('orjson', orjson.loads, dumps)
+
+
+def _msgspec_codec():
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def loads(text):
+        try:
+            return decoder.decode(text)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from None
+
+    def dumps(obj):
+        return encoder.encode(obj).decode('utf-8')
+    return Codec('msgspec', loads, dumps)
+
+
+def available_codecs():
+    """Every codec that can be used here, fastest first."""
+    codecs = []
+    if orjson is not None:
+        codecs.append(_orjson_codec())
+    if msgspec is not None:
+        codecs.append(_msgspec_codec())
+    codecs.append(_stdlib_codec())
+    return codecs
+
+
+_codec = None
+
+
+def get_codec():
+    """Return the process-wide codec chosen by CHAT_JSON_CODEC ('auto' for the fastest installed)."""
+    global _codec
+    if _codec is None:
+        choice = settings.CHAT_JSON_CODEC
+        codecs = available_codecs()
+        if choice == 'auto':
+            _codec = codecs[0]
+        else:
+            matching = [codec for codec in codecs if codec.name == choice]
+            if not matching:
+                raise ImportError(f'CHAT_JSON_CODEC={choice!r} is not installed')
+            _codec = matching[0]
+    return _codec
+
+
+def loads(text):
+    """Decode JSON text (``str`` or ``bytes``); raises ValueError when malformed."""
+    return get_codec().loads(text)
+
+
+def dumps(obj):
+    """Encode ``obj`` as compact JSON ``str``."""
+    return get_codec().dumps(obj)
+
+
+# -- Browser frame schemas ----------------------------------------------
+
+Field = namedtuple('Field', ['name', 'types', 'required'])
+
+OPTIONAL_ID = (str, int, type(None))
+
+SCHEMAS = {
+    'ping': (),
+    'chat': (
+        Field('message', str, True),
+        Field('unique_id', OPTIONAL_ID, False),
+        Field('documents', (list, type(None)), False),
+    ),
+    'file': (
+        Field('message', str, False),
+        Field('unique_id', OPTIONAL_ID, False),
+        Field('file', dict, True),
+    ),
+    'error': (
+        Field('error', str, True),
+    ),
+}
+
+FILE_FIELDS = (
+    Field('name', str, False),
+    Field('type', str, False),
+    Field('content', str, True),
+)
+
+# Kinds the browser may send (error frames only ever go the other way)
+INBOUND_KINDS = ('ping', 'chat', 'file')
+
+# Longest frame treated as a possible keepalive by is_ping
+PING_MAX_BYTES = 64
+
+
+def _check(kind, data, fields):
+    for field in fields:
+        if field.name not in data:
+            if field.required:
+                raise FrameError(f'{kind} frame is missing {field.name!r}')
+        elif not isinstance(data[field.name], field.types):
+            raise FrameError(f'{kind} frame has an invalid {field.name!r}')
+
+
+def frame_kind(data):
+    """Which schema a decoded browser frame should match."""
+    if 'file' in data:
+        return 'file'
+    kind = data.get('type', 'chat')
+    if kind not in INBOUND_KINDS:
+        raise FrameError(f'Unknown frame type {kind!r}')
+    return kind
+
+
+def validate(data):
+    """Check a decoded browser frame against its schema; returns its kind."""
+    if not isinstance(data, dict):
+        raise FrameError('Frame must be a JSON object')
+    kind = frame_kind(data)
+    _check(kind, data, SCHEMAS[kind])
+    if kind == 'file':
+        _check('file', data['file'], FILE_FIELDS)
+    elif kind == 'chat' and data.get('documents'):
+        if not all(isinstance(document_id, (str, int)) for document_id in data['documents']):
+            raise FrameError("chat frame has an invalid 'documents'")
+    return kind
+
+
+def decode_frame(text):
+    """Decode and validate a text frame from the browser; returns ``(kind, data)``."""
+    try:
+        data = loads(text)
+    except ValueError as e:
+        raise FrameError(f'Invalid JSON: {e}') from None
+    return validate(data), data
+
+
+def is_ping(text):
+    """Cheap check for the browser's ``{"type": "ping"}`` keepalive."""
+    if len(text) > PING_MAX_BYTES or 'ping' not in text:
+        return False
+    try:
+        data = loads(text)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get('type') == 'ping' and 'file' not in data
+
+
+PONG = '{"type":"pong"}'
@@ -1,156 +1,414 @@
 """
 WebSocket consumer for handling chat messages with file uploads
 """
-import json
 import base64
 import asyncio
-import aiohttp
+import logging
+import time
+from io import BytesIO
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
 
-try:
-    import PyPDF2
-    from io import BytesIO
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
-    print("Warning: PyPDF2 not installed. PDF support disabled.")
+from . import (
+    chunking, codec, doc_cache, documents, extraction, extractors, history, loopmon, metrics, ratelimit, relay,
+    sessions, upstream, uploads,
+)
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Documents a follow-up question may draw passages from (the browser sends
+# the ones uploaded in the current chat session, newest first)
+MAX_FOLLOWUP_DOCUMENTS = 3
+
+# Text of each batch of PDF pages shown in the browser while a file is read
+FILE_PROGRESS_EXCERPT_CHARS = 300
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer that handles chat messages and file uploads.
-    Forwards messages to external AI engine at epsilonmivaaiengine.onrender.com
+    Forwards messages to the external AI engine over the shared upstream pool.
     """
     
     async def connect(self):
-        """Accept WebSocket connection"""
+        """
+        Accept WebSocket connection.
+        A browser reconnecting with ?session=<token>&last_seq=<n> resumes its
+        chat session (on this or any other worker) and is replayed every
+        frame it missed.
+        """
         await self.accept()
-        self.ai_ws = None
-        self.ai_session = None
-        self.listener_task = None
+        loopmon.ensure_started()
+        metrics.CONNECTIONS_TOTAL.inc()
+        metrics.CONNECTIONS_ACTIVE.inc()
+        with metrics.CONNECT_SECONDS.time():
+            await self.setup()
+    
+    async def setup(self):
+        """Per-socket state, session resume and the upstream client."""
+        self.socket_open = True
+        self.uploads = uploads.UploadAssembler()
+        self.relay = relay.ReplyRelay(
+            self.send_frame,
+            flush_interval=settings.CHAT_STREAM_FLUSH_INTERVAL,
+            idle_timeout=settings.CHAT_STREAM_IDLE_TIMEOUT,
+            on_finish=self.reply_finished,
+        )
+        self.reply_done = asyncio.Event()
+        self.session_group = None
+        self.profile_id, self.document_owner = await self.get_profile()
+        self.limiter = ratelimit.get_limiter()
         
-        # Connect to external AI engine
+        await self.resume_session()
+        
+        # Attach to the shared upstream pool for the external AI engine; the
+        # client reconnects on its own if the engine is down or drops us
+        self.ai = upstream.get_client(
+            self.relay.feed,
+            on_lost=self.relay.finish,
+            on_state=self.upstream_state,
+        )
+        self.ai.start()
+    
+    @database_sync_to_async
+    def get_profile(self):
+        """
+        The profile pk chat history is saved under and the unique id uploaded
+        documents are indexed under (both None for anonymous sockets).
+        """
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return None, None
+        profile, created = UserProfile.objects.get_or_create(user=user)
+        return profile.pk, str(profile.unique_id)
+    
+    def learner_key(self):
+        """
+        Who a message counts against for rate limiting: the account, or for
+        an anonymous socket its chat session and client address (never an
+        id the browser chooses, which it could change on every message).
+        """
+        if self.document_owner:
+            return f'user:{self.document_owner}'
+        client = self.scope.get('client') or ('unknown', None)
+        return (f'session:{self.session_token}', f'{ratelimit.ADDRESS_PREFIX}{client[0]}')
+    
+    async def resume_session(self):
+        """
+        Open (or resume) this socket's chat session, take it over from any
+        other socket still holding it, and replay missed frames.
+        """
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        requested = params.get('session', [None])[0]
         try:
-            self.ai_session = aiohttp.ClientSession()
-            self.ai_ws = await self.ai_session.ws_connect(
-                'wss://epsilonmivaaiengine.onrender.com/ws/chat'
-            )
-            print("Connected to AI engine WebSocket")
-            
-            # Start listening for AI responses in background
-            self.listener_task = asyncio.create_task(self.listen_to_ai())
-        except Exception as e:
-            print(f"Failed to connect to AI engine: {e}")
+            self.delivered_seq = int(params.get('last_seq', ['0'])[0])
+        except ValueError:
+            self.delivered_seq = 0
+        
+        user = self.scope.get('user')
+        owner = str(user.pk) if user is not None and user.is_authenticated else ''
+        
+        self.session_store = sessions.get_store()
+        self.session_token, resumed = await self.session_store.open(requested, owner)
+        self.session_group = f'chat-session.{self.session_token}'
+        if not resumed:
+            self.delivered_seq = 0
+        
+        if self.channel_layer is not None:
+            await self.channel_layer.group_add(self.session_group, self.channel_name)
+            if resumed:
+                await self.channel_layer.group_send(self.session_group, {
+                    'type': 'chat.takeover',
+                    'channel': self.channel_name,
+                })
+        
+        await self.send(text_data=codec.dumps({
+            'type': 'session',
+            'session': self.session_token,
+            'resumed': resumed,
+        }))
+        
+        if resumed:
+            for seq, text in await self.session_store.replay(self.session_token, self.delivered_seq):
+                await self.send(text_data=text)
+                self.delivered_seq = seq
     
     async def disconnect(self, close_code):
         """Clean up on disconnect"""
-        # Cancel listener task
-        if self.listener_task:
-            self.listener_task.cancel()
-            try:
-                await self.listener_task
-            except asyncio.CancelledError:
-                pass
+        metrics.CONNECTIONS_ACTIVE.dec()
+        self.socket_open = False
         
-        # Close WebSocket and session
-        if self.ai_ws:
-            try:
-                await self.ai_ws.close()
-            except:
-                pass
-        if self.ai_session:
-            try:
-                await self.ai_session.close()
-            except:
-                pass
+        # Drop any half-finished uploads
+        self.uploads.close()
+        
+        # Don't leave the last messages of the chat waiting for the flush timer
+        await history.get_writer().flush()
+        
+        if self.channel_layer is not None and self.session_group:
+            await self.channel_layer.group_discard(self.session_group, self.channel_name)
+        
+        # A reply that was mid-stream keeps relaying (to the replay log and to
+        # whichever socket resumes the session) for a short grace period
+        if self.relay.streaming:
+            self.reply_done.clear()
+            asyncio.create_task(self.finish_reply_then_close())
+            return
+        
+        await self.close_upstream()
+    
+    async def finish_reply_then_close(self):
+        """Wait (bounded) for the in-flight reply to finish, then release upstream."""
+        try:
+            await asyncio.wait_for(self.reply_done.wait(), settings.CHAT_RESUME_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        await self.close_upstream()
+    
+    async def close_upstream(self):
+        """Stop listening to the AI engine and release our upstream slot."""
+        await self.ai.close()
+        await self.relay.close()
+    
+    async def chat_takeover(self, event):
+        """Another socket resumed this session; step aside."""
+        if event['channel'] != self.channel_name:
+            await self.close(code=4001)
     
-    async def receive(self, text_data):
+    async def chat_frame(self, event):
+        """A reply frame relayed by the worker that used to hold this session."""
+        if event['seq'] > self.delivered_seq:
+            await self.send(text_data=event['text'])
+            self.delivered_seq = event['seq']
+    
+    async def receive(self, text_data=None, bytes_data=None):
         """
         Receive message from WebSocket.
+        Binary frames carry chunked file uploads; text frames carry chat
+        messages (optionally with a small base64 file attached).
         Process files if present, then forward to AI engine.
         """
+        if bytes_data is not None:
+            metrics.INBOUND_BYTES.observe(len(bytes_data), kind='binary')
+            with metrics.RECEIVE_SECONDS.time(kind='binary'):
+                await self.receive_upload_frame(bytes_data)
+            return
+        
+        if codec.is_ping(text_data):
+            # Keepalive: answer here rather than dispatching it as a message
+            metrics.INBOUND_BYTES.observe(len(text_data), kind='ping')
+            await self.send(text_data=codec.PONG)
+            return
+        
+        metrics.INBOUND_BYTES.observe(len(text_data), kind='text')
+        if len(text_data) > settings.CHAT_TEXT_FRAME_MAX_BYTES:
+            # Decoding a multi-megabyte frame holds the GIL, and so every other
+            # socket, however it is scheduled: files go in binary upload frames
+            metrics.ERRORS.inc(stage='receive')
+            logger.warning("Rejected a %d byte text frame", len(text_data))
+            await self.send(text_data=codec.dumps({
+                'type': 'frame_too_large',
+                'max_bytes': settings.CHAT_TEXT_FRAME_MAX_BYTES,
+                'error': 'That message is too large. Attach files with the upload button instead.',
+            }))
+            return
+        with metrics.RECEIVE_SECONDS.time(kind='text'):
+            await self.receive_message(text_data)
+    
+    async def receive_message(self, text_data):
+        """Handle one text frame: a chat message, possibly with a base64 file."""
         try:
-            data = json.loads(text_data)
+            kind, data = codec.decode_frame(text_data)
+            if kind == 'ping':
+                await self.send(text_data=codec.PONG)
+                return
             message = data.get('message', '')
             unique_id = data.get('unique_id', None)
             file_data = data.get('file', None)
             
             # Validate message
             if not message and not file_data:
-                print("No message or file provided")
+                logger.info("No message or file provided")
                 return
             
+            learner = self.learner_key()
+            await self.limiter.take(learner, 'messages')
+            if file_data:
+                # Size of the decoded file, from its base64 length
+                await self.limiter.take(learner, 'upload_bytes', len(file_data['content']) * 3 // 4)
+            
+            self.save_user_message(message, file_data.get('name') if file_data else None)
+            
             # Process file if present
             if file_data:
-                print(f"Processing file: {file_data.get('name', 'unknown')}")
-                processed_message = await self.process_file(file_data, message)
+                logger.info("Processing file: %s", file_data.get('name', 'unknown'))
+                processed_message = await self.process_file(file_data, message, learner)
                 
                 # Send processed message to AI engine
-                if self.ai_ws:
-                    try:
-                        await self.ai_ws.send_json({
-                            'message': processed_message,
-                            'type': 'chat',
-                            'unique_id': unique_id
-                        })
-                        print("Forwarded message to AI engine")
-                    except Exception as e:
-                        print(f"Error sending to AI: {e}")
-                        await self.send(text_data=json.dumps({
-                            'error': 'Failed to send message to AI'
-                        }))
-                else:
-                    await self.send(text_data=json.dumps({
-                        'error': 'AI engine not connected'
-                    }))
+                await self.send_to_ai({
+                    'message': processed_message,
+                    'type': 'chat',
+                    'unique_id': unique_id
+                })
             else:
-                # No file, just forward message to AI engine
-                if self.ai_ws:
-                    try:
-                        await self.ai_ws.send_json(data)
-                        print("Forwarded text message to AI engine")
-                    except Exception as e:
-                        print(f"Error sending to AI: {e}")
-                        await self.send(text_data=json.dumps({
-                            'error': 'Failed to send message to AI'
-                        }))
-                else:
-                    await self.send(text_data=json.dumps({
-                        'error': 'AI engine not connected'
-                    }))
+                # No file; pull passages from documents uploaded earlier
+                document_ids = data.pop('documents', None)
+                if document_ids and message:
+                    data['message'] = await self.add_document_passages(message, document_ids)
+                await self.send_to_ai(data)
                     
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
-        except Exception as e:
-            print(f"Error in receive: {e}")
+        except codec.FrameError as e:
+            metrics.ERRORS.inc(stage='receive')
+            logger.warning("Rejected frame: %s", e)
+        except ratelimit.RateLimited as e:
+            logger.info("Rate limited (%s)", e.budget)
+            await self.send(text_data=codec.dumps(e.frame()))
+        except Exception:
+            metrics.ERRORS.inc(stage='receive')
+            logger.exception("Error in receive")
     
-    async def listen_to_ai(self):
+    async def receive_upload_frame(self, bytes_data):
         """
-        Listen for messages from AI engine and forward to client.
-        Runs in background task.
+        Handle one binary frame of a chunked upload. Every chunk is
+        acknowledged with the number of bytes received so far; the browser
+        keeps only a small window of unacknowledged chunks in flight.
         """
+        upload_id = op = None
         try:
-            async for msg in self.ai_ws:
-                if msg.type == aiohttp.WSMsgType.TEXT:
-                    # Forward AI response to client
-                    await self.send(text_data=msg.data)
-                elif msg.type == aiohttp.WSMsgType.ERROR:
-                    print(f'AI WebSocket error: {self.ai_ws.exception()}')
-                    break
-                elif msg.type == aiohttp.WSMsgType.CLOSED:
-                    print('AI WebSocket closed')
-                    break
-        except asyncio.CancelledError:
-            # Task was cancelled, clean exit
-            pass
+            header, payload = uploads.parse_frame(bytes_data)
+            upload_id = header['id']
+            op = header.get('op')
+            
+            if op == 'start':
+                upload = self.uploads.start(header)
+                try:
+                    await self.limiter.take(self.learner_key(), 'upload_bytes', upload.size)
+                except ratelimit.RateLimited:
+                    self.uploads.abort(upload_id)
+                    raise
+                logger.info("Receiving file: %s (%d bytes)", upload.name, upload.size)
+                await self.send(text_data=codec.dumps({
+                    'type': 'upload_ready',
+                    'id': upload_id,
+                    'chunk_size': self.uploads.chunk_bytes,
+                    'window': settings.CHAT_UPLOAD_WINDOW,
+                }))
+            elif op == 'chunk':
+                received = self.uploads.write(header, payload)
+                await self.send(text_data=codec.dumps({
+                    'type': 'upload_ack',
+                    'id': upload_id,
+                    'offset': received,
+                }))
+            elif op == 'end':
+                upload = self.uploads.finish(header)
+                try:
+                    learner = self.learner_key()
+                    await self.limiter.take(learner, 'messages')
+                    self.save_user_message(header.get('message', ''), upload.name)
+                    processed_message = await self.process_upload(
+                        upload.name, upload.mime, upload.file, header.get('message', ''),
+                        digest=upload.digest, learner=learner
+                    )
+                finally:
+                    upload.close()
+                await self.send_to_ai({
+                    'message': processed_message,
+                    'type': 'chat',
+                    'unique_id': header.get('unique_id')
+                })
+            elif op == 'abort':
+                self.uploads.abort(upload_id)
+            else:
+                raise uploads.UploadError(f'Unknown upload op: {op!r}', upload_id)
+        
+        except ratelimit.RateLimited as e:
+            logger.info("Rate limited (%s)", e.budget)
+            if op == 'start':
+                # Fail the browser's pending upload with the reason
+                await self.send(text_data=codec.dumps({'type': 'upload_error', 'id': upload_id, 'error': str(e)}))
+            else:
+                await self.send(text_data=codec.dumps(e.frame()))
+        except uploads.UploadError as e:
+            metrics.ERRORS.inc(stage='upload')
+            logger.warning("Upload error: %s", e)
+            await self.send(text_data=codec.dumps({
+                'type': 'upload_error',
+                'id': e.upload_id or upload_id,
+                'error': str(e),
+            }))
+        except Exception:
+            metrics.ERRORS.inc(stage='upload')
+            logger.exception("Error in upload")
+    
+    async def send_frame(self, frame):
+        """
+        Number a reply frame, add it to the session's replay log and send it
+        to the browser (or, if our socket has gone, to whichever socket has
+        resumed the session).
+        """
+        try:
+            seq = await self.session_store.next_seq(self.session_token)
+            frame['seq'] = seq
+            text = codec.dumps(frame)
+            await self.session_store.append(self.session_token, seq, text)
         except Exception as e:
-            print(f"Error in AI listener: {e}")
+            logger.warning("Session store unavailable: %s", e)
+            seq, text = None, codec.dumps(frame)
+        
+        if self.socket_open:
+            await self.send(text_data=text)
+            if seq is not None:
+                self.delivered_seq = seq
+        elif seq is not None and self.channel_layer is not None:
+            await self.channel_layer.group_send(self.session_group, {
+                'type': 'chat.frame',
+                'seq': seq,
+                'text': text,
+            })
+    
+    async def reply_finished(self, message_id, text):
+        """Called by the relay each time a reply is done."""
+        self.reply_done.set()
+        history.get_writer().add(self.profile_id, 'assistant', text)
+    
+    def save_user_message(self, message, file_name=None):
+        """Queue the learner's message for the chat history (written in batches)."""
+        if file_name:
+            message = f"{message}\n\n[Attached file: {file_name}]".strip()
+        history.get_writer().add(self.profile_id, 'user', message)
+    
+    async def send_to_ai(self, payload):
+        """
+        Forward a frame to the AI engine (queued while it reconnects),
+        telling the client if we can't.
+        """
+        try:
+            if await self.ai.send_json(payload):
+                logger.info("Forwarded message to AI engine")
+            else:
+                logger.info("AI engine reconnecting; message queued")
+        except upstream.UpstreamUnavailable as e:
+            metrics.ERRORS.inc(stage='upstream_send')
+            logger.warning("Error sending to AI: %s", e)
+            await self.send(text_data=codec.dumps({
+                'error': 'AI engine not connected'
+            }))
     
-    async def process_file(self, file_data, user_message):
+    async def upstream_state(self, state):
+        """Tell the browser when the AI engine link drops and comes back."""
+        if self.socket_open:
+            await self.send(text_data=codec.dumps({
+                'type': 'upstream',
+                'state': state,
+            }))
+    
+    async def process_file(self, file_data, user_message, learner=None):
         """
-        Process uploaded file and extract text content.
+        Process a file sent inline as base64 in a JSON frame.
         Returns a combined message with file content.
         """
         file_name = file_data.get('name', 'unknown')
@@ -158,53 +416,168 @@ class ChatConsumer(AsyncWebsocketConsumer):
         base64_content = file_data.get('content', '')
         
         try:
-            # Decode base64 content
+            # Small: the whole frame was at most CHAT_TEXT_FRAME_MAX_BYTES
             file_bytes = base64.b64decode(base64_content)
-            
-            # Process based on file type
-            if file_type == 'application/pdf':
-                text_content = await self.extract_pdf_text(file_bytes, file_name)
-            elif file_type == 'text/plain':
-                text_content = file_bytes.decode('utf-8', errors='ignore')
+        except Exception as e:
+            logger.exception("Error processing file %s", file_name)
+            return f"{user_message}\n\n[Error processing file: {str(e)}]"
+        
+        return await self.process_upload(file_name, file_type, BytesIO(file_bytes), user_message, learner=learner)
+    
+    async def process_upload(self, file_name, file_type, file_obj, user_message, digest=None, learner=None):
+        """
+        Extract text content from an uploaded file object.
+        Extracted text is cached by content hash, so a repeat upload of the
+        same document skips parsing entirely. Long documents are trimmed to
+        the passages most relevant to the user's message. Extraction time is
+        charged to ``learner``'s extraction budget; RateLimited is raised if
+        it is already spent.
+        Returns a combined message with file content.
+        """
+        started = time.perf_counter()
+        kind = None
+        try:
+            kind = await asyncio.to_thread(extractors.detect, file_obj, file_type, file_name)
+            size = file_obj.seek(0, 2)
+            file_obj.seek(0)
+            metrics.FILE_BYTES.observe(size, kind=kind or 'unsupported')
+            if kind is not None:
+                if digest is None:
+                    digest = await asyncio.to_thread(doc_cache.file_digest, file_obj)
+                cache = doc_cache.get_cache()
+                key = doc_cache.cache_key(digest, kind)
+                
+                text_content = await cache.get(key)
+                if text_content is None:
+                    learner = learner or self.learner_key()
+                    await self.limiter.take(learner, 'extraction_seconds', 0)
+                    extract_started = time.perf_counter()
+                    try:
+                        # PDFs stream page by page from the process pool; other
+                        # formats are small enough to parse in a thread
+                        if kind == 'pdf':
+                            text_content, complete = await self.extract_pdf_text(file_obj, file_name)
+                        else:
+                            text_content = await asyncio.to_thread(extractors.extract, kind, file_obj)
+                            complete = True
+                    finally:
+                        await self.limiter.charge(
+                            learner, 'extraction_seconds', time.perf_counter() - extract_started
+                        )
+                    if complete:
+                        await cache.put(key, text_content)
+                else:
+                    complete = True
+                    logger.info("Using cached text for %s", file_name)
+                if complete:
+                    await self.index_document(file_name, digest, text_content)
+                
+                # Forward only the passages relevant to the question
+                selected = await asyncio.to_thread(chunking.get_selector().select, text_content, user_message)
+                if len(selected) < len(text_content):
+                    logger.info("Trimmed %s from %d to %d characters", file_name, len(text_content), len(selected))
+                text_content = selected
             else:
-                text_content = f"[Unsupported file type: {file_type}]"
+                text_content = f"[Unsupported file type: {file_type or file_name}]"
             
             # Combine user message with file content
             combined_message = f"{user_message}\n\n--- File Content: {file_name} ---\n{text_content}\n--- End of File ---"
             
             return combined_message
             
+        except ratelimit.RateLimited:
+            raise
         except Exception as e:
-            print(f"Error processing file {file_name}: {e}")
+            metrics.ERRORS.inc(stage='file')
+            logger.exception("Error processing file %s", file_name)
             return f"{user_message}\n\n[Error processing file: {str(e)}]"
+        finally:
+            metrics.FILE_SECONDS.observe(time.perf_counter() - started, kind=kind or 'unsupported')
     
-    async def extract_pdf_text(self, file_bytes, file_name):
+    async def index_document(self, file_name, digest, text_content):
         """
-        Extract text from PDF file using PyPDF2.
+        Register an uploaded document in the learner's document index so
+        follow-up questions can use it, and tell the browser its id.
         """
-        if not PDF_SUPPORT:
-            return "[PDF processing not available - PyPDF2 not installed]"
-        
+        if self.document_owner is None:
+            return
         try:
-            # Run PDF extraction in thread pool to avoid blocking
-            return await asyncio.to_thread(self._extract_pdf_sync, file_bytes)
-        except Exception as e:
-            print(f"Error extracting PDF text from {file_name}: {e}")
-            return f"[Error extracting PDF text: {str(e)}]"
+            document_id = await asyncio.to_thread(
+                documents.get_index().add, self.document_owner, file_name, digest, text_content
+            )
+        except Exception:
+            logger.exception("Error indexing %s", file_name)
+            return
+        await self.send(text_data=codec.dumps({
+            'type': 'document',
+            'id': document_id,
+            'name': file_name,
+        }))
     
-    def _extract_pdf_sync(self, file_bytes):
+    async def add_document_passages(self, message, document_ids):
+        """
+        Append the passages of documents uploaded earlier in this chat
+        session that are relevant to ``message``, so follow-ups need no
+        re-upload. Only the learner's own documents are searched, the last
+        MAX_FOLLOWUP_DOCUMENTS named, within DOCUMENT_FOLLOWUP_MAX_TOKENS.
         """
-        Synchronous PDF text extraction (runs in thread pool).
+        if self.document_owner is None or not isinstance(document_ids, list):
+            return message
+        try:
+            found = await asyncio.to_thread(
+                documents.get_index().search, self.document_owner, document_ids[:MAX_FOLLOWUP_DOCUMENTS], message,
+                settings.DOCUMENT_FOLLOWUP_MAX_TOKENS
+            )
+        except Exception:
+            logger.exception("Document index unavailable")
+            return message
+        for name, chunks in found:
+            passages = chunking.render(chunks, f"--- Relevant passages: {name} ---")
+            message = f"{message}\n\n{passages}\n--- End of Passages ---"
+        return message
+    
+    async def extract_pdf_text(self, file_obj, file_name):
         """
-        pdf_file = BytesIO(file_bytes)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        Extract text from a PDF file object in the process-pool extraction
+        service, sending the client a progress frame with an excerpt of each
+        batch of pages as soon as it is read. Returns the text and whether every page was read (only
+        complete extractions are cached).
+        """
+        service = extraction.get_service()
+        parts = []
         
-        text = ""
-        for page_num, page in enumerate(pdf_reader.pages):
+        with metrics.PDF_EXTRACTION_SECONDS.time():
             try:
-                page_text = page.extract_text()
-                text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+                async for batch in service.iter_batches(file_obj):
+                    if not batch:
+                        continue
+                    text = ''.join(extraction.format_page(page) for page in batch)
+                    parts.append(text)
+                    last = batch[-1]
+                    await self.send(text_data=codec.dumps({
+                        'type': 'file_progress',
+                        'name': file_name,
+                        'page': last.number,
+                        'pages': last.total,
+                        'first_page': batch[0].number,
+                        'excerpt': text.strip()[:FILE_PROGRESS_EXCERPT_CHARS],
+                    }))
+                    
+                    if last.number == last.total and last.page_count > last.total:
+                        parts.append(
+                            f"\n[Only the first {last.total} of {last.page_count} pages were read]\n"
+                        )
+            except extraction.ExtractionBusy:
+                metrics.ERRORS.inc(stage='pdf_busy')
+                return "[The document reader is busy right now - please try again in a moment]", False
+            except extraction.ExtractionTimeout:
+                metrics.ERRORS.inc(stage='pdf_timeout')
+                logger.warning("Timed out extracting PDF text from %s", file_name)
+                parts.append("\n[Stopped reading: the document took too long to process]\n")
+                return ''.join(parts).strip(), False
             except Exception as e:
-                text += f"\n--- Page {page_num + 1}: Error extracting text ---\n"
-        
-        return text.strip()
+                metrics.ERRORS.inc(stage='pdf')
+                logger.warning("Error extracting PDF text from %s: %s", file_name, e)
+                return f"[Error extracting PDF text: {str(e)}]", False
+            
+            return ''.join(parts).strip(), True
@@ -0,0 +1,203 @@
+"""
+Content-addressed cache of extracted document text.
+
+The same worksheet PDF gets uploaded by a whole class, so extracted text is
+cached under a hash of the file's content. Lookups check an in-memory LRU
+tier (bounded by bytes) and then an on-disk tier under DOCUMENT_CACHE_DIR
+(also bounded by bytes, evicting least recently used files). A repeat
+upload skips parsing entirely.
+
+The disk tier's size and recency order are kept in memory: the directory is
+scanned once, on first use, and after that an insert or eviction touches
+only the files involved.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Bump when extraction output changes so stale entries are never served
+EXTRACTOR_VERSION = 2
+
+
+def cache_key(digest, kind):
+    """Cache key for a file's content digest and detected document kind."""
+    return hashlib.sha256(f'{EXTRACTOR_VERSION}:{kind}:{digest}'.encode()).hexdigest()
+
+
+def file_digest(file_obj):
+    """SHA-256 of a file object's content; rewinds the file afterwards."""
+    hasher = hashlib.sha256()
+    for block in iter(lambda: file_obj.read(1024 * 1024), b''):
+        hasher.update(block)
+    file_obj.seek(0)
+    return hasher.hexdigest()
+
+
+class DocumentTextCache:
+    """
+    Two-tier LRU cache mapping content keys to extracted text.
+
+    Disk reads and writes run in a thread so they never block the event loop.
+    """
+
+    def __init__(self, directory, memory_bytes, disk_bytes):
+        self.directory = Path(directory)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = None  # key -> size, least recently used first; scanned on first disk access
+        self.disk_used = 0
+        self.disk_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    def _path(self, key):
+        return self.directory / key[:2] / f'{key}.txt'
+
+    async def get(self, key):
+        """Return cached text for ``key``, or None on a miss."""
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+
+        data = await asyncio.to_thread(self._read_disk, key)
+        if data is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        text = data.decode('utf-8')
+        self._remember(key, text, len(data))
+        return text
+
+    async def put(self, key, text):
+        """Store extracted text in both tiers."""
+        data = text.encode('utf-8')
+        self._remember(key, text, len(data))
+        await asyncio.to_thread(self._write_disk, key, data)
+
+    def _remember(self, key, text, size):
+        if size > self.memory_bytes:
+            return
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_used -= previous[1]
+        self.memory[key] = (text, size)
+        self.memory_used += size
+        while self.memory_used > self.memory_bytes:
+            _, (_, evicted_size) = self.memory.popitem(last=False)
+            self.memory_used -= evicted_size
+            self.memory_evictions += 1
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        with self.disk_lock:
+            self._load_disk()
+            try:
+                data = path.read_bytes()
+            except OSError:
+                if key in self.disk:
+                    self._forget_disk(key)
+                return None
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            else:
+                # Written by another process sharing the directory
+                self.disk[key] = len(data)
+                self.disk_used += len(data)
+        try:
+            # Refresh mtime so the order survives a restart's scan
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _load_disk(self):
+        """Index the files already on disk, oldest first (once per process)."""
+        if self.disk is not None:
+            return
+        entries = []
+        if self.directory.exists():
+            for path in self.directory.glob('*/*.txt'):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+        self.disk = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.disk_used = sum(self.disk.values())
+
+    def _forget_disk(self, key):
+        self.disk_used -= self.disk.pop(key)
+
+    def _write_disk(self, key, data):
+        if len(data) > self.disk_bytes:
+            return
+        with self.disk_lock:
+            self._store_on_disk(key, data)
+
+    def _store_on_disk(self, key, data):
+        self._load_disk()
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        if key in self.disk:
+            self._forget_disk(key)
+        self.disk[key] = len(data)
+        self.disk_used += len(data)
+
+        while self.disk_used > self.disk_bytes:
+            victim = next(iter(self.disk))
+            self._forget_disk(victim)
+            try:
+                self._path(victim).unlink()
+            except OSError:
+                continue  # already gone
+            self.disk_evictions += 1
+
+    def stats(self):
+        """Hit, miss and eviction counters plus current tier sizes."""
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_evictions': self.memory_evictions,
+            'disk_evictions': self.disk_evictions,
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory_used,
+            'memory_budget_bytes': self.memory_bytes,
+            'disk_entries': len(self.disk or ()),
+            'disk_bytes': self.disk_used,
+            'disk_budget_bytes': self.disk_bytes,
+        }
+
+
+_cache = None
+
+
+def get_cache():
+    """Return the process-wide DocumentTextCache, creating it from settings."""
+    global _cache
+    if _cache is None:
+        _cache = DocumentTextCache(
+            settings.DOCUMENT_CACHE_DIR,
+            memory_bytes=settings.DOCUMENT_CACHE_MEMORY_BYTES,
+            disk_bytes=settings.DOCUMENT_CACHE_DISK_BYTES,
+        )
+    return _cache
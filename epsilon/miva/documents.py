@@ -0,0 +1,259 @@
+"""
+Per-learner index of uploaded documents, kept across chat turns.
+
+Every document a signed-in learner uploads is registered against their
+``UserProfile.unique_id`` and its chunks (see miva.chunking) are stored in
+an SQLite FTS5 index under DOCUMENT_INDEX_PATH. The browser is told the
+document's id, and later chat messages can name it so the consumer pulls the
+relevant passages from the index instead of the file being re-uploaded.
+
+The index is a separate SQLite file rather than a Django model so it works
+whichever database backs the site. Documents unused for
+DOCUMENT_INDEX_MAX_AGE_DAYS are dropped, and each learner's least recently
+used documents are dropped once their chunks exceed
+DOCUMENT_INDEX_MAX_BYTES_PER_USER.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+from . import chunking
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS documents_owner_digest ON documents (owner, digest);
+CREATE INDEX IF NOT EXISTS documents_last_used ON documents (last_used);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    document_id TEXT NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    page INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_document ON chunks (document_id, chunk_index);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5 (
+    text, content='chunks', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+'''
+
+
+def valid_document_id(document_id):
+    return isinstance(document_id, str) and len(document_id) == 32 and document_id.isalnum()
+
+
+def match_query(text):
+    """An FTS5 query matching any of the question's meaningful words."""
+    terms = dict.fromkeys(chunking.tokenize(text))
+    return ' OR '.join(f'"{term}"' for term in terms)
+
+
+class DocumentIndex:
+    """
+    SQLite FTS5 index of learners' documents.
+
+    Methods are blocking; the consumer calls them with ``asyncio.to_thread``.
+    One connection is shared under a lock, and other worker processes can
+    open the same file (WAL mode).
+    """
+
+    def __init__(self, path, max_age_days=30, max_bytes_per_user=20 * 1024 * 1024, chunk_chars=1500):
+        self.path = str(path)
+        self.max_age = max_age_days * 86400
+        self.max_bytes_per_user = max_bytes_per_user
+        self.chunk_chars = chunk_chars
+        self.lock = threading.Lock()
+        self.connection = None
+
+        self.documents_added = 0
+        self.documents_reused = 0
+        self.searches = 0
+        self.evicted_by_age = 0
+        self.evicted_by_size = 0
+
+    def _connect(self):
+        if self.connection is None:
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            connection.executescript(SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def add(self, owner, name, digest, text):
+        """
+        Index a document's text for ``owner`` and return its id. A document
+        the learner has uploaded before keeps its id and is not re-indexed.
+        """
+        now = time.time()
+        with self.lock:
+            db = self._connect()
+            with db:
+                row = db.execute(
+                    'SELECT id FROM documents WHERE owner = ? AND digest = ?', (owner, digest)
+                ).fetchone()
+                if row is not None:
+                    db.execute('UPDATE documents SET last_used = ?, name = ? WHERE id = ?', (now, name, row['id']))
+                    self.documents_reused += 1
+                    return row['id']
+
+                chunks = chunking.split(text, self.chunk_chars)
+                size = sum(len(chunk.text.encode('utf-8')) for chunk in chunks)
+                document_id = uuid.uuid4().hex
+                db.execute(
+                    'INSERT INTO documents (id, owner, name, digest, chunk_count, bytes, created_at, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (document_id, owner, name, digest, len(chunks), size, now, now),
+                )
+                db.executemany(
+                    'INSERT INTO chunks (document_id, chunk_index, page, text) VALUES (?, ?, ?, ?)',
+                    [(document_id, chunk.index, chunk.page, chunk.text) for chunk in chunks],
+                )
+                self._evict(db, owner, now)
+            self.documents_added += 1
+            return document_id
+
+    def _delete(self, db, document_ids):
+        for document_id in document_ids:
+            # Chunks go first so the trigger keeps the FTS index in step
+            db.execute('DELETE FROM chunks WHERE document_id = ?', (document_id,))
+            db.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+
+    def _evict(self, db, owner, now):
+        stale = [row['id'] for row in db.execute(
+            'SELECT id FROM documents WHERE last_used < ?', (now - self.max_age,)
+        )]
+        self._delete(db, stale)
+        self.evicted_by_age += len(stale)
+
+        rows = db.execute(
+            'SELECT id, bytes FROM documents WHERE owner = ? ORDER BY last_used DESC', (owner,)
+        ).fetchall()
+        # The newest document is always kept, however large
+        used = rows[0]['bytes'] if rows else 0
+        oversized = []
+        for row in rows[1:]:
+            used += row['bytes']
+            if used > self.max_bytes_per_user:
+                oversized.append(row['id'])
+        self._delete(db, oversized)
+        self.evicted_by_size += len(oversized)
+
+    def documents(self, owner, document_ids):
+        """``{id: name}`` for the given documents that belong to ``owner``."""
+        ids = [d for d in document_ids if valid_document_id(d)]
+        if not ids:
+            return {}
+        placeholders = ', '.join('?' * len(ids))
+        with self.lock:
+            rows = self._connect().execute(
+                f'SELECT id, name FROM documents WHERE owner = ? AND id IN ({placeholders})',
+                (owner, *ids),
+            ).fetchall()
+        return {row['id']: row['name'] for row in rows}
+
+    def search(self, owner, document_ids, question, max_tokens):
+        """
+        The chunks of ``owner``'s documents most relevant to ``question``
+        (best BM25 first) that fit in ``max_tokens``, grouped by document:
+        a list of ``(document name, [Chunk, ...])`` in document order.
+        """
+        names = self.documents(owner, document_ids)
+        query = match_query(question)
+        if not names or not query:
+            return []
+        placeholders = ', '.join('?' * len(names))
+        with self.lock:
+            db = self._connect()
+            rows = db.execute(
+                'SELECT chunks.document_id, chunks.chunk_index, chunks.page, chunks.text '
+                'FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid '
+                f'WHERE chunks_fts MATCH ? AND chunks.document_id IN ({placeholders}) '
+                'ORDER BY bm25(chunks_fts) LIMIT 200',
+                (query, *names),
+            ).fetchall()
+            with db:
+                db.execute(
+                    f'UPDATE documents SET last_used = ? WHERE id IN ({placeholders})',
+                    (time.time(), *names),
+                )
+        self.searches += 1
+
+        found = {}
+        budget = max_tokens
+        for row in rows:
+            cost = chunking.estimate_tokens(row['text'])
+            if cost > budget:
+                continue
+            budget -= cost
+            found.setdefault(row['document_id'], []).append(
+                chunking.Chunk(row['chunk_index'], row['page'], row['text'])
+            )
+        return [
+            (names[document_id], sorted(chunks, key=lambda chunk: chunk.index))
+            for document_id, chunks in found.items()
+        ]
+
+    def forget(self, owner):
+        """Drop every document belonging to ``owner``."""
+        with self.lock:
+            db = self._connect()
+            with db:
+                ids = [row['id'] for row in db.execute('SELECT id FROM documents WHERE owner = ?', (owner,))]
+                self._delete(db, ids)
+
+    def stats(self):
+        """Documents added, reused and evicted, and searches served."""
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT COUNT(*) AS documents, COALESCE(SUM(bytes), 0) AS bytes FROM documents'
+            ).fetchone()
+        return {
+            'documents': row['documents'],
+            'bytes': row['bytes'],
+            'documents_added': self.documents_added,
+            'documents_reused': self.documents_reused,
+            'searches': self.searches,
+            'evicted_by_age': self.evicted_by_age,
+            'evicted_by_size': self.evicted_by_size,
+        }
+
+
+_index = None
+
+
+def get_index():
+    """Return the process-wide DocumentIndex, creating it from settings."""
+    global _index
+    if _index is None:
+        _index = DocumentIndex(
+            settings.DOCUMENT_INDEX_PATH,
+            max_age_days=settings.DOCUMENT_INDEX_MAX_AGE_DAYS,
+            max_bytes_per_user=settings.DOCUMENT_INDEX_MAX_BYTES_PER_USER,
+            chunk_chars=settings.DOCUMENT_CHUNK_CHARS,
+        )
+    return _index
@@ -0,0 +1,427 @@
+"""
+Process-pool PDF text extraction.
+
+PyPDF2 is pure Python and holds the GIL while it parses, so running it in a
+thread still competes with the event loop that serves every other socket in
+the worker. This service runs extraction in a bounded ProcessPoolExecutor
+instead, in batches of pages, and yields page text as an async iterator so
+callers can report progress (or start using the first pages) before the last
+ones are parsed. Each worker keeps the documents it has opened, so a document
+is parsed once per worker rather than once per batch.
+
+Two text backends are supported: PyPDF2 (always available) and, when
+installed, pypdfium2, a binding to the PDFium C library that reads a page's
+text layer many times faster. With PDF_EXTRACTION_BACKEND = 'auto' the
+PDFium fast path is used for documents of PDF_FAST_PATH_MIN_PAGES pages or
+more (large textbooks), and PyPDF2 for everything else.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import aclosing
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import PyPDF2
+    PDF_SUPPORT = True
+except ImportError:
+    PDF_SUPPORT = False
+    logger.warning("PyPDF2 not installed. PDF support disabled.")
+
+try:
+    import pypdfium2
+    PDFIUM_SUPPORT = True
+except ImportError:
+    PDFIUM_SUPPORT = False
+
+
+Page = namedtuple('Page', ['number', 'text', 'total', 'page_count'])
+Page.__doc__ = """
+One extracted page. ``number`` is 1-based, ``text`` is None when the page
+could not be read, ``total`` is the number of pages that will be yielded and
+``page_count`` the number of pages in the document (larger than ``total``
+when the page cap applies).
+"""
+
+
+class ExtractionError(Exception):
+    """Base class for extraction service failures."""
+
+
+class ExtractionBusy(ExtractionError):
+    """Raised when the extraction queue is full."""
+
+
+class ExtractionTimeout(ExtractionError):
+    """Raised when a document takes longer than the per-file timeout."""
+
+
+class PyPDF2Backend:
+    """Pure-Python text extraction with PyPDF2."""
+    name = 'pypdf2'
+
+    def __init__(self, path):
+        self.reader = PyPDF2.PdfReader(path)
+
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def page_text(self, index):
+        return self.reader.pages[index].extract_text() or ''
+
+    def close(self):
+        pass
+
+
+class PDFiumBackend:
+    """Text-layer extraction with PDFium (pypdfium2); the fast path."""
+    name = 'pdfium'
+
+    def __init__(self, path):
+        self.document = pypdfium2.PdfDocument(path)
+
+    def page_count(self):
+        return len(self.document)
+
+    def page_text(self, index):
+        page = self.document[index]
+        try:
+            text_page = page.get_textpage()
+            try:
+                # PDFium ends lines with CRLF; match PyPDF2's plain newlines
+                return text_page.get_text_bounded().replace('\r\n', '\n')
+            finally:
+                text_page.close()
+        finally:
+            page.close()
+
+    def close(self):
+        self.document.close()
+
+
+BACKENDS = {
+    PyPDF2Backend.name: PyPDF2Backend,
+    PDFiumBackend.name: PDFiumBackend,
+}
+
+
+def available_backends():
+    """Names of the backends whose libraries are installed."""
+    names = []
+    if PDF_SUPPORT:
+        names.append(PyPDF2Backend.name)
+    if PDFIUM_SUPPORT:
+        names.append(PDFiumBackend.name)
+    return names
+
+
+def _extract_pages(backend, start, stop):
+    pages = []
+    for index in range(start, stop):
+        try:
+            pages.append(backend.page_text(index))
+        except Exception:
+            pages.append(None)
+    return pages
+
+
+# Documents a worker process keeps open between batches, least recently used first
+WORKER_OPEN_DOCUMENTS = 4
+_open_documents = OrderedDict()
+
+
+def _document_key(path, backend_name):
+    # The inode and mtime tell a reused temporary file name from the document it held before
+    stat = os.stat(path)
+    return path, backend_name, stat.st_ino, stat.st_mtime_ns
+
+
+def _keep_open(key, backend):
+    _open_documents[key] = backend
+    while len(_open_documents) > WORKER_OPEN_DOCUMENTS:
+        _, evicted = _open_documents.popitem(last=False)
+        evicted.close()
+
+
+def _open_document(path, backend_name):
+    """The worker's open backend for ``path``, parsing it only on first use (worker process)."""
+    key = _document_key(path, backend_name)
+    backend = _open_documents.get(key)
+    if backend is None:
+        backend = BACKENDS[backend_name](path)
+        _keep_open(key, backend)
+    else:
+        _open_documents.move_to_end(key)
+    return backend
+
+
+def _extract_range(path, start, stop, backend_name):
+    """Extract pages [start, stop) from the PDF at ``path`` (worker process)."""
+    backend = _open_document(path, backend_name)
+    return _extract_pages(backend, start, min(stop, backend.page_count()))
+
+
+def _choose_backend(path, preference, fast_path_pages):
+    """Open ``path`` with the backend named by ``preference`` ('auto' picks by size)."""
+    if preference != 'auto':
+        return BACKENDS[preference](path)
+    if PDFIUM_SUPPORT:
+        backend = PDFiumBackend(path)
+        if backend.page_count() >= fast_path_pages or not PDF_SUPPORT:
+            return backend
+        backend.close()
+    return PyPDF2Backend(path)
+
+
+def _open_and_extract(path, stop, preference='auto', fast_path_pages=0):
+    """
+    Return the page count, the backend chosen for the document and the text
+    of its first pages (worker process).
+    """
+    backend = _choose_backend(path, preference, fast_path_pages)
+    try:
+        page_count = backend.page_count()
+        pages = _extract_pages(backend, 0, min(stop, page_count))
+    except Exception:
+        backend.close()
+        raise
+    if page_count > stop:
+        # The later batches that land on this worker reuse the parsed document
+        _keep_open(_document_key(path, backend.name), backend)
+    else:
+        backend.close()
+    return page_count, backend.name, pages
+
+
+def _spool_to_path(file_obj):
+    """
+    Copy a file object to a named temporary file the worker processes can
+    open by path. Returns the path; the caller removes it.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as target:
+        shutil.copyfileobj(file_obj, target, 1024 * 1024)
+        return target.name
+
+
+class PDFExtractionService:
+    """
+    Bounded process-pool PDF extractor.
+
+    At most ``max_queue`` documents are admitted at once (further requests
+    raise ExtractionBusy), each document may take at most ``timeout`` seconds
+    and only the first ``max_pages`` pages are read. Pages are extracted in
+    batches of ``batch_pages``, with up to ``max_workers`` batches of one
+    document in flight so a large file can use the whole pool; each worker
+    parses the document once and reads its later batches from that.
+
+    A batch already running in a worker cannot be interrupted; on timeout the
+    remaining batches are cancelled and the running one finishes in the
+    background. The document keeps its place in the queue until it has, so
+    ``max_queue`` bounds the work actually in the pool.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=60.0, max_pages=300, batch_pages=8,
+                 backend='auto', fast_path_pages=40):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.batch_pages = batch_pages
+        self.backend = backend
+        self.fast_path_pages = fast_path_pages
+        self.executor = None
+        # Jobs finish on the executor's callback thread; guards both counters below
+        self.jobs_lock = threading.Lock()
+
+        self.documents = 0
+        self.queued_jobs = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.backend_documents = dict.fromkeys(BACKENDS, 0)
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn keeps worker start-up safe inside a threaded ASGI server
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self.executor
+
+    def _submit(self, jobs, fn, *args):
+        """Run ``fn(*args)`` in the pool, adding its future to ``jobs``."""
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a hostile PDF); start a fresh pool
+            self.executor = None
+            future = self._get_executor().submit(fn, *args)
+        with self.jobs_lock:
+            self.queued_jobs += 1
+        future.add_done_callback(self._job_done)
+        jobs.append(future)
+        return asyncio.wrap_future(future)
+
+    def _job_done(self, future):
+        with self.jobs_lock:
+            self.queued_jobs -= 1
+
+    def _release_when_done(self, jobs):
+        """Free a document's queue slot once none of its ``jobs`` holds a worker."""
+        running = [job for job in jobs if not job.cancel() and not job.done()]
+        remaining = len(running)
+        if not remaining:
+            with self.jobs_lock:
+                self.documents -= 1
+            return
+
+        def job_finished(future):
+            nonlocal remaining
+            with self.jobs_lock:
+                remaining -= 1
+                if remaining == 0:
+                    self.documents -= 1
+
+        for job in running:
+            job.add_done_callback(job_finished)
+
+    async def _wait(self, job, deadline):
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            raise ExtractionTimeout('PDF extraction timed out')
+        try:
+            return await asyncio.wait_for(asyncio.shield(job), remaining)
+        except asyncio.TimeoutError:
+            raise ExtractionTimeout('PDF extraction timed out')
+
+    async def iter_pages(self, file_obj):
+        """
+        Yield a Page for every page of the PDF in ``file_obj``, in order.
+        """
+        async with aclosing(self.iter_batches(file_obj)) as batches:
+            async for batch in batches:
+                for page in batch:
+                    yield page
+
+    async def iter_batches(self, file_obj):
+        """
+        Yield the Pages of the PDF in ``file_obj`` in order, a list per batch
+        as each batch is extracted.
+        """
+        if not available_backends():
+            raise ExtractionError('PDF processing not available - PyPDF2 not installed')
+        if self.backend != 'auto' and self.backend not in available_backends():
+            raise ExtractionError(f'PDF backend {self.backend!r} is not installed')
+        if self.documents >= self.max_queue:
+            self.rejected += 1
+            raise ExtractionBusy('PDF extraction queue is full')
+
+        with self.jobs_lock:
+            self.documents += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        path = None
+        jobs = []
+        pending = []
+        try:
+            path = await asyncio.to_thread(_spool_to_path, file_obj)
+
+            page_count, backend_name, first = await self._wait(
+                self._submit(jobs, _open_and_extract, path, self.batch_pages, self.backend, self.fast_path_pages),
+                deadline,
+            )
+            self.backend_documents[backend_name] += 1
+            total = min(page_count, self.max_pages)
+
+            batches = [
+                (start, min(start + self.batch_pages, total))
+                for start in range(len(first), total, self.batch_pages)
+            ]
+            next_batch = 0
+
+            def fill_window():
+                nonlocal next_batch
+                while next_batch < len(batches) and len(pending) < self.max_workers:
+                    start, stop = batches[next_batch]
+                    pending.append((start, self._submit(jobs, _extract_range, path, start, stop, backend_name)))
+                    next_batch += 1
+
+            fill_window()
+            yield [Page(index + 1, text, total, page_count) for index, text in enumerate(first[:total])]
+
+            while pending:
+                start, job = pending.pop(0)
+                texts = await self._wait(job, deadline)
+                fill_window()
+                yield [Page(start + offset + 1, text, total, page_count) for offset, text in enumerate(texts)]
+
+            self.completed += 1
+        except ExtractionTimeout:
+            self.timeouts += 1
+            raise
+        finally:
+            self._release_when_done(jobs)
+            if path is not None:
+                await asyncio.to_thread(os.remove, path)
+
+    async def extract_text(self, file_obj):
+        """Extract the whole document as one string of page-marked text."""
+        parts = []
+        async for page in self.iter_pages(file_obj):
+            parts.append(format_page(page))
+        return ''.join(parts).strip()
+
+    def stats(self):
+        """Queue depth and outcome counters."""
+        return {
+            'documents_in_progress': self.documents,
+            'queue_limit': self.max_queue,
+            'queued_jobs': self.queued_jobs,
+            'workers': self.max_workers,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'documents_by_backend': dict(self.backend_documents),
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def format_page(page):
+    """Render a Page with the page markers the AI engine prompt expects."""
+    if page.text is None:
+        return f"\n--- Page {page.number}: Error extracting text ---\n"
+    return f"\n--- Page {page.number} ---\n{page.text}\n"
+
+
+_service = None
+
+
+def get_service():
+    """Return the process-wide PDFExtractionService, creating it from settings."""
+    global _service
+    if _service is None:
+        _service = PDFExtractionService(
+            max_workers=settings.PDF_EXTRACTION_WORKERS,
+            max_queue=settings.PDF_EXTRACTION_QUEUE_LIMIT,
+            timeout=settings.PDF_EXTRACTION_TIMEOUT,
+            max_pages=settings.PDF_EXTRACTION_MAX_PAGES,
+            batch_pages=settings.PDF_EXTRACTION_BATCH_PAGES,
+            backend=settings.PDF_EXTRACTION_BACKEND,
+            fast_path_pages=settings.PDF_FAST_PATH_MIN_PAGES,
+        )
+    return _service
@@ -0,0 +1,227 @@
+"""
+Extractor registry: turns an uploaded document into plain text.
+
+Each extractor is registered for a document kind with the MIME types and
+file extensions it handles. The kind of an upload is worked out from its
+magic bytes first (browsers often send an empty or generic MIME type), then
+its declared MIME type, then its file extension.
+
+PDFs are registered here for detection only; their text is extracted page by
+page in the process pool (miva.extraction). Every other extractor is a plain
+function of a binary file object, run in a thread by the consumer.
+"""
+import csv
+import io
+import re
+import zipfile
+from collections import namedtuple
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+from django.conf import settings
+
+
+class DocumentTooLarge(ValueError):
+    """Raised when a document would expand to more than we are willing to read."""
+
+
+Extractor = namedtuple('Extractor', ['kind', 'label', 'mime_types', 'extensions', 'extract'])
+
+_registry = {}
+
+
+def register(kind, label, mime_types=(), extensions=()):
+    """Decorator registering ``func(file_obj) -> str`` as the extractor for ``kind``."""
+    def decorator(func):
+        _registry[kind] = Extractor(kind, label, tuple(mime_types), tuple(extensions), func)
+        return func
+    return decorator
+
+
+def get(kind):
+    return _registry.get(kind)
+
+
+def supported_extensions():
+    return sorted(ext for extractor in _registry.values() for ext in extractor.extensions)
+
+
+def _is_docx(file_obj):
+    try:
+        with zipfile.ZipFile(file_obj) as archive:
+            return 'word/document.xml' in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+    finally:
+        file_obj.seek(0)
+
+
+def sniff(file_obj):
+    """Identify binary formats from their magic bytes; rewinds the file."""
+    head = file_obj.read(8)
+    file_obj.seek(0)
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04') and _is_docx(file_obj):
+        return 'docx'
+    return None
+
+
+def detect(file_obj, mime, name):
+    """The registered kind for an upload, or None if it is unsupported."""
+    kind = sniff(file_obj)
+    if kind is not None:
+        return kind
+    mime = (mime or '').split(';')[0].strip().lower()
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    for extractor in _registry.values():
+        if mime in extractor.mime_types:
+            return extractor.kind
+    for extractor in _registry.values():
+        if extension in extractor.extensions:
+            return extractor.kind
+    return None
+
+
+def _truncate(text):
+    limit = settings.DOCUMENT_EXTRACTION_MAX_CHARS
+    if len(text) > limit:
+        return text[:limit] + f"\n[Only the first {limit} characters were read]"
+    return text
+
+
+def _read_text(file_obj):
+    data = file_obj.read()
+    if data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    return data.decode('utf-8', errors='ignore')
+
+
+def extract(kind, file_obj):
+    """Run the extractor registered for ``kind`` (not for PDFs)."""
+    return _registry[kind].extract(file_obj)
+
+
+# Text is extracted page by page by miva.extraction, not by a function here
+_registry['pdf'] = Extractor('pdf', 'PDF', ('application/pdf',), ('pdf',), None)
+
+
+@register('text', 'text file', mime_types=('text/plain',), extensions=('txt', 'text', 'log'))
+def extract_text(file_obj):
+    return _truncate(_read_text(file_obj))
+
+
+MARKDOWN_IMAGE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+MARKDOWN_LINK = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+MARKDOWN_HTML_COMMENT = re.compile(r'<!--.*?-->', re.S)
+
+
+@register('markdown', 'Markdown document', mime_types=('text/markdown', 'text/x-markdown'),
+          extensions=('md', 'markdown'))
+def extract_markdown(file_obj):
+    # Headings, lists and emphasis read fine as they are; only drop image
+    # URLs and comments, and keep link targets in brackets
+    text = _read_text(file_obj)
+    text = MARKDOWN_HTML_COMMENT.sub('', text)
+    text = MARKDOWN_IMAGE.sub(r'[Image: \1]', text)
+    text = MARKDOWN_LINK.sub(r'\1 (\2)', text)
+    return _truncate(text)
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects visible text, with line breaks at block-level elements."""
+
+    SKIP = {'script', 'style', 'noscript', 'template', 'head'}
+    BLOCKS = {
+        'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+        'section', 'article', 'header', 'footer', 'blockquote', 'pre', 'table', 'ul', 'ol',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+        if tag == 'li':
+            self.parts.append('- ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+    def text(self):
+        lines = (' '.join(line.split()) for line in ''.join(self.parts).splitlines())
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+@register('html', 'web page', mime_types=('text/html', 'application/xhtml+xml'),
+          extensions=('html', 'htm', 'xhtml'))
+def extract_html(file_obj):
+    parser = _HTMLTextParser()
+    parser.feed(_read_text(file_obj))
+    parser.close()
+    return _truncate(parser.text())
+
+
+@register('csv', 'spreadsheet (CSV)', mime_types=('text/csv', 'application/csv'), extensions=('csv',))
+def extract_csv(file_obj):
+    text = _read_text(file_obj)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+    max_rows = settings.CSV_EXTRACTION_MAX_ROWS
+    lines = []
+    for index, row in enumerate(csv.reader(io.StringIO(text), dialect)):
+        if index >= max_rows:
+            lines.append(f"[Only the first {max_rows} rows were read]")
+            break
+        lines.append(' | '.join(cell.strip() for cell in row))
+    return _truncate('\n'.join(lines))
+
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+@register('docx', 'Word document',
+          mime_types=('application/vnd.openxmlformats-officedocument.wordprocessingml.document',),
+          extensions=('docx',))
+def extract_docx(file_obj):
+    limit = settings.DOCUMENT_EXTRACTION_MAX_CHARS
+    with zipfile.ZipFile(file_obj) as archive:
+        # A small upload can inflate enormously (a zip bomb); check before decompressing
+        if archive.getinfo('word/document.xml').file_size > settings.DOCX_MAX_XML_BYTES:
+            raise DocumentTooLarge('This Word document is too large to read')
+        with archive.open('word/document.xml') as document:
+            paragraphs = []
+            collected = 0
+            # iterparse keeps memory flat on long documents
+            for _, element in ElementTree.iterparse(document):
+                if element.tag != f'{WORD_NS}p':
+                    continue
+                parts = []
+                for node in element.iter():
+                    if node.tag == f'{WORD_NS}t' and node.text:
+                        parts.append(node.text)
+                    elif node.tag == f'{WORD_NS}tab':
+                        parts.append('\t')
+                    elif node.tag in (f'{WORD_NS}br', f'{WORD_NS}cr'):
+                        parts.append('\n')
+                paragraphs.append(''.join(parts))
+                element.clear()
+                collected += len(paragraphs[-1]) + 1
+                if collected > limit:
+                    # _truncate marks the cut; the rest is never parsed
+                    break
+    return _truncate('\n'.join(p for p in paragraphs if p.strip()))
@@ -0,0 +1,194 @@
+"""
+Persistent chat history.
+
+The consumer queues messages on a process-wide HistoryWriter, which writes
+them with one bulk INSERT per batch from a background task, so a chat turn
+never waits on the database. A failed batch is retried a few times, and
+whatever is queued is written when a chat socket closes and at exit. History is read back newest-first with keyset
+(cursor) pagination on (created_at, id): each page is an index range scan
+from the cursor, however far back the learner scrolls.
+"""
+import asyncio
+import atexit
+import base64
+import logging
+from datetime import datetime
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a history cursor cannot be decoded."""
+
+
+def encode_cursor(message):
+    """Opaque cursor pointing just before ``message``."""
+    raw = f'{message.created_at.isoformat()}|{message.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` from a cursor made by encode_cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, _, pk = base64.b64decode(padded, altchars=b'-_', validate=True).decode().partition('|')
+        created_at, pk = datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor('Invalid history cursor')
+    # encode_cursor always writes the offset; a naive time was not made by it
+    if settings.USE_TZ and timezone.is_naive(created_at):
+        raise InvalidCursor('Invalid history cursor')
+    return created_at, pk
+
+
+def history_page(profile, before=None, limit=None):
+    """
+    Return ``(messages, next_cursor)`` for one page of a profile's history.
+    Messages are oldest-first within the page; ``next_cursor`` fetches the
+    page before it, and is None when there is nothing older.
+    """
+    limit = min(limit or settings.CHAT_HISTORY_PAGE_SIZE, settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+    messages = ChatMessage.objects.filter(profile=profile)
+    if before:
+        created_at, pk = decode_cursor(before)
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    rows = list(messages.order_by('-created_at', '-id')[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return list(reversed(rows[:limit])), next_cursor
+
+
+class HistoryWriter:
+    """
+    Buffers chat messages and writes them in batches: whenever
+    ``batch_size`` messages are waiting, or ``flush_interval`` seconds after
+    the first one was queued. A batch that fails to write goes back on the
+    queue for the next flush, up to ``max_retries`` times in a row before it
+    is dropped.
+    """
+
+    def __init__(self, batch_size=50, flush_interval=1.0, max_retries=3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.pending = []
+        self.flush_task = None
+        # Strong references to running flushes, which the loop only keeps weakly
+        self.tasks = set()
+        self.loop = None
+        self.failed_attempts = 0
+
+        self.messages_written = 0
+        self.batches_written = 0
+        self.write_failures = 0
+        self.messages_dropped = 0
+
+    def add(self, profile_id, role, text):
+        """Queue one message; returns immediately."""
+        if not profile_id or not text:
+            return
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # A timer from a previous event loop will never fire
+            self.loop = loop
+            self.flush_task = None
+        self.pending.append(ChatMessage(
+            profile_id=profile_id, role=role, text=text, created_at=timezone.now()
+        ))
+        if len(self.pending) >= self.batch_size:
+            self._spawn(self.flush())
+        else:
+            self._schedule()
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def _schedule(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = self._spawn(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        # A failed flush may schedule the next attempt
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far in one bulk INSERT."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await database_sync_to_async(ChatMessage.objects.bulk_create)(batch)
+        except Exception:
+            self._failed(batch)
+            if self.pending:
+                self._schedule()
+            return
+        self._written(batch)
+
+    def _written(self, batch):
+        self.failed_attempts = 0
+        self.messages_written += len(batch)
+        self.batches_written += 1
+
+    def _failed(self, batch):
+        self.write_failures += 1
+        self.failed_attempts += 1
+        if self.failed_attempts > self.max_retries:
+            self.failed_attempts = 0
+            self.messages_dropped += len(batch)
+            logger.exception("Failed to write %d chat messages; dropping them", len(batch))
+            return
+        logger.exception("Failed to write %d chat messages; will retry", len(batch))
+        # Back in front of anything queued meanwhile, so the order is kept
+        self.pending = batch + self.pending
+
+    def close(self):
+        """Write whatever is still queued, synchronously (at process exit)."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            ChatMessage.objects.bulk_create(batch)
+        except Exception:
+            self.write_failures += 1
+            self.messages_dropped += len(batch)
+            logger.exception("Failed to write %d chat messages at exit", len(batch))
+            return
+        self._written(batch)
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'messages_written': self.messages_written,
+            'batches_written': self.batches_written,
+            'write_failures': self.write_failures,
+            'messages_dropped': self.messages_dropped,
+        }
+
+
+_writer = None
+
+
+def get_writer():
+    """Return the process-wide HistoryWriter, creating it from settings."""
+    global _writer
+    if _writer is None:
+        _writer = HistoryWriter(
+            batch_size=settings.CHAT_HISTORY_BATCH_SIZE,
+            flush_interval=settings.CHAT_HISTORY_FLUSH_INTERVAL,
+        )
+        atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,252 @@
+"""
+HTTP caching and compression for HTML pages.
+
+Each page view declares its policy with the ``page_cache`` decorator:
+
+    public    anonymous visitors all get the same bytes, so the whole
+              response (and its gzip/brotli encodings) is kept in the
+              default cache for PAGE_CACHE_TIMEOUT seconds and served
+              without running the view. A page with a form (``csrf``) is
+              cached with a placeholder where the CSRF token goes and gets
+              a fresh token on every hit.
+    private   pages for signed-in learners carry an ETag (and a
+              Last-Modified where the view has one) computed before the view
+              runs: a hash of the page's template version, the URL, the
+              learner and anything the view adds with ``key``. A browser
+              revalidating its copy gets a 304 without a render.
+
+A page's template version is a hash of its template (and every template it
+extends or includes) and the static URLs in them, so a deploy that changes
+the page, or an asset's hashed name, changes every cache key and ETag. It is
+worked out once per process, and on every request with DEBUG.
+
+Every page goes out as ``Cache-Control: ... no-cache`` with ``Vary: Cookie``
+(signed-in learners see a different page at the same URL) and is compressed
+with brotli (with the Brotli package installed) or gzip when the browser
+accepts it.
+"""
+import hashlib
+import re
+import time
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.templatetags.static import static
+from django.utils import translation
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.utils.text import compress_string
+
+from . import offline
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+# Bodies smaller than this are sent as they are
+MIN_COMPRESS_BYTES = 200
+# Cached pages are compressed once, at the highest level; others on every request
+CACHED_BROTLI_QUALITY = 11
+BROTLI_QUALITY = 5
+# Random padding for compressed pages carrying a CSRF token (as GZipMiddleware, against BREACH)
+MAX_RANDOM_BYTES = 100
+
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = b'\x00csrf\x00'
+
+PagePolicy = namedtuple('PagePolicy', ['template', 'public', 'csrf', 'key', 'last_modified'])
+
+
+# -- Compression -----------------------------------------------------------
+
+def accepted_encoding(request):
+    """The best encoding the browser accepts: 'br', 'gzip' or None."""
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if brotli is not None and ACCEPTS_BROTLI.search(accepted):
+        return 'br'
+    if ACCEPTS_GZIP.search(accepted):
+        return 'gzip'
+    return None
+
+
+def encode(body, encoding, cached=False, padded=False):
+    if encoding == 'br':
+        return brotli.compress(body, quality=CACHED_BROTLI_QUALITY if cached else BROTLI_QUALITY)
+    return compress_string(body, max_random_bytes=MAX_RANDOM_BYTES if padded else None)
+
+
+def compress(request, response, encoded=None, padded=False):
+    """
+    Compress a response for the browser, using ``encoded`` (encoding ->
+    bytes) when it already has the body in that encoding. A strong ETag
+    becomes weak, as the compressed bytes differ from what it was computed on.
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if response.streaming or response.has_header('Content-Encoding') or len(response.content) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = accepted_encoding(request)
+    if encoding is None:
+        return response
+    body = (encoded or {}).get(encoding) or encode(response.content, encoding, padded=padded)
+    if len(body) >= len(response.content):
+        return response
+
+    response.content = body
+    response['Content-Length'] = str(len(body))
+    response['Content-Encoding'] = encoding
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    return response
+
+
+# -- Versions and validators ---------------------------------------------
+
+_versions = {}
+
+
+def page_version(template):
+    """Changes whenever the page's templates, or the static URLs in them, do."""
+    version = None if settings.DEBUG else _versions.get(template)
+    if version is None:
+        digest = hashlib.sha256()
+        for name, path in sorted(offline.template_files(template).items()):
+            text = path.read_text(encoding='utf-8')
+            digest.update(text.encode('utf-8'))
+            for static_name in offline.STATIC_TAG.findall(text):
+                digest.update(static(static_name).encode('utf-8'))
+        version = _versions[template] = digest.hexdigest()[:16]
+    return version
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha256('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:32]
+
+
+def private_etag(request, policy, version):
+    """
+    The ETag of a page as this learner sees it, without rendering it; None
+    for a page with a form when the browser has no CSRF cookie yet.
+    """
+    parts = [version, translation.get_language(), request.get_full_path(), request.user.pk, request.user.get_username()]
+    if policy.csrf:
+        secret = request.META.get('CSRF_COOKIE')
+        if not secret:
+            return None
+        parts.append(secret)
+    if policy.key:
+        parts.append(policy.key(request))
+    return make_etag(*parts)
+
+
+def set_validators(request, response, etag, last_modified):
+    if etag:
+        response.headers.setdefault('ETag', etag)
+    if last_modified is not None:
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+
+
+# -- Public pages --------------------------------------------------------
+
+def cache_entry(response, csrf):
+    """What is kept of a rendered public page: its body (split where the CSRF token goes) and encodings."""
+    body = response.content
+    if csrf:
+        body = CSRF_INPUT.sub(lambda match: match.group(1) + CSRF_PLACEHOLDER + match.group(2), body)
+    entry = {
+        'parts': body.split(CSRF_PLACEHOLDER),
+        'content_type': response['Content-Type'],
+        'etag': make_etag(hashlib.sha256(body).hexdigest()),
+        'last_modified': int(time.time()),
+        'encoded': {},
+    }
+    # A page with a token changes on every request, so it is compressed then
+    if not csrf and len(body) >= MIN_COMPRESS_BYTES:
+        entry['encoded']['gzip'] = encode(body, 'gzip', cached=True)
+        if brotli is not None:
+            entry['encoded']['br'] = encode(body, 'br', cached=True)
+    return entry
+
+
+def serve_public(request, view, policy, version, args, kwargs):
+    key = 'page:%s:%s:%s' % (version, translation.get_language(), request.path)
+    entry = cache.get(key)
+    if entry is None:
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or response.streaming or response.cookies:
+            return compress(request, response)
+        entry = cache_entry(response, policy.csrf)
+        cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT)
+
+    etag = entry['etag']
+    if policy.csrf:
+        token = get_token(request).encode('ascii')
+        # The browser's copy holds a token for its CSRF cookie, so only that cookie can revalidate it
+        etag = make_etag(etag, request.META['CSRF_COOKIE'])
+
+    response = get_conditional_response(request, etag=etag, last_modified=entry['last_modified'])
+    if response is None:
+        body = token.join(entry['parts']) if policy.csrf else entry['parts'][0]
+        response = HttpResponse(body, content_type=entry['content_type'])
+    set_validators(request, response, etag, entry['last_modified'])
+    response['Cache-Control'] = 'private, no-cache' if policy.csrf else 'public, no-cache'
+    patch_vary_headers(response, ('Cookie',))
+    return compress(request, response, None if policy.csrf else entry['encoded'], padded=policy.csrf)
+
+
+# -- Private pages -------------------------------------------------------
+
+def serve_private(request, view, policy, version, args, kwargs):
+    etag = private_etag(request, policy, version)
+    last_modified = policy.last_modified(request) if policy.last_modified else None
+    if last_modified is not None:
+        last_modified = int(last_modified.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified) if etag else None
+    if response is None:
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return compress(request, response)
+        if policy.csrf and etag is None:
+            # Rendering the form issued a CSRF cookie
+            etag = private_etag(request, policy, version)
+    set_validators(request, response, etag, last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Cookie',))
+    return compress(request, response, padded=policy.csrf)
+
+
+def page_cache(template, public=False, csrf=False, key=None, last_modified=None):
+    """
+    Give a page view its cache policy (see the module docstring). ``template``
+    is the template the view renders; ``public`` caches the whole page for
+    anonymous visitors (it must not depend on the query string); ``csrf``
+    marks a page with a form; ``key(request)`` adds anything else the page
+    depends on to its ETag and ``last_modified(request)`` returns when the
+    page's content last changed (a datetime, or None).
+    Only GET and HEAD requests are cached.
+    """
+    policy = PagePolicy(template, public, csrf, key, last_modified)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            version = page_version(policy.template)
+            if policy.public and settings.PAGE_CACHE_TIMEOUT and not request.user.is_authenticated:
+                return serve_public(request, view, policy, version, args, kwargs)
+            return serve_private(request, view, policy, version, args, kwargs)
+
+        wrapper.page_policy = policy
+        return wrapper
+
+    return decorator
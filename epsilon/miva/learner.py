@@ -0,0 +1,187 @@
+"""
+Learner preferences and questionnaire results.
+
+Both used to live as nested dicts in the DB-backed session, so every request
+deserialized and rewrote the whole session row. They are now stored in the
+LearnerPreferences and QuizResult models and read through a per-user cache
+entry that is deleted whenever the learner's data is written.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import personas
+from .models import LearnerPreferences, QuizResult
+
+
+PREFERENCE_FIELDS = (
+    'age',
+    'voice_guidance',
+    'reading_support',
+    'reduced_motion',
+    'break_reminders',
+    'daily_reminders',
+    'achievement_alerts',
+    'high_contrast',
+    'color_theme',
+)
+
+QUIZ_FIELDS = ('flow', 'learning_style', 'focus_time', 'reading_level', 'learning_goal', 'persona')
+
+# Friendly labels for the questionnaire answers
+QUIZ_QUESTIONS = [
+    ('learning_style', 'How do you learn best?', {
+        'visual-active': 'Pictures, Games & Videos',
+        'audio-patient': 'Listening & Repeating',
+        'slow-steady': 'Step-by-Step & Slow',
+        'mixed': 'A Mix of Everything',
+    }),
+    ('focus_time', 'How long can you usually focus on one thing?', {
+        '5': '5-10 minutes',
+        '15': '10-20 minutes',
+        '30': '20-30 minutes',
+        'flex': 'It Depends',
+    }),
+    ('reading_level', 'How do you feel about reading?', {
+        'struggle': 'I Find It Very Hard',
+        'slow': 'I Can Read But It Takes Time',
+        'ok': "I'm Okay with Reading",
+        'confident': 'I Love Reading!',
+    }),
+    ('learning_goal', 'What do you want to learn most?', {
+        'school': 'Help with School Subjects',
+        'life-skills': 'Real Life Skills',
+        'catch-up': 'Catch Up at My Own Speed',
+        'confidence': 'Build Confidence',
+    }),
+]
+
+# Cached in place of "no quiz yet" so a miss is cached too
+NO_QUIZ = {}
+
+
+def _preferences_key(profile_id):
+    return f'learner:{profile_id}:preferences'
+
+
+def _quiz_key(profile_id):
+    return f'learner:{profile_id}:quiz'
+
+
+def default_preferences():
+    return {
+        name: LearnerPreferences._meta.get_field(name).get_default()
+        for name in PREFERENCE_FIELDS
+    }
+
+
+def get_preferences(profile):
+    """The learner's preferences as a dict (defaults if none are saved yet)."""
+    key = _preferences_key(profile.pk)
+    preferences = cache.get(key)
+    if preferences is None:
+        preferences = (
+            LearnerPreferences.objects.filter(profile=profile).values(*PREFERENCE_FIELDS).first()
+            or default_preferences()
+        )
+        cache.set(key, preferences, settings.LEARNER_CACHE_TIMEOUT)
+    return preferences
+
+
+def update_preferences(profile, changes):
+    """
+    Save the given preference values. Only fields whose value actually
+    changed are written (and nothing at all if none did).
+    Returns the names of the changed fields.
+    """
+    current = get_preferences(profile)
+    changed = {}
+    for name, value in changes.items():
+        if name not in PREFERENCE_FIELDS:
+            continue
+        field = LearnerPreferences._meta.get_field(name)
+        value = field.to_python('' if value is None else value)
+        if current.get(name) != value:
+            changed[name] = value
+    if not changed:
+        return []
+
+    preferences, created = LearnerPreferences.objects.get_or_create(profile=profile, defaults=changed)
+    if not created:
+        for name, value in changed.items():
+            setattr(preferences, name, value)
+        preferences.save(update_fields=[*changed, 'updated_at'])
+    cache.delete(_preferences_key(profile.pk))
+    return list(changed)
+
+
+def record_quiz(profile, answers):
+    """Store a questionnaire submission (a dict of QUIZ_FIELDS)."""
+    QuizResult.objects.create(
+        profile=profile,
+        **{name: answers.get(name) or '' for name in QUIZ_FIELDS if name != 'flow'},
+        flow=answers.get('flow') or QuizResult.FLOW_PATH,
+    )
+    cache.delete(_quiz_key(profile.pk))
+
+
+def latest_quiz(profile):
+    """The learner's most recent questionnaire answers as a dict, or None."""
+    key = _quiz_key(profile.pk)
+    quiz = cache.get(key)
+    if quiz is None:
+        quiz = (
+            QuizResult.objects.filter(profile=profile)
+            .order_by('-created_at', '-id')
+            .values(*QUIZ_FIELDS)
+            .first()
+            or NO_QUIZ
+        )
+        cache.set(key, quiz, settings.LEARNER_CACHE_TIMEOUT)
+    return quiz or None
+
+
+def quiz_answers(quiz):
+    """Question/answer pairs with friendly labels, for the results page."""
+    if not quiz:
+        return []
+    return [
+        {'question': question, 'answer': labels.get(quiz.get(name, ''), quiz.get(name, ''))}
+        for name, question, labels in QUIZ_QUESTIONS
+    ]
+
+
+def quiz_from_post(post, flow):
+    """
+    Pull questionnaire answers out of a POSTed form and score the persona.
+    The persona the browser sent is only used if none of the answers could
+    be scored.
+    """
+    answers = personas.from_form(post)
+    client_persona = post.get('persona', '')
+    answers['flow'] = flow
+    answers['persona'] = personas.detect(answers) or (
+        client_persona if client_persona in personas.PERSONAS else ''
+    )
+    return answers
+
+
+def claim_session_quiz(request, profile):
+    """
+    Move answers an anonymous visitor left in the session (the adult
+    questionnaire is public) onto their profile once they sign in.
+    """
+    answers = request.session.pop('quiz', None)
+    if answers:
+        record_quiz(profile, answers)
+
+
+def forget_quizzes(profile_ids):
+    """Drop cached questionnaire results, e.g. after re-scoring personas."""
+    cache.delete_many([_quiz_key(pk) for pk in profile_ids])
+
+
+def reset(profile):
+    """Delete the learner's saved preferences and questionnaire results."""
+    LearnerPreferences.objects.filter(profile=profile).delete()
+    QuizResult.objects.filter(profile=profile).delete()
+    cache.delete_many([_preferences_key(profile.pk), _quiz_key(profile.pk)])
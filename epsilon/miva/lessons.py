@@ -0,0 +1,318 @@
+"""
+Lesson content and the question bank.
+
+Lessons and their quiz questions live in the Lesson and Question models and
+are loaded in bulk with ``manage.py import_curriculum``. Each process keeps
+a compiled QuestionBank in memory: every lesson's question set encoded once
+as JSON, with a strong ETag (a hash of those bytes). The question API is
+then a dict lookup, and a browser that already has the current set gets a
+304 without anything being rendered or encoded.
+
+The bank is compiled on first use and remembers the curriculum version it
+was built from: the number of lessons and when one was last imported. Every
+process re-reads that (one indexed aggregate query) at most once every
+LESSON_BANK_CHECK_SECONDS and recompiles when an import has changed it, so
+no process serves an old question set for longer than that.
+
+Curriculum files (JSON, or YAML with PyYAML installed) look like::
+
+    lessons:
+      - slug: math-counting
+        subject: math
+        position: 1
+        title: Counting with Tega
+        questions:
+          - prompt: If you have 3 apples and get 2 more, how many do you have?
+            choices: ['4', '5', '6', '3']
+            answer: 1            # index into choices
+            explanation: 3 + 2 = 5
+"""
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Lesson, Question
+
+try:
+    import yaml
+except ImportError:  # optional: YAML curriculum files
+    yaml = None
+
+
+LESSON_FIELDS = ('slug', 'subject', 'position', 'title')
+QUESTION_FIELDS = ('position', 'prompt', 'choices', 'answer', 'explanation')
+SUBJECTS = {value for value, _ in Lesson.SUBJECT_CHOICES}
+SLUG = re.compile(r'[-a-zA-Z0-9_]{1,80}')
+
+
+class CurriculumError(ValueError):
+    """Raised when a curriculum file is malformed; nothing is imported."""
+
+
+# A lesson's question set, ready to serve
+QuestionSet = namedtuple(
+    'QuestionSet', ['slug', 'subject', 'position', 'title', 'etag', 'body', 'last_modified', 'question_ids'],
+)
+
+
+def question_set_payload(lesson, questions):
+    return {
+        'lesson': {field: getattr(lesson, field) for field in LESSON_FIELDS},
+        'questions': [
+            {
+                'id': question.pk,
+                'prompt': question.prompt,
+                'choices': question.choices,
+                'answer': question.answer,
+                'explanation': question.explanation,
+            }
+            for question in questions
+        ],
+    }
+
+
+def compile_question_set(lesson, questions):
+    body = json.dumps(
+        question_set_payload(lesson, questions), ensure_ascii=False, separators=(',', ':'),
+    ).encode('utf-8')
+    return QuestionSet(
+        slug=lesson.slug,
+        subject=lesson.subject,
+        position=lesson.position,
+        title=lesson.title,
+        etag='"%s"' % hashlib.sha256(body).hexdigest()[:32],
+        body=body,
+        last_modified=lesson.updated_at,
+        question_ids=tuple(question.pk for question in questions),
+    )
+
+
+class QuestionBank:
+    """Every lesson's compiled question set, by slug and by subject, and each question's lesson."""
+
+    def __init__(self, question_sets, version):
+        self.version = version
+        self.by_slug = {question_set.slug: question_set for question_set in question_sets}
+        self.by_subject = {}
+        self.question_lessons = {
+            question_id: question_set.slug
+            for question_set in question_sets for question_id in question_set.question_ids
+        }
+        for question_set in sorted(question_sets, key=lambda q: q.position):
+            self.by_subject.setdefault(question_set.subject, []).append(question_set)
+        self.compiled_at = time.time()
+
+    @classmethod
+    def load(cls, version=None):
+        """Compile the bank from the database (two queries)."""
+        lessons = Lesson.objects.prefetch_related('questions')
+        return cls([compile_question_set(lesson, lesson.questions.all()) for lesson in lessons], version)
+
+    def get(self, slug):
+        return self.by_slug.get(slug)
+
+    def lessons(self, subject):
+        """The subject's question sets in lesson order."""
+        return self.by_subject.get(subject, [])
+
+    def index(self, subject=None):
+        """Summaries of the subject's (or every) lesson and a strong ETag over them."""
+        if subject:
+            question_sets = self.lessons(subject)
+        else:
+            question_sets = sorted(self.by_slug.values(), key=lambda q: (q.subject, q.position))
+        summaries = [
+            {field: getattr(question_set, field) for field in LESSON_FIELDS + ('etag',)}
+            for question_set in question_sets
+        ]
+        digest = hashlib.sha256(''.join(question_set.etag for question_set in question_sets).encode('ascii'))
+        return '"%s"' % digest.hexdigest()[:32], summaries
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'lessons': len(self.by_slug),
+            'questions': len(self.question_lessons),
+            'bytes': sum(len(question_set.body) for question_set in self.by_slug.values()),
+            'compiled_at': self.compiled_at,
+        }
+
+
+_bank = None
+_checked_at = 0.0
+
+
+def current_version():
+    """Changes whenever lessons are imported or deleted."""
+    version = Lesson.objects.aggregate(count=Count('id'), updated=Max('updated_at'))
+    return version['count'], version['updated']
+
+
+def get_bank():
+    """Return this process's QuestionBank, recompiled if the curriculum has changed."""
+    global _bank, _checked_at
+    now = time.monotonic()
+    if _bank is None or now - _checked_at >= settings.LESSON_BANK_CHECK_SECONDS:
+        _checked_at = now
+        version = current_version()
+        if _bank is None or version != _bank.version:
+            _bank = QuestionBank.load(version)
+    return _bank
+
+
+def adventure_context(subject, slug=None):
+    """
+    Template context for an adventure page: the lesson asked for (the
+    subject's first by default), where it sits in the subject and the next one.
+    """
+    question_sets = get_bank().lessons(subject)
+    if not question_sets:
+        return {'lesson': None}
+    index = next((i for i, question_set in enumerate(question_sets) if question_set.slug == slug), 0)
+    return {
+        'lesson': question_sets[index],
+        'lesson_number': index + 1,
+        'lesson_count': len(question_sets),
+        'next_lesson': question_sets[index + 1] if index + 1 < len(question_sets) else None,
+    }
+
+
+def curriculum_changed():
+    """Recompile this process's bank on next use (others notice within LESSON_BANK_CHECK_SECONDS)."""
+    global _bank
+    _bank = None
+
+
+# -- Import --------------------------------------------------------------
+
+def read_curriculum(path):
+    """Parse a JSON or YAML curriculum file."""
+    path = Path(path)
+    text = path.read_text(encoding='utf-8')
+    if path.suffix in ('.yaml', '.yml'):
+        if yaml is None:
+            raise CurriculumError('Install PyYAML to import YAML curriculum files')
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise CurriculumError(f'Invalid YAML: {e}') from None
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise CurriculumError(f'Invalid JSON: {e}') from None
+
+
+def _require(value, types, where):
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise CurriculumError(f'{where} is missing or has the wrong type')
+    return value
+
+
+def validate_curriculum(data):
+    """Check a parsed curriculum and return its lessons as a list of clean dicts."""
+    if not isinstance(data, dict) or not isinstance(data.get('lessons'), list):
+        raise CurriculumError("A curriculum is an object with a 'lessons' list")
+    lessons = []
+    slugs = set()
+    for index, item in enumerate(data['lessons']):
+        where = f'lessons[{index}]'
+        if not isinstance(item, dict):
+            raise CurriculumError(f'{where} must be an object')
+        slug = _require(item.get('slug'), str, f'{where}.slug')
+        if not SLUG.fullmatch(slug):
+            raise CurriculumError(f'{where}.slug must be up to 80 letters, digits, hyphens or underscores')
+        if slug in slugs:
+            raise CurriculumError(f'{where}.slug {slug!r} appears twice')
+        slugs.add(slug)
+        subject = item.get('subject')
+        if subject not in SUBJECTS:
+            raise CurriculumError(f'{where}.subject must be one of {", ".join(sorted(SUBJECTS))}')
+        lesson = {
+            'slug': slug,
+            'subject': subject,
+            'position': _require(item.get('position', 1), int, f'{where}.position'),
+            'title': _require(item.get('title'), str, f'{where}.title')[:200],
+            'questions': [],
+        }
+        for number, question in enumerate(item.get('questions') or [], start=1):
+            qwhere = f'{where}.questions[{number - 1}]'
+            if not isinstance(question, dict):
+                raise CurriculumError(f'{qwhere} must be an object')
+            choices = _require(question.get('choices'), list, f'{qwhere}.choices')
+            if len(choices) < 2 or not all(isinstance(choice, str) for choice in choices):
+                raise CurriculumError(f'{qwhere}.choices must be at least two strings')
+            answer = _require(question.get('answer'), int, f'{qwhere}.answer')
+            if not 0 <= answer < len(choices):
+                raise CurriculumError(f'{qwhere}.answer must index into choices')
+            lesson['questions'].append({
+                'position': number,
+                'prompt': _require(question.get('prompt'), str, f'{qwhere}.prompt'),
+                'choices': choices,
+                'answer': answer,
+                'explanation': _require(question.get('explanation', ''), str, f'{qwhere}.explanation'),
+            })
+        lessons.append(lesson)
+    return lessons
+
+
+def import_curriculum(data, replace=False):
+    """
+    Load a parsed curriculum in one transaction: lessons are matched by slug
+    and updated or created, and each imported lesson's questions are replaced
+    by the file's (matched by position). With ``replace`` lessons missing
+    from the file are deleted. Returns counts of what was written.
+    """
+    lessons = validate_curriculum(data)
+    now = timezone.now()
+    with transaction.atomic():
+        existing = Lesson.objects.in_bulk([lesson['slug'] for lesson in lessons], field_name='slug')
+        created, updated = [], []
+        for item in lessons:
+            lesson = existing.get(item['slug']) or Lesson(slug=item['slug'])
+            for field in ('subject', 'position', 'title'):
+                setattr(lesson, field, item[field])
+            lesson.updated_at = now
+            (updated if lesson.pk else created).append(lesson)
+        Lesson.objects.bulk_update(updated, ['subject', 'position', 'title', 'updated_at'], batch_size=500)
+        Lesson.objects.bulk_create(created, batch_size=500)
+        # bulk_create only sets primary keys on some databases
+        ids = dict(Lesson.objects.filter(slug__in=[item['slug'] for item in lessons]).values_list('slug', 'id'))
+
+        # Questions keep their rows (and ids) by position, so an unchanged
+        # question set keeps its ETag and anything recorded against a question survives
+        existing_questions = {
+            (question.lesson_id, question.position): question
+            for question in Question.objects.filter(lesson_id__in=ids.values())
+        }
+        new_questions, changed_questions = [], []
+        for item in lessons:
+            for fields in item['questions']:
+                key = (ids[item['slug']], fields['position'])
+                question = existing_questions.pop(key, None) or Question(lesson_id=key[0])
+                for field, value in fields.items():
+                    setattr(question, field, value)
+                (changed_questions if question.pk else new_questions).append(question)
+        Question.objects.bulk_update(changed_questions, QUESTION_FIELDS, batch_size=500)
+        Question.objects.bulk_create(new_questions, batch_size=1000)
+        Question.objects.filter(pk__in=[question.pk for question in existing_questions.values()]).delete()
+
+        deleted = 0
+        if replace:
+            _, per_model = Lesson.objects.exclude(slug__in=ids.keys()).delete()
+            deleted = per_model.get(Lesson._meta.label, 0)
+        transaction.on_commit(curriculum_changed)
+
+    return {
+        'created': len(created),
+        'updated': len(updated),
+        'deleted': deleted,
+        'questions': sum(len(item['questions']) for item in lessons),
+    }
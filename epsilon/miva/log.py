@@ -0,0 +1,47 @@
+"""
+Log sampling for the chat path.
+
+Under heavy traffic the per-message INFO logs ("Forwarded message to AI
+engine", ...) would flood stdout. SamplingFilter keeps every WARNING and
+above, and lets through at most ``per_second`` records a second for each
+distinct INFO/DEBUG message template (the unformatted ``msg``), optionally
+sampling beyond that at ``sample_rate``. The next record of a template that
+was cut back notes how many were dropped.
+
+Used from LOGGING in epsilon/settings.py; log with %-style arguments
+(``logger.info('Receiving %s', name)``) so records group by template.
+"""
+import logging
+import random
+import threading
+import time
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, per_second=5, sample_rate=0.0, name=''):
+        super().__init__(name)
+        self.per_second = per_second
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = int(time.monotonic())
+        with self.lock:
+            window, passed, dropped = self.windows.get(key, (now, 0, 0))
+            if window != now:
+                window, passed = now, 0
+            keep = passed < self.per_second or random.random() < self.sample_rate
+            if keep:
+                if dropped:
+                    record.msg = f'{record.msg} [{dropped} similar messages suppressed]'
+                self.windows[key] = (window, passed + 1, 0)
+            else:
+                self.windows[key] = (window, passed, dropped + 1)
+            if len(self.windows) > 10000:
+                # Templates built with f-strings never repeat; don't grow forever
+                self.windows.clear()
+        return keep
@@ -0,0 +1,157 @@
+"""
+Event-loop watchdog for the Daphne process.
+
+Every chat socket shares one event loop, so any callback that runs for a
+long time (a big ``json.loads``, a sync library call...) delays every other
+learner. When LOOP_MONITOR is on, the first chat socket starts a monitor on
+the running loop:
+
+- a ticker task sleeps ``interval`` seconds at a time and records how late
+  it woke up (scheduling lag) into a rolling window and the
+  ``chat_event_loop_lag_seconds`` histogram;
+- a watchdog thread notices when the ticker has not run for more than
+  ``slow_threshold`` seconds, i.e. the loop is stuck inside one callback, and
+  logs a warning with the loop thread's current stack so the culprit can be
+  found and moved off the loop.
+"""
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class LoopMonitor:
+    """Scheduling-lag ticker plus a stack-capturing watchdog thread for one event loop."""
+
+    def __init__(self, interval=0.1, slow_threshold=0.25, window=600, keep_stalls=10):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.samples = collections.deque(maxlen=window)
+        self.recent_stalls = collections.deque(maxlen=keep_stalls)
+
+        self.loop = None
+        self.task = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.loop_thread_id = None
+        self.heartbeat = 0.0
+        self.reported_beat = None
+
+        self.ticks = 0
+        self.stalls = 0
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self):
+        """Start monitoring the running loop (no-op if already watching it)."""
+        loop = asyncio.get_running_loop()
+        if self.running and self.loop is loop:
+            return
+        self.stop()
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped = threading.Event()
+        self.task = loop.create_task(self.tick())
+        self.thread = threading.Thread(target=self.watch, args=(self.stopped,), name='loop-watchdog', daemon=True)
+        self.thread.start()
+        logger.info(
+            'Event loop monitor started (interval %.0f ms, slow threshold %.0f ms)',
+            self.interval * 1000, self.slow_threshold * 1000,
+        )
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None and not self.task.done() and not self.loop.is_closed():
+            self.task.cancel()
+        self.task = None
+
+    async def tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            previous, self.heartbeat = self.heartbeat, time.monotonic()
+            self.ticks += 1
+            self.samples.append(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+            if previous == self.reported_beat and self.recent_stalls:
+                # The stall the watchdog reported is over: record how long it really was
+                self.recent_stalls[-1]['blocked_ms'] = round(lag * 1000, 1)
+
+    def watch(self, stopped):
+        """Watchdog thread: capture the loop thread's stack while it is stuck."""
+        while not stopped.wait(self.slow_threshold / 2):
+            beat = self.heartbeat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.slow_threshold or beat == self.reported_beat:
+                continue
+            self.reported_beat = beat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            self.stalls += 1
+            metrics.LOOP_STALLS.inc()
+            self.recent_stalls.append({'at': time.time(), 'blocked_ms': round(blocked * 1000, 1), 'stack': stack})
+            logger.warning('Event loop blocked for over %.0f ms in:\n%s', blocked * 1000, stack.rstrip())
+
+    def stats(self):
+        """Rolling lag distribution (ms) and stall counts."""
+        ordered = sorted(self.samples)
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000,
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'ticks': self.ticks,
+            'lag_ms': {
+                'samples': len(ordered),
+                'p50': _ms(_percentile(ordered, 0.50)),
+                'p95': _ms(_percentile(ordered, 0.95)),
+                'p99': _ms(_percentile(ordered, 0.99)),
+                'max': _ms(ordered[-1] if ordered else None),
+            },
+            'stalls': self.stalls,
+            'recent_stalls': list(self.recent_stalls),
+        }
+
+
+_monitor = None
+
+
+def get_monitor():
+    """Return the process-wide LoopMonitor, creating it from settings."""
+    global _monitor
+    if _monitor is None:
+        _monitor = LoopMonitor(
+            interval=settings.LOOP_MONITOR_INTERVAL,
+            slow_threshold=settings.LOOP_MONITOR_SLOW_SECONDS,
+            window=settings.LOOP_MONITOR_WINDOW,
+        )
+    return _monitor
+
+
+def ensure_started():
+    """Start the monitor on the running loop if LOOP_MONITOR is enabled."""
+    if settings.LOOP_MONITOR:
+        get_monitor().start()
@@ -0,0 +1,106 @@
+"""
+Compare the installed JSON codecs on the frames the chat path actually handles.
+"""
+import base64
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miva import codec
+
+
+def sample_frames(file_bytes):
+    """Representative frames, by name: browser messages, engine replies and relay output."""
+    reply = (
+        'Photosynthesis turns light energy into chemical energy. In the light-dependent reactions, '
+        'chlorophyll absorbs light and splits water, releasing oxygen. ' * 6
+    )
+    return {
+        'ping': {'type': 'ping'},
+        'chat': {
+            'message': 'Can you explain how photosynthesis works, step by step?',
+            'type': 'chat',
+            'unique_id': 'f3b2c1d0-7a6e-4f1b-9c8d-2e1f0a9b8c7d',
+            'documents': [41, 57, 63],
+        },
+        'engine_delta': {'type': 'delta', 'delta': ' chlorophyll absorbs', 'correlation_id': 'a' * 32},
+        'engine_reply': {'message': reply, 'correlation_id': 'a' * 32},
+        'relay_delta': {'type': 'delta', 'id': '5f0c2a9e1b7d', 'text': reply[:160], 'seq': 1234},
+        'upload_header': {'op': 'chunk', 'id': '9d8c7b6a5f4e', 'offset': 655360},
+        'inline_file': {
+            'message': 'Please read and analyze this text file. Help me understand its content.',
+            'type': 'chat',
+            'unique_id': None,
+            'file': {
+                'name': 'notes.txt',
+                'type': 'text/plain',
+                'content': base64.b64encode(file_bytes).decode('ascii'),
+            },
+        },
+    }
+
+
+def best_of(func, arg, number, repeat):
+    """Fastest per-call time of ``func(arg)`` in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        elapsed = (time.perf_counter() - started) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class Command(BaseCommand):
+    help = 'Time encode/decode of realistic chat frames with each installed JSON codec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=2000, help='Calls per timing run (small frames)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timing runs; the fastest is reported')
+        parser.add_argument(
+            '--file-size', type=int, default=128 * 1024,
+            help='Bytes in the inline_file frame (frames over CHAT_TEXT_FRAME_MAX_BYTES are refused)',
+        )
+        parser.add_argument(
+            '--codec', action='append', choices=('orjson', 'msgspec', 'json'),
+            help='Only benchmark this codec (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        codecs = [c for c in codec.available_codecs() if not options['codec'] or c.name in options['codec']]
+        if not codecs:
+            raise CommandError('None of the requested codecs is installed')
+        frames = sample_frames(os.urandom(options['file_size']))
+        reference = codec.available_codecs()[-1]
+
+        self.stdout.write(f"{'frame':<14}{'bytes':>10}  " + ''.join(f'{c.name:>22}' for c in codecs))
+        self.stdout.write(f"{'':<14}{'':>10}  " + ''.join(f"{'decode / encode us':>22}" for c in codecs))
+        totals = {c.name: [0.0, 0.0] for c in codecs}
+        for name, frame in frames.items():
+            text = reference.dumps(frame)
+            # Keep multi-megabyte frames from taking minutes
+            number = max(1, options['number'] * 1024 // max(len(text), 1024))
+            cells = []
+            for c in codecs:
+                decode = best_of(c.loads, text, number, options['repeat'])
+                encode = best_of(c.dumps, frame, number, options['repeat'])
+                totals[c.name][0] += decode
+                totals[c.name][1] += encode
+                cells.append(f'{decode * 1e6:>10.2f} / {encode * 1e6:<9.2f}')
+            self.stdout.write(f'{name:<14}{len(text):>10}  ' + ''.join(f'{cell:>22}' for cell in cells))
+
+        baseline = totals[reference.name] if reference.name in totals else None
+        for c in codecs:
+            decode, encode = totals[c.name]
+            line = f'{c.name}: one of each frame decoded in {decode * 1e6:.1f}us, encoded in {encode * 1e6:.1f}us'
+            if baseline and c.name != reference.name:
+                line += f' ({baseline[0] / decode:.1f}x / {baseline[1] / encode:.1f}x the stdlib)'
+            self.stdout.write(self.style.SUCCESS(line))
+
+        # Schema validation is the same for every codec; show what it adds on top
+        text = reference.dumps(frames['chat'])
+        validate = best_of(codec.validate, frames['chat'], options['number'], options['repeat'])
+        self.stdout.write(f'Schema validation of a chat frame: {validate * 1e6:.2f}us ({len(text)} bytes)')
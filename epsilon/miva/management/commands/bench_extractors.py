@@ -0,0 +1,78 @@
+"""
+Compare the installed PDF text extraction backends on a set of documents.
+"""
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miva import extraction
+
+
+class Command(BaseCommand):
+    help = 'Time each installed PDF extraction backend on the given PDFs (files or directories)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='PDF files, or directories searched for *.pdf')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Runs per document and backend; the fastest is reported',
+        )
+        parser.add_argument(
+            '--backend', action='append', choices=sorted(extraction.BACKENDS),
+            help='Only benchmark this backend (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        documents = []
+        for name in options['paths']:
+            path = Path(name)
+            if path.is_dir():
+                documents.extend(sorted(path.rglob('*.pdf')))
+            elif path.is_file():
+                documents.append(path)
+            else:
+                raise CommandError(f'No such file or directory: {name}')
+        if not documents:
+            raise CommandError('No PDF documents found')
+
+        backends = [b for b in extraction.available_backends() if b in (options['backend'] or extraction.BACKENDS)]
+        if not backends:
+            raise CommandError('None of the requested PDF backends is installed')
+
+        totals = {name: [0, 0.0, 0] for name in backends}
+        for document in documents:
+            for name in backends:
+                try:
+                    pages, seconds, chars = self.measure(name, str(document), options['repeat'])
+                except Exception as e:
+                    self.stderr.write(f'{document.name} [{name}]: {e}')
+                    continue
+                totals[name][0] += pages
+                totals[name][1] += seconds
+                totals[name][2] += chars
+                self.stdout.write(
+                    f'{document.name} [{name}]: {pages} pages in {seconds:.3f}s '
+                    f'({pages / seconds if seconds else 0:.0f} pages/s, {chars} chars)'
+                )
+
+        for name, (pages, seconds, chars) in totals.items():
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {pages} pages in {seconds:.3f}s '
+                f'({pages / seconds if seconds else 0:.0f} pages/s, {chars} chars)'
+            ))
+
+    def measure(self, backend_name, path, repeat):
+        best = None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            backend = extraction.BACKENDS[backend_name](path)
+            try:
+                pages = extraction._extract_pages(backend, 0, backend.page_count())
+            finally:
+                backend.close()
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        chars = sum(len(text) for text in pages if text)
+        return len(pages), best, chars
@@ -0,0 +1,110 @@
+"""
+Benchmark the spaced-repetition scheduler (miva/reviews.py) on a synthetic
+cohort: SM-2 grading, "next N due" lookups and the nightly rebalance.
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from miva import reviews
+from miva.models import ReviewItem
+
+
+def synthetic_chunk(rng, learners, items, today):
+    """Review state for ``learners`` x ``items`` cards, as parallel arrays (learner-major)."""
+    count = learners * items
+    repetitions = rng.integers(0, 8, count, dtype=np.int32)
+    interval = np.where(repetitions == 0, 0, rng.integers(1, 120, count, dtype=np.int32)).astype(np.int32)
+    return {
+        'learner': np.repeat(np.arange(learners, dtype=np.int64), items),
+        'ease': rng.integers(reviews.MIN_EASE, 3000, count, dtype=np.int32),
+        'interval': interval,
+        'repetitions': repetitions,
+        # A learner back from a break: some cards overdue, most spread over the coming weeks
+        'due': today + rng.integers(-10, 60, count).astype(np.int64),
+        'grade': rng.integers(0, reviews.MAX_GRADE + 1, count, dtype=np.int32),
+    }
+
+
+def max_daily_load(learner, due, today):
+    """The most reviews any learner has due on one day (overdue counts as today)."""
+    day = np.maximum(due, today) - today
+    span = int(day.max()) + 1
+    return int(np.bincount(learner * span + day).max())
+
+
+class Command(BaseCommand):
+    help = 'Time SM-2 grading, next-N-due lookups and the nightly rebalance on a synthetic cohort (no database writes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--learners', type=int, default=100000, help='Learners in the cohort')
+        parser.add_argument('--items', type=int, default=500, help='Review items per learner')
+        parser.add_argument('--chunk', type=int, default=10000, help='Learners processed at a time (bounds memory)')
+        parser.add_argument('--limit', type=int, default=50, help='Reviews due per learner per day for the rebalance')
+        parser.add_argument('--due', type=int, default=20, help='N in "next N due"')
+        parser.add_argument('--queries', type=int, default=200, help='Next-N-due lookups timed per chunk')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        learners, per_learner, chunk = options['learners'], options['items'], options['chunk']
+        if min(learners, per_learner, chunk, options['limit'], options['due'], options['queries']) < 1:
+            raise CommandError('All sizes must be at least 1')
+        rng = np.random.default_rng(options['seed'])
+        today = timezone.localdate().toordinal()
+        n = options['due']
+
+        grading = indexed = scanned = spreading = 0.0
+        queries = moved = before = after = 0
+        for start in range(0, learners, chunk):
+            size = min(chunk, learners - start)
+            cards = synthetic_chunk(rng, size, per_learner, today)
+
+            started = time.perf_counter()
+            reviews.sm2(cards['ease'], cards['interval'], cards['repetitions'], cards['grade'])
+            grading += time.perf_counter() - started
+
+            # Next N due: a slice of the (learner, due, id) ordering, like the
+            # database index, against filtering and sorting every card
+            order = np.lexsort((np.arange(len(cards['due'])), cards['due'], cards['learner']))
+            sorted_learner, sorted_due = cards['learner'][order], cards['due'][order]
+            sample = rng.integers(0, size, min(options['queries'], size))
+            started = time.perf_counter()
+            for learner in sample.tolist():
+                first, last = np.searchsorted(sorted_learner, (learner, learner + 1))
+                window = sorted_due[first:min(first + n, last)]
+                order[first:first + int(np.searchsorted(window, today, side='right'))]
+            indexed += time.perf_counter() - started
+            started = time.perf_counter()
+            for learner in sample.tolist():
+                hits = np.flatnonzero((cards['learner'] == learner) & (cards['due'] <= today))
+                hits[np.argsort(cards['due'][hits], kind='stable')[:n]]
+            scanned += time.perf_counter() - started
+            queries += len(sample)
+
+            started = time.perf_counter()
+            new = reviews.spread(cards['learner'], cards['due'], today, options['limit'])
+            spreading += time.perf_counter() - started
+            moved += int(np.count_nonzero(new != cards['due']))
+            before = max(before, max_daily_load(cards['learner'], cards['due'], today))
+            after = max(after, max_daily_load(cards['learner'], new, today))
+
+        total = learners * per_learner
+        self.stdout.write(f'{learners} learners x {per_learner} items = {total} review items, {chunk} learners per chunk')
+        self.stdout.write(self.style.SUCCESS(
+            f'SM-2 grading: {grading:.2f}s, {total / grading / 1e6:.1f}M answers/s'
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Next {n} due: {indexed / queries * 1e6:.1f}us from the index vs '
+            f'{scanned / queries * 1e6:.1f}us scanning {chunk * per_learner} cards '
+            f'({scanned / indexed:.0f}x)'
+        ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebalance to {options['limit']}/day: {spreading:.2f}s, moved {moved} items; "
+            f'busiest learner-day {before} -> {after} reviews'
+        ))
+
+        # The query due_items runs, and the plan the database picks for it
+        plan = ReviewItem.objects.filter(profile_id=1, due__lte=timezone.localdate()).order_by('due', 'id')[:n]
+        self.stdout.write(f'due_items query plan: {plan.explain()}')
@@ -0,0 +1,97 @@
+"""
+Build the static files for production: per-page bundles, content-hashed
+names and precompressed copies, then report bytes per page.
+"""
+import json
+import re
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from miva import assets
+
+
+STATIC_TAG = re.compile(r"\{% static '([^']+\.(?:js|css))' %\}")
+
+BUILD_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+}
+
+
+def file_size(path):
+    return path.stat().st_size if path.exists() else None
+
+
+class Command(BaseCommand):
+    help = 'Bundle, minify, hash and precompress JS/CSS into STATIC_ROOT and report bytes per page'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete STATIC_ROOT first (by default files from earlier builds are kept for cached pages)',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        # Rebuild every bundle from scratch, then hash and compress everything
+        shutil.rmtree(settings.ASSET_BUNDLE_DIR, ignore_errors=True)
+        with override_settings(STORAGES=BUILD_STORAGES):
+            call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+
+        static_root = Path(settings.STATIC_ROOT)
+        manifest = json.loads((static_root / 'staticfiles.json').read_text())['paths']
+        report = self.report(static_root, manifest)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'page':<32}{'requests':>10}{'before':>10}{'minified':>10}{'gzip':>9}{'brotli':>9}"
+        )
+        for page, row in report['pages'].items():
+            self.stdout.write(
+                f"{page:<32}{row['requests_before']:>5} -> {row['requests_after']:<2}{row['before']:>10}"
+                f"{row['minified']:>10}{row['gzip']:>9}{row['brotli'] if row['brotli'] is not None else '-':>9}"
+            )
+        total = report['total']
+        self.stdout.write(self.style.SUCCESS(
+            f"All pages: {total['before']} bytes before, {total['minified']} minified, "
+            f"{total['gzip']} gzip" + (f", {total['brotli']} brotli" if total['brotli'] is not None else '')
+        ))
+        if total['brotli'] is None:
+            self.stdout.write('Install the Brotli package to also write .br files.')
+
+    def report(self, static_root, manifest):
+        """Bytes of JS/CSS each template loads, as separate source files before and as built bundles after."""
+        pages = {}
+        for template_dir in settings.TEMPLATES[0]['DIRS']:
+            for template in sorted(Path(template_dir).rglob('*.html')):
+                names = STATIC_TAG.findall(template.read_text(encoding='utf-8'))
+                if names:
+                    pages[str(template.relative_to(template_dir))] = self.page_sizes(names, static_root, manifest)
+
+        total = {}
+        for key in ('before', 'minified', 'gzip', 'brotli'):
+            values = [row[key] for row in pages.values()]
+            total[key] = None if None in values else sum(values)
+        return {'pages': pages, 'total': total}
+
+    def page_sizes(self, names, static_root, manifest):
+        row = {'requests_before': 0, 'requests_after': len(names), 'before': 0, 'minified': 0, 'gzip': 0, 'brotli': 0}
+        for name in names:
+            prefix, _, bundle = name.partition('/')
+            sources = assets.BUNDLES[bundle] if prefix == assets.BUNDLE_PREFIX and bundle in assets.BUNDLES else [name]
+            row['requests_before'] += len(sources)
+            row['before'] += sum(file_size(assets.source_path(source)) or 0 for source in sources)
+
+            built = static_root / manifest.get(name, name)
+            row['minified'] += file_size(built) or 0
+            row['gzip'] += file_size(built.with_name(built.name + '.gz')) or 0
+            brotli = file_size(built.with_name(built.name + '.br'))
+            row['brotli'] = None if brotli is None or row['brotli'] is None else row['brotli'] + brotli
+        return row
@@ -0,0 +1,42 @@
+"""
+Write the offline service worker's precache manifest (see miva/offline.py).
+"""
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from miva import offline
+
+
+class Command(BaseCommand):
+    help = 'Generate the versioned precache manifest for the offline service worker (run after build_assets)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Where to write the manifest (default: OFFLINE_PRECACHE_MANIFEST)')
+        parser.add_argument('--print', action='store_true', help='Print the manifest instead of writing it')
+
+    def handle(self, *args, **options):
+        manifest = offline.build_manifest()
+        text = json.dumps(manifest, indent=2, sort_keys=True)
+        if options['print']:
+            self.stdout.write(text)
+            return
+
+        target = Path(options['output'] or settings.OFFLINE_PRECACHE_MANIFEST)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+        partial.write_text(text + '\n', encoding='utf-8')
+        os.replace(partial, target)
+
+        if not manifest['hashed']:
+            self.stdout.write(self.style.WARNING(
+                'Assets are listed under unhashed names (build_assets has not run, or DEBUG is on), '
+                'so the service worker will revalidate them like pages.'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Precache manifest {manifest['version']}: {len(manifest['lessons'])} lessons, "
+            f"{len(manifest['dashboards'])} dashboards, {len(manifest['assets'])} assets -> {target}"
+        ))
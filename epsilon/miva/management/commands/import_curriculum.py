@@ -0,0 +1,40 @@
+"""
+Load lessons and quiz questions from a JSON or YAML curriculum file.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miva import lessons
+
+
+class Command(BaseCommand):
+    help = 'Import a whole curriculum (lessons and questions) from JSON/YAML in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Curriculum file (.json, .yaml or .yml); see miva/lessons.py for the format')
+        parser.add_argument(
+            '--replace', action='store_true',
+            help='Also delete lessons that are not in the file',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only check the file')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            data = lessons.read_curriculum(options['path'])
+            if options['dry_run']:
+                found = lessons.validate_curriculum(data)
+                self.stdout.write(self.style.SUCCESS(
+                    f"{len(found)} lesson(s), {sum(len(item['questions']) for item in found)} question(s): OK"
+                ))
+                return
+            counts = lessons.import_curriculum(data, replace=options['replace'])
+        except (OSError, lessons.CurriculumError) as e:
+            raise CommandError(str(e))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counts['created']} new and {counts['updated']} updated lesson(s) "
+            f"with {counts['questions']} question(s), deleted {counts['deleted']}, in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,346 @@
+"""
+Load test the chat WebSocket and report relay latency as JSON.
+
+By default everything runs in this process: the stub AI engine, and N chat
+sockets driven straight into the ASGI application, so the numbers describe
+what one worker's event loop can hold. With ``--url`` the sockets go over
+the network to a running server instead (start it with AI_ENGINE_URL pointed
+at ``manage.py run_stub_engine``); pass ``--server-pid`` to measure that
+server's memory.
+"""
+import asyncio
+import json
+import resource
+import struct
+import time
+import uuid
+
+import aiohttp
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from miva import stub_engine
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values`` (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summary_ms(values):
+    return {
+        'count': len(values),
+        'p50': _ms(percentile(values, 0.50)),
+        'p95': _ms(percentile(values, 0.95)),
+        'p99': _ms(percentile(values, 0.99)),
+        'max': _ms(max(values) if values else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def rss_bytes(pid=None):
+    """Resident set size of a process (this one by default)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid is None:
+        # Peak rather than current RSS, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def upload_frame(header, payload=b''):
+    """Binary chunked-upload frame (see miva.uploads)."""
+    data = json.dumps(header).encode()
+    return struct.pack('>I', len(data)) + data + payload
+
+
+class InProcessSocket:
+    """A chat socket driven directly into the ASGI application."""
+
+    def __init__(self, application, path):
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise ConnectionError('Chat socket was rejected')
+
+    async def send_text(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def send_bytes(self, data):
+        await self.communicator.send_to(bytes_data=data)
+
+    async def receive(self, timeout):
+        return json.loads(await self.communicator.receive_from(timeout))
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class NetworkSocket:
+    """A chat socket to a running server."""
+
+    def __init__(self, http, url):
+        self.http = http
+        self.url = url
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await self.http.ws_connect(self.url)
+
+    async def send_text(self, text):
+        await self.ws.send_str(text)
+
+    async def send_bytes(self, data):
+        await self.ws.send_bytes(data)
+
+    async def receive(self, timeout):
+        msg = await self.ws.receive(timeout)
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            raise ConnectionError(f'Chat socket closed ({msg.type.name})')
+        return json.loads(msg.data)
+
+    async def close(self):
+        await self.ws.close()
+
+
+class LoopLagProbe:
+    """Measures how late a periodic timer fires on the running event loop."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class Command(BaseCommand):
+    help = 'Open N chat sockets, send text and file messages, and report latency percentiles as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100)
+        parser.add_argument('--messages', type=int, default=5, help='Messages per connection')
+        parser.add_argument(
+            '--file-every', type=int, default=5,
+            help='Make every Nth message a file upload (0 for text only)',
+        )
+        parser.add_argument('--file-size', type=int, default=64 * 1024, help='Bytes per uploaded file')
+        parser.add_argument('--think-time', type=float, default=0.0, help='Seconds between messages on a socket')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for each reply')
+        parser.add_argument('--url', help='ws:// URL of a running chat server (default: in-process)')
+        parser.add_argument('--server-pid', type=int, help='PID of the server behind --url, for memory')
+        parser.add_argument('--engine-latency', type=float, default=0.05)
+        parser.add_argument('--engine-chunk-delay', type=float, default=0.0)
+        parser.add_argument('--engine-chunk-words', type=int, default=8)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['messages'] < 1:
+            raise CommandError('--connections and --messages must be at least 1')
+        report = asyncio.run(self.run(options))
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text + '\n')
+        self.stdout.write(text)
+
+    async def run(self, options):
+        if options['url']:
+            async with aiohttp.ClientSession() as http:
+                return await self.load(options, lambda: NetworkSocket(http, options['url']), options['server_pid'])
+
+        engine = stub_engine.StubEngine(
+            latency=options['engine_latency'],
+            chunk_delay=options['engine_chunk_delay'],
+            chunk_words=options['engine_chunk_words'],
+        )
+        engine_url = await engine.start()
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        try:
+            # Every socket here is one anonymous learner; measure capacity, not the rate limits
+            with override_settings(AI_ENGINE_URL=engine_url, CHANNEL_LAYERS=layers, CHAT_RATE_LIMITS={}):
+                from epsilon.asgi import application
+                from miva import upstream
+                try:
+                    return await self.load(options, lambda: InProcessSocket(application, '/ws/chat/'), None)
+                finally:
+                    await upstream.get_pool().close()
+        finally:
+            await engine.stop()
+
+    async def load(self, options, make_socket, server_pid):
+        probe = LoopLagProbe()
+        probe.start()
+        if options['url']:
+            # Our own RSS says nothing about a server in another process
+            measure = (lambda: rss_bytes(server_pid)) if server_pid else (lambda: None)
+            measured = 'server' if server_pid else None
+        else:
+            measure = rss_bytes
+            measured = 'this process (includes the load generator)'
+        rss_before = measure()
+
+        results = {'connect': [], 'connect_errors': [], 'first_frame': [], 'reply': [], 'errors': [], 'bytes_sent': 0}
+        started = time.perf_counter()
+        opened = await asyncio.gather(*(
+            self.open_socket(make_socket, results) for _ in range(options['connections'])
+        ))
+        sockets = [socket for socket in opened if socket is not None]
+        rss_connected = measure()
+
+        await asyncio.gather(*(self.converse(socket, options, results) for socket in sockets))
+        elapsed = time.perf_counter() - started
+        rss_after = measure()
+        for socket in sockets:
+            try:
+                await socket.close()
+            except Exception:
+                pass
+        await probe.stop()
+
+        connected = len(sockets)
+        memory = {
+            'measured': measured,
+            'rss_before_bytes': rss_before,
+            'rss_connected_bytes': rss_connected,
+            'rss_after_bytes': rss_after,
+            'per_connection_bytes': (
+                (rss_connected - rss_before) // connected if connected and rss_before and rss_connected else None
+            ),
+        }
+        return {
+            'mode': 'network' if options['url'] else 'in-process',
+            'connections': {
+                'requested': options['connections'],
+                'open': connected,
+                'error_samples': results['connect_errors'][:5],
+            },
+            'messages': {
+                'sent': len(results['reply']) + len(results['errors']),
+                'replied': len(results['reply']),
+                'errors': len(results['errors']),
+                'error_samples': results['errors'][:5],
+            },
+            'duration_seconds': round(elapsed, 3),
+            'throughput': {
+                'replies_per_second': round(len(results['reply']) / elapsed, 2) if elapsed else None,
+                'upload_bytes_per_second': round(results['bytes_sent'] / elapsed) if elapsed else None,
+            },
+            'latency_ms': {
+                'connect': summary_ms(results['connect']),
+                'first_frame': summary_ms(results['first_frame']),
+                'full_reply': summary_ms(results['reply']),
+            },
+            'event_loop_lag_ms': summary_ms(probe.samples),
+            'memory': memory,
+        }
+
+    async def open_socket(self, make_socket, results):
+        socket = make_socket()
+        started = time.perf_counter()
+        try:
+            await socket.connect()
+            frame = await socket.receive(10)
+            if frame.get('type') != 'session':
+                raise ConnectionError(f'Expected a session frame, got {frame!r}')
+        except Exception as e:
+            results['connect_errors'].append(repr(e))
+            return None
+        results['connect'].append(time.perf_counter() - started)
+        return socket
+
+    async def converse(self, socket, options, results):
+        file_body = (b'The quick brown fox jumps over the lazy dog.\n' * (options['file_size'] // 45 + 1))
+        file_body = file_body[:options['file_size']]
+        for number in range(1, options['messages'] + 1):
+            is_file = options['file_every'] and number % options['file_every'] == 0
+            try:
+                if is_file:
+                    sent_at = await self.send_file(socket, file_body, options['timeout'])
+                    results['bytes_sent'] += len(file_body)
+                else:
+                    sent_at = time.perf_counter()
+                    await socket.send_text(json.dumps({'type': 'chat', 'message': f'Question {number}'}))
+                await self.await_reply(socket, sent_at, options['timeout'], results)
+            except Exception as e:
+                results['errors'].append(f"{'file' if is_file else 'text'}: {e!r}")
+            if options['think_time']:
+                await asyncio.sleep(options['think_time'])
+
+    async def send_file(self, socket, body, timeout):
+        """Upload ``body`` with the chunked protocol; returns when the 'end' frame went out."""
+        upload_id = uuid.uuid4().hex[:12]
+        await socket.send_bytes(upload_frame({
+            'op': 'start', 'id': upload_id, 'name': 'loadtest.txt', 'type': 'text/plain', 'size': len(body),
+        }))
+        ready = await self.next_frame(socket, timeout, ('upload_ready', 'upload_error'))
+        if ready['type'] == 'upload_error':
+            raise ConnectionError(ready.get('error'))
+        chunk_size = ready['chunk_size']
+        window = ready['window'] * chunk_size
+
+        offset = acked = 0
+        while offset < len(body):
+            while offset - acked >= window:
+                acked = (await self.next_frame(socket, timeout, ('upload_ack',)))['offset']
+            chunk = body[offset:offset + chunk_size]
+            await socket.send_bytes(upload_frame({'op': 'chunk', 'id': upload_id, 'offset': offset}, chunk))
+            offset += len(chunk)
+        while acked < len(body):
+            acked = (await self.next_frame(socket, timeout, ('upload_ack',)))['offset']
+
+        sent_at = time.perf_counter()
+        await socket.send_bytes(upload_frame({'op': 'end', 'id': upload_id, 'message': 'Summarise this file'}))
+        return sent_at
+
+    async def next_frame(self, socket, timeout, types):
+        while True:
+            frame = await socket.receive(timeout)
+            if frame.get('type') in types or 'error' in frame:
+                if 'error' in frame and frame.get('type') not in types:
+                    raise ConnectionError(frame['error'])
+                return frame
+
+    async def await_reply(self, socket, sent_at, timeout, results):
+        first = None
+        while True:
+            frame = await socket.receive(timeout)
+            kind = frame.get('type')
+            if 'error' in frame:
+                raise ConnectionError(frame['error'])
+            if kind == 'delta' and first is None:
+                first = time.perf_counter()
+                results['first_frame'].append(first - sent_at)
+            elif kind == 'done':
+                results['reply'].append(time.perf_counter() - sent_at)
+                return
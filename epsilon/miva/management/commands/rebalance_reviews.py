@@ -0,0 +1,36 @@
+"""
+Spread every learner's spaced-repetition reviews so no day is overloaded
+(see miva/reviews.py). Run nightly.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from miva import reviews
+
+
+class Command(BaseCommand):
+    help = 'Cap the reviews due per learner per day, pushing the excess to the following days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=settings.REVIEW_DAILY_LIMIT,
+            help='Most reviews due per learner per day (default: REVIEW_DAILY_LIMIT)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Learners read and updated per query')
+        parser.add_argument('--dry-run', action='store_true', help='Count what would move without saving')
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--limit and --chunk-size must be at least 1')
+
+        started = time.perf_counter()
+        items, moved = reviews.rebalance(
+            daily_limit=options['limit'], chunk_size=options['chunk_size'], dry_run=options['dry_run'],
+        )
+        elapsed = time.perf_counter() - started
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {moved} of {items} review(s) to keep at most {options['limit']} due per day, in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,40 @@
+"""
+Recompute every learner's progress aggregates from the activity log.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from miva import progress
+from miva.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Rebuild LearnerProgress (streaks, XP, lessons, badges) from ActivityEvent'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', metavar='USERNAME',
+            help='Only rebuild these users (repeatable); default is everyone',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Events fetched from the database per batch',
+        )
+
+    def handle(self, *args, **options):
+        profile_ids = None
+        if options['usernames']:
+            profile_ids = list(
+                UserProfile.objects.filter(user__username__in=options['usernames'])
+                .values_list('id', flat=True)
+            )
+            if not profile_ids:
+                raise CommandError('No matching users found')
+
+        started = time.perf_counter()
+        count = progress.rebuild(profile_ids, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt progress for {count} learner(s) in {elapsed:.2f}s'
+        ))
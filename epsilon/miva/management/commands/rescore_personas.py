@@ -0,0 +1,58 @@
+"""
+Re-score every stored questionnaire with the current persona weights.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from miva import learner, personas
+from miva.models import QuizResult
+
+
+class Command(BaseCommand):
+    help = 'Recompute QuizResult.persona for every stored questionnaire in one pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Questionnaires scored (and updated) per batch',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report how many personas would change without saving',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        fields = ('id', 'profile_id', 'persona', *personas.QUESTIONS)
+        rows = QuizResult.objects.order_by('id').values(*fields).iterator(chunk_size=chunk_size)
+
+        started = time.perf_counter()
+        scored = changed = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                changed += self.rescore(chunk, options['dry_run'])
+                scored += len(chunk)
+                chunk = []
+        if chunk:
+            changed += self.rescore(chunk, options['dry_run'])
+            scored += len(chunk)
+
+        elapsed = time.perf_counter() - started
+        verb = 'would change' if options['dry_run'] else 'changed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scored {scored} questionnaire(s) in {elapsed:.2f}s; {changed} persona(s) {verb}'
+        ))
+
+    def rescore(self, rows, dry_run):
+        """Score one chunk with a single matrix product and save the changes."""
+        updates = []
+        for row, persona in zip(rows, personas.detect_many(rows)):
+            if persona is not None and persona != row['persona']:
+                updates.append(QuizResult(id=row['id'], profile_id=row['profile_id'], persona=persona))
+        if updates and not dry_run:
+            QuizResult.objects.bulk_update(updates, ['persona'], batch_size=500)
+            learner.forget_quizzes({result.profile_id for result in updates})
+        return len(updates)
@@ -0,0 +1,46 @@
+"""
+Run the local stub AI engine (miva.stub_engine) for development and load tests.
+"""
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from miva import stub_engine
+
+
+class Command(BaseCommand):
+    help = 'Serve a fake AI engine on ws://<host>:<port>/ws/chat (point AI_ENGINE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds before the first fragment')
+        parser.add_argument('--chunk-delay', type=float, default=0.01, help='Seconds between fragments')
+        parser.add_argument(
+            '--chunk-words', type=int, default=3,
+            help='Words per streamed fragment (0 replies with one whole message)',
+        )
+        parser.add_argument('--mode', choices=stub_engine.MODES, default='normal')
+
+    def handle(self, *args, **options):
+        engine = stub_engine.StubEngine(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            chunk_delay=options['chunk_delay'],
+            chunk_words=options['chunk_words'],
+            mode=options['mode'],
+        )
+        try:
+            asyncio.run(self.serve(engine))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, engine):
+        url = await engine.start()
+        self.stdout.write(self.style.SUCCESS(f'Stub AI engine listening on {url} (mode: {engine.mode})'))
+        self.stdout.write(f'Change mode with: curl -X POST "http://{engine.host}:{engine.port}/mode?set=stall"')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await engine.stop()
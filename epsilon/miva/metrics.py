@@ -0,0 +1,288 @@
+"""
+In-process metrics for the chat relay path, served in the Prometheus text
+format at /metrics/.
+
+Counters, gauges and histograms live in one registry per process (each
+Daphne worker reports its own numbers; Prometheus adds them up). The
+``stats()`` snapshots of the shared services (upstream pool, extraction
+service, caches...) are exported as gauges when the endpoint is scraped.
+
+Timing a block::
+
+    with metrics.RECEIVE_SECONDS.time():
+        ...
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds: 1ms .. 60s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes: 256B .. 32MB
+SIZE_BUCKETS = tuple(256 * 4 ** n for n in range(10))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} takes labels {self.labelnames}, got {tuple(labels)}')
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_label_text(labels)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        return [('', key, value) for key, value in items]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the ``with`` block (also on errors)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = sorted((key, dict(series, counts=list(series['counts']))) for key, series in self.series.items())
+        samples = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                samples.append(('_bucket', key + (('le', _number(float(bound))),), cumulative))
+            samples.append(('_sum', key, series['sum']))
+            samples.append(('_count', key, series['count']))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help_text, labelnames, buckets))
+
+    def collector(self, prefix, help_text):
+        """
+        Decorator for a function returning a ``stats()`` dict; its numeric
+        values are exported as ``<prefix>_<key>`` gauges on every scrape
+        (nested dicts are flattened, non-numbers skipped).
+        """
+        def decorator(func):
+            self.collectors.append((prefix, help_text, func))
+            return func
+        return decorator
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, help_text, func in self.collectors:
+            try:
+                stats = func()
+            except Exception:
+                continue
+            for name, value in sorted(_flatten(prefix, stats)):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _flatten(prefix, stats):
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+REGISTRY = Registry()
+
+CONNECTIONS_ACTIVE = REGISTRY.gauge('chat_connections_active', 'Chat WebSockets currently open')
+CONNECTIONS_TOTAL = REGISTRY.counter('chat_connections_total', 'Chat WebSockets accepted')
+CONNECT_SECONDS = REGISTRY.histogram('chat_connect_seconds', 'Time to set up a chat socket (profile, session resume)')
+RECEIVE_SECONDS = REGISTRY.histogram(
+    'chat_receive_seconds', 'Time spent handling one inbound frame', ['kind'],
+)
+INBOUND_BYTES = REGISTRY.histogram(
+    'chat_inbound_frame_bytes', 'Size of inbound WebSocket frames', ['kind'], buckets=SIZE_BUCKETS,
+)
+FILE_SECONDS = REGISTRY.histogram(
+    'chat_file_processing_seconds', 'Time to turn an uploaded file into message text', ['kind'],
+)
+FILE_BYTES = REGISTRY.histogram(
+    'chat_file_bytes', 'Size of processed uploads', ['kind'], buckets=SIZE_BUCKETS,
+)
+PDF_EXTRACTION_SECONDS = REGISTRY.histogram('chat_pdf_extraction_seconds', 'Time to extract text from a PDF')
+UPSTREAM_SEND_SECONDS = REGISTRY.histogram('chat_upstream_send_seconds', 'Time to write a frame to the AI engine')
+UPSTREAM_PAYLOAD_BYTES = REGISTRY.histogram(
+    'chat_upstream_payload_bytes', 'Size of frames sent to the AI engine', buckets=SIZE_BUCKETS,
+)
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram(
+    'chat_upstream_ttfb_seconds', 'Time from sending a request to the first reply frame from the AI engine',
+)
+DOCUMENT_BYTES_SAVED = REGISTRY.histogram(
+    'chat_document_bytes_saved', 'Document text left out of one message by chunk selection', buckets=SIZE_BUCKETS,
+)
+RELAY_FEED_SECONDS = REGISTRY.histogram(
+    'chat_relay_feed_seconds', 'Time to relay one AI engine frame to the browser',
+)
+ERRORS = REGISTRY.counter('chat_errors_total', 'Errors on the chat path', ['stage'])
+RATE_LIMITED = REGISTRY.counter(
+    'chat_rate_limited_total', 'Messages and uploads refused by the per-learner rate limits', ['budget'],
+)
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    'chat_event_loop_lag_seconds', 'How late the loop monitor ticker woke up (LOOP_MONITOR only)',
+)
+LOOP_STALLS = REGISTRY.counter(
+    'chat_event_loop_stalls_total', 'Callbacks that blocked the event loop past LOOP_MONITOR_SLOW_SECONDS',
+)
+
+
+@REGISTRY.collector('chat_upstream_pool', 'Upstream AI engine pool (see upstream.UpstreamPool.stats)')
+def _upstream_stats():
+    from . import upstream
+    return upstream.get_pool().stats()
+
+
+@REGISTRY.collector('chat_pdf_extraction', 'PDF extraction service (see extraction.PDFExtractionService.stats)')
+def _extraction_stats():
+    from . import extraction
+    return extraction.get_service().stats()
+
+
+@REGISTRY.collector('chat_document_cache', 'Extracted text cache (see doc_cache.DocumentTextCache.stats)')
+def _doc_cache_stats():
+    from . import doc_cache
+    return doc_cache.get_cache().stats()
+
+
+@REGISTRY.collector('chat_document_context', 'Document chunk selection (see chunking.ContextSelector.stats)')
+def _chunking_stats():
+    from . import chunking
+    return chunking.get_selector().stats()
+
+
+@REGISTRY.collector('chat_history_writer', 'Batched chat history writes (see history.HistoryWriter.stats)')
+def _history_stats():
+    from . import history
+    return history.get_writer().stats()
+
+
+@REGISTRY.collector('chat_rate_limiter', 'Per-learner rate limits (see ratelimit.RateLimiter.stats)')
+def _ratelimit_stats():
+    from . import ratelimit
+    return ratelimit.get_limiter().stats()
+
+
+@REGISTRY.collector('chat_event_loop', 'Event loop monitor (see loopmon.LoopMonitor.stats)')
+def _loop_stats():
+    from . import loopmon
+    return loopmon.get_monitor().stats()
+
+
+def render():
+    """The whole registry in the Prometheus text exposition format."""
+    return REGISTRY.render()
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miva', '0002_chat_message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerPreferences',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('age', models.CharField(blank=True, max_length=10)),
+                ('voice_guidance', models.BooleanField(default=False)),
+                ('reading_support', models.BooleanField(default=False)),
+                ('reduced_motion', models.BooleanField(default=False)),
+                ('break_reminders', models.BooleanField(default=False)),
+                ('daily_reminders', models.BooleanField(default=True)),
+                ('achievement_alerts', models.BooleanField(default=True)),
+                ('high_contrast', models.BooleanField(default=False)),
+                ('color_theme', models.CharField(default='default', max_length=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='preferences', to='miva.userprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuizResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flow', models.CharField(choices=[('path', 'Learning path'), ('adult', 'Adult')], default='path', max_length=10)),
+                ('learning_style', models.CharField(blank=True, max_length=20)),
+                ('focus_time', models.CharField(blank=True, max_length=20)),
+                ('reading_level', models.CharField(blank=True, max_length=20)),
+                ('learning_goal', models.CharField(blank=True, max_length=20)),
+                ('persona', models.CharField(blank=True, max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_results', to='miva.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['profile', 'created_at'], name='miva_quiz_profile_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miva', '0003_learner_preferences_quiz_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_xp', models.PositiveIntegerField(default=0)),
+                ('lessons_completed', models.PositiveIntegerField(default=0)),
+                ('streak_days', models.PositiveIntegerField(default=0)),
+                ('longest_streak', models.PositiveIntegerField(default=0)),
+                ('last_active_date', models.DateField(blank=True, null=True)),
+                ('badges_earned', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='miva.userprofile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('visit', 'Visit'), ('lesson_started', 'Lesson started'), ('lesson_completed', 'Lesson completed'), ('quiz_completed', 'Quiz completed')], max_length=20)),
+                ('xp', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_events', to='miva.userprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['profile', 'created_at'], name='miva_event_profile_created')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miva', '0004_activity_event_learner_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activityevent',
+            name='client_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='activityevent',
+            constraint=models.UniqueConstraint(fields=('profile', 'client_id'), name='miva_event_client_id'),
+        ),
+    ]
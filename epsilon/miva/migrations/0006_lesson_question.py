@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miva', '0005_activity_event_client_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lesson',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=80, unique=True)),
+                ('subject', models.CharField(choices=[('math', 'Math Adventures'), ('reading', 'Reading Quest'), ('science', 'Science Lab'), ('creative', 'Creative Studio')], max_length=20)),
+                ('position', models.PositiveIntegerField(default=1)),
+                ('title', models.CharField(max_length=200)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['subject', 'position'],
+                'indexes': [models.Index(fields=['subject', 'position'], name='miva_lesson_subject_position')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=1)),
+                ('prompt', models.TextField()),
+                ('choices', models.JSONField()),
+                ('answer', models.PositiveSmallIntegerField()),
+                ('explanation', models.TextField(blank=True)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='miva.lesson')),
+            ],
+            options={
+                'ordering': ['lesson', 'position'],
+            },
+        ),
+    ]
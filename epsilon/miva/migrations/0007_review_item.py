@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('miva', '0006_lesson_question'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ease', models.PositiveSmallIntegerField(default=2500)),
+                ('interval', models.PositiveSmallIntegerField(default=0)),
+                ('repetitions', models.PositiveSmallIntegerField(default=0)),
+                ('lapses', models.PositiveSmallIntegerField(default=0)),
+                ('due', models.DateField()),
+                ('last_reviewed', models.DateField(blank=True, null=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_items', to='miva.userprofile')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_items', to='miva.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['profile', 'due', 'id'], name='miva_review_profile_due')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'question'), name='miva_review_profile_question')],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 
@@ -11,4 +12,205 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.unique_id}"
 
-# Create your models here.
+
+class ChatMessage(models.Model):
+    """
+    One message in a learner's chat with Tega.
+    Read back newest-first with keyset pagination (see miva.history).
+    """
+    ROLE_USER = 'user'
+    ROLE_ASSISTANT = 'assistant'
+    ROLE_CHOICES = [
+        (ROLE_USER, 'User'),
+        (ROLE_ASSISTANT, 'Tega'),
+    ]
+
+    profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='chat_messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    text = models.TextField()
+    # Stamped when the consumer queues the message, not when the batch is written
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', 'created_at'], name='miva_chat_profile_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile.user.username} ({self.role}) - {self.created_at:%Y-%m-%d %H:%M}"
+
+
+class LearnerPreferences(models.Model):
+    """
+    Accessibility and notification settings for one learner.
+    Read through a per-user cache (see miva.learner).
+    """
+    profile = models.OneToOneField(UserProfile, on_delete=models.CASCADE, related_name='preferences')
+    age = models.CharField(max_length=10, blank=True)
+    voice_guidance = models.BooleanField(default=False)
+    reading_support = models.BooleanField(default=False)
+    reduced_motion = models.BooleanField(default=False)
+    break_reminders = models.BooleanField(default=False)
+    daily_reminders = models.BooleanField(default=True)
+    achievement_alerts = models.BooleanField(default=True)
+    high_contrast = models.BooleanField(default=False)
+    color_theme = models.CharField(max_length=20, default='default')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Preferences for {self.profile.user.username}"
+
+
+class QuizResult(models.Model):
+    """Answers from one run of the onboarding questionnaire."""
+    FLOW_PATH = 'path'
+    FLOW_ADULT = 'adult'
+    FLOW_CHOICES = [
+        (FLOW_PATH, 'Learning path'),
+        (FLOW_ADULT, 'Adult'),
+    ]
+
+    profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='quiz_results')
+    flow = models.CharField(max_length=10, choices=FLOW_CHOICES, default=FLOW_PATH)
+    learning_style = models.CharField(max_length=20, blank=True)
+    focus_time = models.CharField(max_length=20, blank=True)
+    reading_level = models.CharField(max_length=20, blank=True)
+    learning_goal = models.CharField(max_length=20, blank=True)
+    persona = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', 'created_at'], name='miva_quiz_profile_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile.user.username} - {self.persona or self.flow} ({self.created_at:%Y-%m-%d})"
+
+
+class ActivityEvent(models.Model):
+    """
+    Append-only log of things a learner did. LearnerProgress is kept up to
+    date from it as events are written, and can be rebuilt from it in bulk.
+    """
+    KIND_VISIT = 'visit'
+    KIND_LESSON_STARTED = 'lesson_started'
+    KIND_LESSON_COMPLETED = 'lesson_completed'
+    KIND_QUIZ_COMPLETED = 'quiz_completed'
+    KIND_CHOICES = [
+        (KIND_VISIT, 'Visit'),
+        (KIND_LESSON_STARTED, 'Lesson started'),
+        (KIND_LESSON_COMPLETED, 'Lesson completed'),
+        (KIND_QUIZ_COMPLETED, 'Quiz completed'),
+    ]
+
+    profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='activity_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # XP awarded for this event, stored so later rule changes don't rewrite history
+    xp = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Id the browser gave an event it queued offline, so a retried sync is not counted twice
+    client_id = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', 'created_at'], name='miva_event_profile_created'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'client_id'], name='miva_event_client_id'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile.user.username} - {self.kind} (+{self.xp} XP)"
+
+
+class LearnerProgress(models.Model):
+    """Per-learner aggregates of the activity log, read by the dashboards."""
+    profile = models.OneToOneField(UserProfile, on_delete=models.CASCADE, related_name='progress')
+    total_xp = models.PositiveIntegerField(default=0)
+    lessons_completed = models.PositiveIntegerField(default=0)
+    streak_days = models.PositiveIntegerField(default=0)
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_active_date = models.DateField(null=True, blank=True)
+    badges_earned = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Progress for {self.profile.user.username}: {self.total_xp} XP"
+
+
+class Lesson(models.Model):
+    """
+    One lesson of an adventure. Loaded in bulk with ``import_curriculum`` and
+    served to the browser from the in-memory question bank (see miva.lessons).
+    """
+    SUBJECT_MATH = 'math'
+    SUBJECT_READING = 'reading'
+    SUBJECT_SCIENCE = 'science'
+    SUBJECT_CREATIVE = 'creative'
+    SUBJECT_CHOICES = [
+        (SUBJECT_MATH, 'Math Adventures'),
+        (SUBJECT_READING, 'Reading Quest'),
+        (SUBJECT_SCIENCE, 'Science Lab'),
+        (SUBJECT_CREATIVE, 'Creative Studio'),
+    ]
+
+    slug = models.SlugField(max_length=80, unique=True)
+    subject = models.CharField(max_length=20, choices=SUBJECT_CHOICES)
+    position = models.PositiveIntegerField(default=1)
+    title = models.CharField(max_length=200)
+    # Set by the importer, so it changes only when the curriculum is loaded
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['subject', 'position']
+        indexes = [
+            models.Index(fields=['subject', 'position'], name='miva_lesson_subject_position'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} {self.position}: {self.title}"
+
+
+class Question(models.Model):
+    """A multiple-choice question in a lesson's quiz."""
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='questions')
+    position = models.PositiveIntegerField(default=1)
+    prompt = models.TextField()
+    choices = models.JSONField()  # list of answer texts
+    answer = models.PositiveSmallIntegerField()  # index of the correct choice
+    explanation = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['lesson', 'position']
+
+    def __str__(self):
+        return f"{self.lesson.slug} Q{self.position}"
+
+
+class ReviewItem(models.Model):
+    """
+    A learner's spaced-repetition state for one question (SM-2, see
+    miva.reviews), kept in small integer columns: one row per question the
+    learner has answered.
+    """
+    profile = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='review_items')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='review_items')
+    ease = models.PositiveSmallIntegerField(default=2500)  # SM-2 easiness factor x 1000
+    interval = models.PositiveSmallIntegerField(default=0)  # days
+    repetitions = models.PositiveSmallIntegerField(default=0)  # correct answers in a row
+    lapses = models.PositiveSmallIntegerField(default=0)
+    due = models.DateField()
+    last_reviewed = models.DateField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'question'], name='miva_review_profile_question'),
+        ]
+        indexes = [
+            # "Next N due" is a range scan of this index from the start of the learner's rows
+            models.Index(fields=['profile', 'due', 'id'], name='miva_review_profile_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile.user.username} - Q{self.question_id} due {self.due}"
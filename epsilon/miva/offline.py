@@ -0,0 +1,134 @@
+"""
+Offline mode: the service worker and its precache manifest.
+
+The worker (assets/sw.js, served at /sw.js by ``views.service_worker`` with
+the manifest prepended) keeps two caches:
+
+    pages   LESSON_PAGES are served from the cache first and revalidated in
+            the background once older than OFFLINE_REVALIDATE_SECONDS;
+            DASHBOARD_PAGES show live progress, so they come from the network
+            first and from the cache only when offline.
+    assets  every static file those pages load, cache first. Content-hashed
+            names (after ``build_assets``) never change, so they are never
+            revalidated; unhashed ones (under ``runserver``) are, like pages.
+
+Lesson question sets (the question API, see miva.lessons) go in the pages
+cache when first fetched and are revalidated in the background on every
+use: a 304 while unchanged, thanks to their ETags.
+
+Both are filled when the worker installs and named after the manifest
+version, a hash of the page templates, the static files they load and the
+worker itself, so a deploy that changes any of them installs a new worker
+that refetches everything and deletes the old caches.
+
+Progress events (lessons started and finished, quizzes answered) are posted
+to the batch progress API through the worker, which queues them in
+IndexedDB and sends the whole queue in one request; while offline the queue
+waits for the connection to come back (Background Sync where the browser has
+it, otherwise the page's ``online`` event or the next page load).
+
+``manage.py build_precache`` writes the manifest to OFFLINE_PRECACHE_MANIFEST
+at deploy time; without it the manifest is built once per process (on every
+request with DEBUG, so template edits are picked up).
+"""
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template import loader
+from django.templatetags.static import static
+from django.urls import reverse
+
+from . import assets, progress
+
+
+# (URL name, template) of the pages that work offline
+LESSON_PAGES = [
+    ('adventure_math', 'adventure-math.html'),
+    ('adventure_reading', 'adventure-reading.html'),
+    ('adventure_science', 'adventure-science.html'),
+    ('adventure_creative', 'adventure-creative.html'),
+    ('micro_lesson', 'micro-lesson.html'),
+    ('break_timer', 'break-timer.html'),
+]
+DASHBOARD_PAGES = [
+    ('dashboard', 'dashboards/default.html'),
+    ('dashboard_chidi', 'dashboards/chidi.html'),
+    ('dashboard_tunde', 'dashboards/tunde.html'),
+    ('dashboard_ngozi', 'dashboards/ngozi.html'),
+    ('dashboard_parent', 'dashboard-parent.html'),
+    ('dashboard_adult', 'dashboard-adult.html'),
+]
+
+WORKER_SOURCE = 'sw.js'
+
+STATIC_TAG = re.compile(r"\{% static '([^']+)' %\}")
+PARENT_TAG = re.compile(r"""\{% (?:extends|include) ["']([^"']+)["']""")
+
+
+def template_files(name, found=None):
+    """Paths of a template and every template it extends or includes."""
+    found = found if found is not None else {}
+    if name not in found:
+        path = Path(loader.get_template(name).origin.name)
+        found[name] = path
+        for parent in PARENT_TAG.findall(path.read_text(encoding='utf-8')):
+            template_files(parent, found)
+    return found
+
+
+def build_manifest():
+    """The URLs to precache and a version that changes whenever any of them (or the worker) does."""
+    pages = LESSON_PAGES + DASHBOARD_PAGES
+    templates = {}
+    for _, name in pages:
+        template_files(name, templates)
+    static_names = sorted({
+        static_name for path in templates.values()
+        for static_name in STATIC_TAG.findall(path.read_text(encoding='utf-8'))
+    })
+
+    manifest = {
+        'lessons': [reverse(url_name) for url_name, _ in LESSON_PAGES],
+        'dashboards': [reverse(url_name) for url_name, _ in DASHBOARD_PAGES],
+        'assets': [static(name) for name in static_names],
+        'static_url': settings.STATIC_URL,
+        # Manifest storage only hands out hashed names with DEBUG off
+        'hashed': settings.STATIC_ASSETS_BUILT and not settings.DEBUG,
+        'revalidate_after': settings.OFFLINE_REVALIDATE_SECONDS,
+        'content_url': reverse('lesson_index'),
+        'sync_url': reverse('progress_batch'),
+        'sync_batch': progress.MAX_BATCH_EVENTS,
+        'logout_url': reverse('logout'),
+    }
+
+    digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8'))
+    files = [templates[name] for name in sorted(templates)]
+    files += [Path(finders.find(name)) for name in static_names]
+    files.append(assets.source_path(WORKER_SOURCE))
+    for path in files:
+        digest.update(path.read_bytes())
+    manifest['version'] = digest.hexdigest()[:16]
+    return manifest
+
+
+_manifest = None
+
+
+def get_manifest():
+    """The manifest written by ``build_precache``, or one built now if it has not run."""
+    global _manifest
+    if _manifest is None or settings.DEBUG:
+        path = Path(settings.OFFLINE_PRECACHE_MANIFEST)
+        _manifest = json.loads(path.read_text(encoding='utf-8')) if path.exists() else build_manifest()
+    return _manifest
+
+
+def worker_script(manifest=None):
+    """The service worker's source with the manifest it caches from."""
+    manifest = manifest or get_manifest()
+    source = assets.source_path(WORKER_SOURCE).read_text(encoding='utf-8')
+    return f'const PRECACHE = {json.dumps(manifest, sort_keys=True)};\n{source}'
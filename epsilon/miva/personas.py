@@ -0,0 +1,106 @@
+"""
+Server-side persona detection.
+
+Learners are matched to a persona (Chidi, Ngozi or Tunde) from their
+onboarding questionnaire answers. Each (question, answer) pair adds a fixed
+number of points to each persona; the weights are held in one matrix with a
+row per answer and a column per persona, so scoring is a matrix product:
+
+    scores = indicators @ WEIGHTS
+
+where ``indicators`` has a 1 for every answer the learner picked. One learner
+is scored per request with ``detect()``; ``detect_many()`` scores a whole
+batch of stored questionnaires at once (see the ``rescore_personas``
+command). Ties go to the persona listed first, as in the browser.
+
+The weights mirror ``PERSONA_WEIGHTS`` in assets/personas.js, the one
+script every questionnaire page uses for its instant preview.
+"""
+import numpy as np
+
+
+PERSONAS = ('chidi', 'ngozi', 'tunde')
+
+# (question, answer) -> points for (chidi, ngozi, tunde)
+SCORING_TABLE = {
+    ('learning_style', 'visual-active'): (3, 0, 0),
+    ('learning_style', 'audio-patient'): (0, 3, 0),
+    ('learning_style', 'slow-steady'): (0, 0, 3),
+    ('learning_style', 'mixed'): (1, 1, 1),
+
+    ('focus_time', '5'): (3, 0, 0),
+    ('focus_time', '15'): (1, 0, 1),
+    ('focus_time', '30'): (0, 0, 2),
+    ('focus_time', 'flex'): (2, 0, 0),
+
+    ('reading_level', 'struggle'): (1, 3, 0),
+    ('reading_level', 'slow'): (0, 2, 2),
+    ('reading_level', 'ok'): (0, 0, 1),
+    ('reading_level', 'confident'): (0, 0, 0),
+
+    ('learning_goal', 'school'): (1, 0, 1),
+    ('learning_goal', 'life-skills'): (0, 3, 0),
+    ('learning_goal', 'catch-up'): (0, 0, 2),
+    ('learning_goal', 'confidence'): (0, 1, 1),
+}
+
+QUESTIONS = ('learning_style', 'focus_time', 'reading_level', 'learning_goal')
+
+# Questionnaire form field names (as posted by the browser) for each question
+FORM_FIELDS = {
+    'learningStyle': 'learning_style',
+    'focusTime': 'focus_time',
+    'readingLevel': 'reading_level',
+    'learningGoal': 'learning_goal',
+}
+
+# Most answer sets the scoring API accepts in one request
+MAX_BATCH = 500
+
+ANSWER_ROWS = {answer: row for row, answer in enumerate(SCORING_TABLE)}
+WEIGHTS = np.array(list(SCORING_TABLE.values()), dtype=np.int16)
+
+
+def from_form(data):
+    """Answers keyed by question from questionnaire form field names."""
+    return {question: data.get(field, '') for field, question in FORM_FIELDS.items()}
+
+
+def encode(answer_sets):
+    """
+    Indicator matrix for a sequence of answer dicts: one row per learner,
+    one column per known (question, answer). Unknown answers are ignored.
+    """
+    indicators = np.zeros((len(answer_sets), len(ANSWER_ROWS)), dtype=np.int16)
+    for i, answers in enumerate(answer_sets):
+        for question in QUESTIONS:
+            row = ANSWER_ROWS.get((question, answers.get(question)))
+            if row is not None:
+                indicators[i, row] = 1
+    return indicators
+
+
+def score_many(answer_sets):
+    """Score matrix (learners x PERSONAS) for many answer dicts at once."""
+    return encode(answer_sets) @ WEIGHTS
+
+
+def detect_many(answer_sets):
+    """
+    Best persona for each answer dict, or None for a learner who gave no
+    answer we recognise.
+    """
+    indicators = encode(answer_sets)
+    best = (indicators @ WEIGHTS).argmax(axis=1)
+    answered = indicators.any(axis=1)
+    return [PERSONAS[i] if ok else None for i, ok in zip(best, answered)]
+
+
+def score(answers):
+    """Scores for one learner as a ``{persona: points}`` dict."""
+    return dict(zip(PERSONAS, score_many([answers])[0].tolist()))
+
+
+def detect(answers):
+    """Best persona for one learner's answers (None if none were recognised)."""
+    return detect_many([answers])[0]
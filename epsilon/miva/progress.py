@@ -0,0 +1,222 @@
+"""
+Learner progress: streaks, XP, lessons and badges.
+
+Every learner action is appended to ActivityEvent, and the learner's
+LearnerProgress row is updated in the same transaction, so the dashboards
+read one precomputed row instead of scanning the log. ``rebuild()`` (the
+``rebuild_progress`` command) recomputes every row from the log in bulk,
+e.g. after changing the badge rules.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ActivityEvent, LearnerProgress
+
+
+XP_BY_KIND = {
+    ActivityEvent.KIND_VISIT: 0,
+    ActivityEvent.KIND_LESSON_STARTED: 10,
+    ActivityEvent.KIND_LESSON_COMPLETED: 25,
+    ActivityEvent.KIND_QUIZ_COMPLETED: 15,
+}
+
+# Events the browser may report through the progress API
+CLIENT_KINDS = {
+    ActivityEvent.KIND_LESSON_STARTED,
+    ActivityEvent.KIND_LESSON_COMPLETED,
+    ActivityEvent.KIND_QUIZ_COMPLETED,
+}
+
+# Most events accepted in one offline sync batch
+MAX_BATCH_EVENTS = 200
+
+# (badge, aggregate, threshold) - a badge is earned once the aggregate reaches the threshold
+BADGES = [
+    ('first_lesson', 'lessons_completed', 1),
+    ('five_lessons', 'lessons_completed', 5),
+    ('twenty_lessons', 'lessons_completed', 20),
+    ('three_day_streak', 'longest_streak', 3),
+    ('week_streak', 'longest_streak', 7),
+    ('xp_100', 'total_xp', 100),
+    ('xp_500', 'total_xp', 500),
+]
+
+
+def apply_event(progress, kind, xp, day):
+    """Fold one event (on local date ``day``) into a LearnerProgress row."""
+    progress.total_xp += xp
+    if kind == ActivityEvent.KIND_LESSON_COMPLETED:
+        progress.lessons_completed += 1
+
+    last = progress.last_active_date
+    if last is None or day > last:
+        if last is not None and day - last == timedelta(days=1):
+            progress.streak_days += 1
+        else:
+            progress.streak_days = 1
+        progress.last_active_date = day
+        progress.longest_streak = max(progress.longest_streak, progress.streak_days)
+
+    progress.badges_earned = sum(
+        1 for _, field, threshold in BADGES if getattr(progress, field) >= threshold
+    )
+
+
+def client_xp(kind, xp):
+    """
+    XP for an event the browser reported: its own figure (e.g. a partly
+    answered quiz) clamped to what the kind is worth, the full award if it
+    sent none or a non-number.
+    """
+    most = XP_BY_KIND.get(kind, 0)
+    if not isinstance(xp, (int, float)) or isinstance(xp, bool) or xp != xp:
+        return most
+    return int(min(max(xp, 0), most))
+
+
+def record_event(profile, kind, xp=None):
+    """Append an event to the log and update the learner's aggregates."""
+    if xp is None:
+        xp = XP_BY_KIND.get(kind, 0)
+    with transaction.atomic():
+        event = ActivityEvent.objects.create(profile=profile, kind=kind, xp=xp)
+        progress, created = LearnerProgress.objects.select_for_update().get_or_create(profile=profile)
+        apply_event(progress, kind, xp, timezone.localdate(event.created_at))
+        progress.save()
+    return progress
+
+
+def client_events(items, now=None):
+    """
+    Validate events queued by the browser, each ``{"id", "kind", "at"}`` with
+    ``at`` in milliseconds since the epoch and an optional ``xp`` (clamped by
+    ``client_xp``; a quiz_completed event may also carry its graded
+    ``answers``). Returns ``(events, rejected ids)``;
+    timestamps are clamped to the last OFFLINE_EVENT_MAX_AGE_DAYS so a clock
+    that is wrong (or a queue forgotten for weeks) cannot rewrite old streaks.
+    """
+    now = now or timezone.now()
+    earliest = now - timedelta(days=settings.OFFLINE_EVENT_MAX_AGE_DAYS)
+    events, rejected = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        event_id = item.get('id')
+        if not isinstance(event_id, str) or not 0 < len(event_id) <= 64:
+            continue
+        at = item.get('at')
+        if item.get('kind') not in CLIENT_KINDS or not isinstance(at, (int, float)) or isinstance(at, bool):
+            rejected.append(event_id)
+            continue
+        try:
+            created_at = datetime.fromtimestamp(at / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            rejected.append(event_id)
+            continue
+        event = {
+            'id': event_id, 'kind': item['kind'], 'at': min(max(created_at, earliest), now),
+            'xp': client_xp(item['kind'], item.get('xp')),
+        }
+        if isinstance(item.get('answers'), list):
+            event['answers'] = item['answers']  # graded quiz answers, scheduled by miva.reviews
+        events.append(event)
+    return events, rejected
+
+
+def record_batch(profile, events):
+    """
+    Record events from ``client_events`` in one transaction, oldest first.
+    Events whose id is already in the log are skipped, so a batch the browser
+    retries after a lost response is only counted once. An offline day older
+    than the learner's latest activity earns its XP now but only counts towards
+    the streak after ``rebuild``. Returns ``(progress, ids recorded)``.
+    """
+    with transaction.atomic():
+        # Locking the progress row serialises concurrent batches from one learner
+        progress, created = LearnerProgress.objects.select_for_update().get_or_create(profile=profile)
+        seen = set(ActivityEvent.objects.filter(
+            profile=profile, client_id__in=[event['id'] for event in events],
+        ).values_list('client_id', flat=True))
+        new = []
+        for event in sorted(events, key=lambda event: event['at']):
+            if event['id'] in seen:
+                continue
+            seen.add(event['id'])
+            xp = event.get('xp', XP_BY_KIND.get(event['kind'], 0))
+            new.append(ActivityEvent(
+                profile=profile, kind=event['kind'], xp=xp, created_at=event['at'], client_id=event['id'],
+            ))
+            apply_event(progress, event['kind'], xp, timezone.localdate(event['at']))
+        ActivityEvent.objects.bulk_create(new)
+        progress.save()
+    return progress, [event.client_id for event in new]
+
+
+def record_visit(profile):
+    """Count today towards the streak; writes at most once per day."""
+    progress = get_progress(profile)
+    if progress.last_active_date != timezone.localdate():
+        progress = record_event(profile, ActivityEvent.KIND_VISIT)
+    return progress
+
+
+def get_progress(profile):
+    """The learner's progress row (an unsaved empty one if they have no activity)."""
+    progress = LearnerProgress.objects.filter(profile=profile).first()
+    return progress or LearnerProgress(profile=profile)
+
+
+def current_streak(progress, today=None):
+    """The streak as of today: zero once a whole day has been missed."""
+    today = today or timezone.localdate()
+    if progress.last_active_date is None or today - progress.last_active_date > timedelta(days=1):
+        return 0
+    return progress.streak_days
+
+
+def dashboard_stats(progress):
+    """Template context for the streak/points/lessons/badges widgets."""
+    return {
+        'streak_days': current_streak(progress),
+        'total_points': progress.total_xp,
+        'lessons_completed': progress.lessons_completed,
+        'badges_earned': progress.badges_earned,
+    }
+
+
+def rebuild(profile_ids=None, chunk_size=2000):
+    """
+    Recompute LearnerProgress from the activity log in one pass over the
+    events (streamed in ``chunk_size`` batches). Returns the number of rows
+    written.
+    """
+    events = ActivityEvent.objects.order_by('profile_id', 'created_at', 'id')
+    if profile_ids is not None:
+        events = events.filter(profile_id__in=profile_ids)
+
+    rows = []
+    current = None
+    for profile_id, kind, xp, created_at in events.values_list(
+        'profile_id', 'kind', 'xp', 'created_at'
+    ).iterator(chunk_size=chunk_size):
+        if current is None or current.profile_id != profile_id:
+            current = LearnerProgress(profile_id=profile_id)
+            rows.append(current)
+        apply_event(current, kind, xp, timezone.localdate(created_at))
+
+    with transaction.atomic():
+        stale = LearnerProgress.objects.all()
+        if profile_ids is not None:
+            stale = stale.filter(profile_id__in=profile_ids)
+        stale.delete()
+        LearnerProgress.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def reset(profile):
+    """Delete the learner's activity log and progress."""
+    ActivityEvent.objects.filter(profile=profile).delete()
+    LearnerProgress.objects.filter(profile=profile).delete()
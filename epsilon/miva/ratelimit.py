@@ -0,0 +1,219 @@
+"""
+Per-learner rate limiting for the chat socket.
+
+Each learner has a token bucket per budget in CHAT_RATE_LIMITS:
+
+    messages            chat messages and finished uploads
+    upload_bytes        bytes of uploaded files
+    extraction_seconds  seconds spent extracting text from documents
+
+A bucket holds up to ``burst`` tokens and refills at ``per_minute`` tokens a
+minute. ``take`` spends tokens up front and refuses when there are not
+enough; ``charge`` spends them after the fact (extraction time is only known
+once it is done) and may leave the bucket in debt, so the learner's next
+upload waits until it has paid that back.
+
+Learners are identified by their account when signed in. Anonymous sockets
+are charged to two buckets, their chat session's and their client address's;
+the address bucket holds CHAT_RATE_LIMIT_ADDRESS_SCALE times the budget, so a
+few learners behind one NAT or proxy are not throttled together but opening
+new sessions from one address does not reset the limits. Nothing the browser
+sends is used as a key. Buckets live in this process by default;
+CHAT_RATE_LIMIT_STORE = 'redis' shares them between workers.
+"""
+import asyncio
+import math
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+
+# Keys with this prefix are client addresses, shared by everyone behind them
+ADDRESS_PREFIX = 'address:'
+
+USER_MESSAGES = {
+    'messages': "You're sending messages faster than Tega can keep up. Please wait {wait} and try again.",
+    'upload_bytes': "You've uploaded a lot in a short time. Please wait {wait} before uploading more.",
+    'extraction_seconds': 'Tega is still busy reading your earlier documents. Please wait {wait} before uploading another.',
+}
+
+
+class RateLimited(Exception):
+    """Raised when a learner has used up one of their budgets."""
+
+    def __init__(self, budget, retry_after):
+        self.budget = budget
+        self.retry_after = retry_after
+        seconds = math.ceil(retry_after)
+        wait = '1 second' if seconds <= 1 else f'{seconds} seconds'
+        super().__init__(USER_MESSAGES.get(budget, 'Please wait {wait}.').format(wait=wait))
+
+    def frame(self):
+        """The error frame sent to the browser."""
+        return {
+            'type': 'rate_limited',
+            'budget': self.budget,
+            'retry_after': math.ceil(self.retry_after),
+            'error': str(self),
+        }
+
+
+class InMemoryBucketStore:
+    """Token buckets for a single Daphne process (the default)."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    async def update(self, key, rate, burst, cost, force=False):
+        """
+        Refill bucket ``key`` and spend ``cost`` tokens if it holds enough (or
+        regardless, with ``force``). Returns ``(allowed, tokens left)``.
+        """
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = force or tokens >= cost
+        if allowed:
+            tokens -= cost
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        # A bucket untouched for an hour has long since refilled: forget it
+        for key in [k for k, (_, updated) in self.buckets.items() if now - updated > 3600]:
+            del self.buckets[key]
+
+
+# Refill and spend atomically; Redis' clock is used so workers agree on time
+UPDATE_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+if tokens == nil or updated == nil then
+    tokens = burst
+    updated = now
+end
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local allowed = ARGV[4] == '1' or tokens >= cost
+if allowed then
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+if allowed then
+    return {1, tostring(tokens)}
+end
+return {0, tostring(tokens)}
+'''
+
+
+class RedisBucketStore:
+    """Token buckets in Redis, shared by every worker (one hash per bucket)."""
+
+    def __init__(self, url, prefix='chat:ratelimit:'):
+        self.url = url
+        self.prefix = prefix
+        self.client = None
+        self.script = None
+        self.loop = None
+
+    def _redis(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop:
+            import redis.asyncio as redis
+            self.client = redis.from_url(self.url)
+            self.script = self.client.register_script(UPDATE_SCRIPT)
+            self.loop = loop
+        return self.client
+
+    async def update(self, key, rate, burst, cost, force=False):
+        self._redis()
+        allowed, tokens = await self.script(
+            keys=[f'{self.prefix}{key}'], args=[rate, burst, cost, '1' if force else '0'],
+        )
+        return bool(allowed), float(tokens)
+
+
+class RateLimiter:
+    """Applies the CHAT_RATE_LIMITS budgets to learners' token buckets."""
+
+    def __init__(self, store):
+        self.store = store
+        self.allowed = 0
+        self.refused = {}
+
+    def _budget(self, budget):
+        # Read on every call so limits can be changed (or removed) without a restart
+        limit = settings.CHAT_RATE_LIMITS.get(budget)
+        if not limit:
+            return None
+        return limit['per_minute'] / 60.0, limit['burst']
+
+    def _buckets(self, learner, rate, burst):
+        """``(key, rate, burst)`` of each bucket ``learner`` (a key or tuple of keys) is charged to."""
+        for key in (learner,) if isinstance(learner, str) else learner:
+            scale = settings.CHAT_RATE_LIMIT_ADDRESS_SCALE if key.startswith(ADDRESS_PREFIX) else 1
+            yield key, rate * scale, burst * scale
+
+    async def take(self, learner, budget, cost=1):
+        """
+        Spend ``cost`` from each of ``learner``'s ``budget`` buckets, or raise
+        RateLimited (and spend nothing) if any of them is short.
+        """
+        limit = self._budget(budget)
+        if limit is None:
+            return
+        taken = []
+        for key, rate, burst in self._buckets(learner, *limit):
+            # More than a full bucket could never be admitted; charge a full bucket instead
+            spend = min(cost, burst)
+            allowed, tokens = await self.store.update(f'{budget}:{key}', rate, burst, spend)
+            if not allowed:
+                for key, rate, burst, spent in taken:
+                    await self.store.update(f'{budget}:{key}', rate, burst, -spent, force=True)
+                self.refused[budget] = self.refused.get(budget, 0) + 1
+                metrics.RATE_LIMITED.inc(budget=budget)
+                raise RateLimited(budget, (spend - tokens) / rate)
+            taken.append((key, rate, burst, spend))
+        self.allowed += 1
+
+    async def charge(self, learner, budget, cost):
+        """Spend ``cost`` after the fact; the buckets may go into debt."""
+        limit = self._budget(budget)
+        if limit is None or cost <= 0:
+            return
+        for key, rate, burst in self._buckets(learner, *limit):
+            await self.store.update(f'{budget}:{key}', rate, burst, cost, force=True)
+
+    def stats(self):
+        """Admissions granted and refusals per budget."""
+        return {
+            'allowed': self.allowed,
+            'refused': dict(self.refused),
+            'buckets': len(getattr(self.store, 'buckets', ())),
+        }
+
+
+_limiter = None
+
+
+def get_limiter():
+    """Return the process-wide RateLimiter on the store selected by CHAT_RATE_LIMIT_STORE."""
+    global _limiter
+    if _limiter is None:
+        if settings.CHAT_RATE_LIMIT_STORE == 'redis':
+            store = RedisBucketStore(settings.REDIS_URL)
+        else:
+            store = InMemoryBucketStore()
+        _limiter = RateLimiter(store)
+    return _limiter
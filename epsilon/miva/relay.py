@@ -0,0 +1,164 @@
+"""
+Streaming relay of AI engine replies to the browser.
+
+Upstream replies may arrive one token at a time. Forwarding each fragment as
+its own WebSocket frame means a frame, a DOM update and a markdown re-parse
+per token, so the relay coalesces fragments for a short flush interval and
+sends the browser a small streaming protocol keyed by a message id::
+
+    {"type": "delta", "id": "<message id>", "text": "<new text>"}
+    {"type": "done",  "id": "<message id>"}
+
+Upstream frames are classified as:
+
+    end of stream    type in END_TYPES, or done=true -> flushed, then "done"
+    stream fragment  type in STREAM_TYPES          -> appended to the open reply
+    error            has an "error" key            -> forwarded unchanged
+    whole message    anything else                 -> one delta + "done"
+
+A stream with no end marker is closed after ``idle_timeout`` seconds of
+silence so the browser can finish rendering it.
+"""
+import asyncio
+import uuid
+
+from . import codec
+
+
+STREAM_TYPES = {'delta', 'token', 'chunk', 'stream'}
+END_TYPES = {'done', 'end', 'stream_end', 'complete'}
+TEXT_KEYS = ('delta', 'token', 'message', 'response', 'text')
+
+
+def fragment_text(data):
+    """Pick the text out of an upstream frame, whichever key it uses."""
+    for key in TEXT_KEYS:
+        value = data.get(key)
+        if isinstance(value, str):
+            return value
+    return ''
+
+
+class ReplyRelay:
+    """
+    Coalesces upstream reply fragments into delta/done frames.
+
+    ``send`` is an async callable that takes one frame (a dict) for the
+    browser. ``on_finish``, if given, is awaited with the message id and the
+    full reply text each time a reply is done.
+    """
+
+    def __init__(self, send, flush_interval=0.04, idle_timeout=5.0, on_finish=None):
+        self.send = send
+        self.on_finish = on_finish
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+
+        self.message_id = None
+        self.pending = []
+        self.reply_parts = []
+        self.last_fragment = 0.0
+        self.emit_lock = asyncio.Lock()
+        self.flush_task = None
+        self.idle_task = None
+
+        self.fragments = 0
+        self.frames_sent = 0
+
+    async def feed(self, raw_text):
+        """Handle one frame of text from the AI engine."""
+        try:
+            data = codec.loads(raw_text)
+        except ValueError:
+            data = {'message': raw_text}
+        if not isinstance(data, dict):
+            data = {'message': raw_text}
+
+        if 'error' in data:
+            await self.finish()
+            await self._emit(data)
+            return
+
+        frame_type = data.get('type')
+        text = fragment_text(data)
+
+        if frame_type in END_TYPES or data.get('done') is True:
+            # Checked first: the last fragment of a stream may carry done=true
+            self._append(text)
+            await self.finish()
+        elif frame_type in STREAM_TYPES:
+            self._append(text)
+        else:
+            # A complete, non-streamed reply
+            await self.finish()
+            self._append(text)
+            await self.finish()
+
+    def _append(self, text):
+        if self.message_id is None:
+            self.message_id = uuid.uuid4().hex[:12]
+            self.idle_task = asyncio.create_task(self._close_when_idle())
+        self.last_fragment = asyncio.get_running_loop().time()
+        if not text:
+            return
+        self.fragments += 1
+        self.pending.append(text)
+        self.reply_parts.append(text)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def _close_when_idle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            remaining = self.last_fragment + self.idle_timeout - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        self.idle_task = None
+        await self.finish()
+
+    async def flush(self):
+        """Send everything buffered for the open reply as one delta frame."""
+        if not self.pending or self.message_id is None:
+            return
+        text = ''.join(self.pending)
+        self.pending = []
+        await self._emit({'type': 'delta', 'id': self.message_id, 'text': text})
+
+    async def finish(self):
+        """Flush the open reply (if any) and mark it done."""
+        if self.message_id is None:
+            return
+        await self.flush()
+        message_id = self.message_id
+        reply_text = ''.join(self.reply_parts)
+        self.message_id = None
+        self.reply_parts = []
+        if self.idle_task is not None and self.idle_task is not asyncio.current_task():
+            self.idle_task.cancel()
+        self.idle_task = None
+        await self._emit({'type': 'done', 'id': message_id})
+        if self.on_finish is not None:
+            await self.on_finish(message_id, reply_text)
+
+    @property
+    def streaming(self):
+        """True while a reply is open (started but not yet done)."""
+        return self.message_id is not None
+
+    async def _emit(self, frame):
+        async with self.emit_lock:
+            await self.send(frame)
+            self.frames_sent += 1
+
+    async def close(self):
+        """Stop background timers (the socket is going away)."""
+        for task in (self.flush_task, self.idle_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self.flush_task = None
+        self.idle_task = None
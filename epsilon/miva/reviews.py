@@ -0,0 +1,250 @@
+"""
+Spaced repetition: SM-2 review scheduling for quiz questions.
+
+Every question a learner answers gets a ReviewItem. Each answer is graded
+0-5 (5 = instant recall, below 3 = forgotten) and moves the item along the
+SM-2 schedule:
+
+    grade >= 3   the interval goes 1 day, 6 days, then grows by the easiness
+                 factor each time, and the factor moves by
+                 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02)  (min 1.3)
+    grade < 3    back to a 1 day interval; the factor is kept
+
+``sm2`` works on numpy arrays, so a batch of answers from the API (or a
+whole synthetic cohort in ``bench_reviews``) is scheduled in a handful of
+vector operations instead of a Python loop per item.
+
+"Next N due" (``due_items``) is a range scan of the (profile, due, id)
+index: it reads N rows however many items the learner has.
+
+``rebalance`` (the nightly ``rebalance_reviews`` command) spreads each
+learner's reviews so that no day has more than REVIEW_DAILY_LIMIT due.
+After a few missed days the backlog is spread over the following days
+instead of landing all at once. Items only ever move later, and a learner's
+items fall due in the same order as before. It works on whole cohorts, a
+chunk of learners per query, with the per-day packing done by ``spread`` in
+numpy.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LearnerProgress, ReviewItem
+
+
+MIN_EASE = 1300  # easiness factor x 1000
+PASS_GRADE = 3
+MAX_GRADE = 5
+MAX_INTERVAL = 3650  # days
+
+# Most graded answers accepted in one request, and most due items returned
+MAX_BATCH_ANSWERS = 200
+MAX_DUE_ITEMS = 100
+
+SCHEDULE_FIELDS = ['ease', 'interval', 'repetitions', 'lapses', 'due', 'last_reviewed']
+
+
+def sm2(ease, interval, repetitions, grade):
+    """
+    Apply one graded answer to each item; all arguments are arrays (or
+    scalars) of the ReviewItem columns. Returns the new
+    ``(ease, interval, repetitions)`` as int32 arrays.
+    """
+    ease = np.asarray(ease, dtype=np.int32)
+    interval = np.asarray(interval, dtype=np.int32)
+    repetitions = np.asarray(repetitions, dtype=np.int32)
+    grade = np.asarray(grade, dtype=np.int32)
+
+    passed = grade >= PASS_GRADE
+    miss = MAX_GRADE - grade
+    # The SM-2 adjustment, in thousandths: 1000 * (0.1 - miss * (0.08 + miss * 0.02))
+    new_ease = np.where(passed, np.maximum(MIN_EASE, ease + 100 - miss * (80 + miss * 20)), ease)
+
+    grown = np.rint(interval * (ease / 1000.0)).astype(np.int32)
+    new_interval = np.where(repetitions == 0, 1, np.where(repetitions == 1, 6, grown))
+    new_interval = np.where(passed, np.minimum(new_interval, MAX_INTERVAL), 1)
+    new_repetitions = np.where(passed, np.minimum(repetitions + 1, 32767), 0)
+    return new_ease.astype(np.int32), new_interval.astype(np.int32), new_repetitions.astype(np.int32)
+
+
+def parse_answers(items, known_questions):
+    """
+    Validate ``[{"question": id, "grade": 0-5}, ...]`` from the browser.
+    Returns ``(answers, rejected)``: ``(question id, grade)`` pairs for
+    questions in ``known_questions``, and the entries that were not.
+    """
+    answers, rejected = [], []
+    for item in items:
+        question = item.get('question') if isinstance(item, dict) else None
+        grade = item.get('grade') if isinstance(item, dict) else None
+        if (
+            isinstance(question, int) and not isinstance(question, bool) and question in known_questions
+            and isinstance(grade, int) and not isinstance(grade, bool) and 0 <= grade <= MAX_GRADE
+        ):
+            answers.append((question, grade))
+        else:
+            rejected.append(item)
+    return answers, rejected
+
+
+def record_answers(profile, answers, today=None):
+    """
+    Schedule a batch of ``(question id, grade)`` answers for one learner in
+    one transaction: one query for the existing items, one ``sm2`` pass and
+    a bulk write each for updated and new items. A question answered twice
+    in the batch takes its last grade. An answer given before the item was
+    last reviewed (a quiz taken offline and synced late) is skipped, so it
+    never moves a newer schedule back. Returns the scheduled ReviewItems.
+
+    The learner's progress row is locked first, so concurrent batches from
+    one learner take turns; new items are inserted ignoring conflicts, so
+    on a database without row locks a race to create the same item keeps
+    the first schedule instead of failing.
+    """
+    today = today or timezone.localdate()
+    grades = dict(answers)
+    if not grades:
+        return []
+    with transaction.atomic():
+        LearnerProgress.objects.select_for_update().get_or_create(profile=profile)
+        existing = {
+            item.question_id: item
+            for item in ReviewItem.objects.select_for_update().filter(profile=profile, question_id__in=grades)
+        }
+        grades = {
+            question_id: grade for question_id, grade in grades.items()
+            if question_id not in existing or existing[question_id].last_reviewed is None
+            or existing[question_id].last_reviewed <= today
+        }
+        if not grades:
+            return []
+        items = [existing.get(question_id) or ReviewItem(profile=profile, question_id=question_id, due=today)
+                 for question_id in grades]
+        ease, interval, repetitions = sm2(
+            [item.ease for item in items],
+            [item.interval for item in items],
+            [item.repetitions for item in items],
+            list(grades.values()),
+        )
+        for item, grade, new_ease, new_interval, new_repetitions in zip(
+            items, grades.values(), ease.tolist(), interval.tolist(), repetitions.tolist()
+        ):
+            if grade < PASS_GRADE and item.repetitions:
+                item.lapses += 1
+            item.ease, item.interval, item.repetitions = new_ease, new_interval, new_repetitions
+            item.due = today + timedelta(days=new_interval)
+            item.last_reviewed = today
+        ReviewItem.objects.bulk_update([item for item in items if item.pk], SCHEDULE_FIELDS, batch_size=500)
+        new = [item for item in items if not item.pk]
+        ReviewItem.objects.bulk_create(new, batch_size=500, ignore_conflicts=True)
+        if new:
+            # ignore_conflicts leaves primary keys unset; read back what was stored
+            items = list(ReviewItem.objects.filter(profile=profile, question_id__in=grades).order_by('question_id'))
+    return items
+
+
+def due_items(profile, limit=20, today=None):
+    """The learner's ``limit`` most overdue items due by ``today``, oldest first."""
+    today = today or timezone.localdate()
+    limit = max(1, min(limit, MAX_DUE_ITEMS))
+    return list(ReviewItem.objects.filter(profile=profile, due__lte=today).order_by('due', 'id')[:limit])
+
+
+def due_count(profile, today=None):
+    today = today or timezone.localdate()
+    return ReviewItem.objects.filter(profile=profile, due__lte=today).count()
+
+
+def item_dict(item, bank):
+    """JSON for one scheduled item; the question itself comes from the lesson's question set."""
+    return {
+        'question': item.question_id,
+        'lesson': bank.question_lessons.get(item.question_id),
+        'due': item.due.isoformat(),
+        'interval': item.interval,
+        'repetitions': item.repetitions,
+    }
+
+
+# -- Nightly rebalance ---------------------------------------------------
+
+def spread(learner, due, today, daily_limit):
+    """
+    New due days for parallel arrays of learner ids and due days (day
+    ordinals) so that no learner has more than ``daily_limit`` items due on
+    any day from ``today`` on; overdue items count as due today. Items only
+    move later and each learner's items keep their order. The arrays must
+    hold every item of the learners in them.
+
+    Sorted by (learner, due), a learner's p-th item can be no earlier than
+    the (p - daily_limit)-th plus one day, and no earlier than it was due.
+    Within one residue class p % daily_limit that recurrence,
+    new[j] = max(due[j], new[j - 1] + 1), has the closed form
+    new[j] = j + cummax(due[j] - j), a running maximum numpy does in one pass.
+    """
+    learner = np.asarray(learner, dtype=np.int64)
+    due = np.asarray(due, dtype=np.int64)
+    if not len(due):
+        return due.copy()
+    effective = np.maximum(due, today)
+
+    # Ties (e.g. everything overdue) go to whatever has been due longest
+    order = np.lexsort((due, effective, learner))
+    sorted_learner = learner[order]
+    first = np.r_[True, sorted_learner[1:] != sorted_learner[:-1]]
+    starts = np.flatnonzero(first)
+    group = np.cumsum(first) - 1
+    position = np.arange(len(order)) - starts[group]
+    residue = position % daily_limit
+    step = position // daily_limit
+
+    # Lay each (learner, residue) class out contiguously, in due order
+    classes = np.lexsort((step, residue, group))
+    klass = (group * daily_limit + residue)[classes]
+    step = step[classes]
+    base = effective[order][classes] - step
+    lowest = base.min()
+    width = base.max() - lowest + 1
+    # Offsetting every class above the one before makes the running maximum restart per class
+    offset = klass * width
+    packed = np.maximum.accumulate(base - lowest + offset) - offset + lowest + step
+
+    new = np.empty_like(due)
+    new[order[classes]] = packed
+    # Leave items alone that need not move (keeping how overdue they are)
+    return np.where(new == effective, due, new)
+
+
+def rebalance(today=None, daily_limit=None, chunk_size=1000, dry_run=False):
+    """
+    Apply ``spread`` to every learner's items, ``chunk_size`` learners at a
+    time: one query to read a chunk's (id, learner, due), one vectorized
+    spread and one bulk update of the items that moved. Returns
+    ``(items, moved)``.
+    """
+    today = today or timezone.localdate()
+    daily_limit = daily_limit or settings.REVIEW_DAILY_LIMIT
+    profile_ids = list(ReviewItem.objects.order_by('profile_id').values_list('profile_id', flat=True).distinct())
+
+    items = moved = 0
+    for start in range(0, len(profile_ids), chunk_size):
+        rows = list(ReviewItem.objects.filter(
+            profile_id__in=profile_ids[start:start + chunk_size],
+        ).values_list('id', 'profile_id', 'due'))
+        if not rows:
+            continue
+        ids, learners, dues = zip(*rows)
+        due = np.fromiter((day.toordinal() for day in dues), dtype=np.int64, count=len(dues))
+        new = spread(np.array(learners), due, today.toordinal(), daily_limit)
+        changed = np.flatnonzero(new != due)
+        items += len(rows)
+        moved += len(changed)
+        if len(changed) and not dry_run:
+            ReviewItem.objects.bulk_update(
+                [ReviewItem(id=ids[i], due=date.fromordinal(int(new[i]))) for i in changed.tolist()],
+                ['due'], batch_size=1000,
+            )
+    return items, moved
@@ -0,0 +1,179 @@
+"""
+Chat session state shared between Daphne workers.
+
+Each chat socket belongs to a session identified by a random token the
+browser keeps in sessionStorage. Every frame the relay sends is numbered and
+appended to a short replay log for the session, so when a socket drops and
+the browser reconnects (possibly to a different worker behind the load
+balancer) it can ask for everything after the last sequence number it saw.
+
+The in-memory store only works for a single process; the Redis store is
+used for multi-process deployments (CHAT_SESSION_STORE = 'redis').
+"""
+import asyncio
+import re
+import time
+import uuid
+
+from django.conf import settings
+
+
+TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+def valid_token(token):
+    return bool(token) and bool(TOKEN_RE.match(token))
+
+
+class InMemorySessionStore:
+    """Session store for a single Daphne process (the default)."""
+
+    def __init__(self, ttl=3600, max_frames=500):
+        self.ttl = ttl
+        self.max_frames = max_frames
+        self.sessions = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for token in [t for t, s in self.sessions.items() if s['expires'] < now]:
+            del self.sessions[token]
+
+    async def open(self, token, owner):
+        """
+        Return ``(token, resumed)``. An existing session owned by ``owner``
+        is resumed; otherwise a fresh session is created.
+        """
+        self._expire()
+        session = self.sessions.get(token) if valid_token(token) else None
+        if session is not None and session['owner'] == owner:
+            session['expires'] = time.monotonic() + self.ttl
+            return token, True
+        token = new_token()
+        self.sessions[token] = {
+            'owner': owner,
+            'seq': 0,
+            'frames': [],
+            'expires': time.monotonic() + self.ttl,
+        }
+        return token, False
+
+    async def next_seq(self, token):
+        session = self.sessions.get(token)
+        if session is None:
+            return 0
+        session['seq'] += 1
+        return session['seq']
+
+    async def append(self, token, seq, text):
+        session = self.sessions.get(token)
+        if session is None:
+            return
+        session['frames'].append((seq, text))
+        del session['frames'][:-self.max_frames]
+        session['expires'] = time.monotonic() + self.ttl
+
+    async def replay(self, token, after_seq):
+        """Frames with a sequence number greater than ``after_seq``, in order."""
+        session = self.sessions.get(token)
+        if session is None:
+            return []
+        return [(seq, text) for seq, text in session['frames'] if seq > after_seq]
+
+
+class RedisSessionStore:
+    """
+    Session store backed by Redis, shared by every worker.
+
+    A session is a hash ``<prefix><token>`` holding the owner and the
+    sequence counter, plus a capped list ``<prefix><token>:frames`` of
+    ``"<seq>:<frame json>"`` entries. Both keys expire after ``ttl`` seconds
+    without activity.
+    """
+
+    def __init__(self, url, ttl=3600, max_frames=500, prefix='chat:session:'):
+        self.url = url
+        self.ttl = ttl
+        self.max_frames = max_frames
+        self.prefix = prefix
+        self.client = None
+        self.loop = None
+
+    def _redis(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop:
+            import redis.asyncio as redis
+            self.client = redis.from_url(self.url)
+            self.loop = loop
+        return self.client
+
+    def _keys(self, token):
+        key = f'{self.prefix}{token}'
+        return key, f'{key}:frames'
+
+    async def open(self, token, owner):
+        client = self._redis()
+        if valid_token(token):
+            key, frames_key = self._keys(token)
+            stored_owner = await client.hget(key, 'owner')
+            if stored_owner is not None and stored_owner.decode() == owner:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.expire(key, self.ttl)
+                    pipe.expire(frames_key, self.ttl)
+                    await pipe.execute()
+                return token, True
+
+        token = new_token()
+        key, _ = self._keys(token)
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={'owner': owner, 'seq': 0})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        return token, False
+
+    async def next_seq(self, token):
+        key, _ = self._keys(token)
+        return await self._redis().hincrby(key, 'seq', 1)
+
+    async def append(self, token, seq, text):
+        key, frames_key = self._keys(token)
+        async with self._redis().pipeline(transaction=False) as pipe:
+            pipe.rpush(frames_key, f'{seq}:{text}')
+            pipe.ltrim(frames_key, -self.max_frames, -1)
+            pipe.expire(frames_key, self.ttl)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def replay(self, token, after_seq):
+        _, frames_key = self._keys(token)
+        frames = []
+        for entry in await self._redis().lrange(frames_key, 0, -1):
+            seq, _, text = entry.decode().partition(':')
+            if int(seq) > after_seq:
+                frames.append((int(seq), text))
+        return frames
+
+
+_store = None
+
+
+def get_store():
+    """Return the process-wide session store selected by CHAT_SESSION_STORE."""
+    global _store
+    if _store is None:
+        if settings.CHAT_SESSION_STORE == 'redis':
+            _store = RedisSessionStore(
+                settings.REDIS_URL,
+                ttl=settings.CHAT_SESSION_TTL,
+                max_frames=settings.CHAT_SESSION_MAX_FRAMES,
+            )
+        else:
+            _store = InMemorySessionStore(
+                ttl=settings.CHAT_SESSION_TTL,
+                max_frames=settings.CHAT_SESSION_MAX_FRAMES,
+            )
+    return _store
@@ -0,0 +1,137 @@
+"""
+A local stand-in for the external AI engine, for tests and load tests.
+
+It speaks the same WebSocket protocol as the real engine: every chat frame
+gets a reply streamed as ``delta`` frames followed by ``done``, with the
+request's ``correlation_id`` echoed back. Its ``mode`` can be switched at
+any time to simulate an unhealthy engine:
+
+    normal   reply to every frame
+    drop     close the connection when the next frame arrives
+    stall    accept frames but never reply
+    refuse   reject new connections (HTTP 503); open ones keep working
+
+When run as a server (``manage.py run_stub_engine``) the mode can also be
+changed with ``POST /mode?set=<mode>``.
+"""
+import asyncio
+import json
+
+from aiohttp import WSMsgType, web
+
+
+MODES = ('normal', 'drop', 'stall', 'refuse')
+
+
+class StubEngine:
+    """
+    aiohttp WebSocket server answering ``You said: <message>``.
+
+    ``latency`` is the delay before the first fragment, ``chunk_delay`` the
+    delay between fragments and ``chunk_words`` the words per fragment
+    (0 sends the whole reply as a single non-streamed frame).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, chunk_delay=0.0, chunk_words=1, mode='normal'):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.mode = mode
+        self.runner = None
+        self.sockets = set()
+
+        self.connections = 0
+        self.requests = 0
+        self.refused = 0
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/ws/chat'
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/ws/chat', self.handle)
+        app.router.add_post('/mode', self.set_mode)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.url
+
+    async def stop(self):
+        for ws in list(self.sockets):
+            await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def drop_all(self):
+        """Close every open connection (as an engine restart would)."""
+        for ws in list(self.sockets):
+            await ws.close()
+
+    async def set_mode(self, request):
+        mode = request.query.get('set')
+        if mode not in MODES:
+            raise web.HTTPBadRequest(text=f'mode must be one of {", ".join(MODES)}')
+        self.mode = mode
+        if mode == 'drop':
+            await self.drop_all()
+        return web.json_response({'mode': self.mode, 'connections': len(self.sockets)})
+
+    async def handle(self, request):
+        if self.mode == 'refuse':
+            self.refused += 1
+            raise web.HTTPServiceUnavailable()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        self.sockets.add(ws)
+        tasks = set()
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                if self.mode == 'drop':
+                    break
+                self.requests += 1
+                if self.mode == 'stall':
+                    continue
+                # Reply concurrently, as the real engine does for multiplexed sessions
+                task = asyncio.create_task(self.reply(ws, msg.data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self.sockets.discard(ws)
+            for task in tasks:
+                task.cancel()
+            await ws.close()
+        return ws
+
+    async def reply(self, ws, raw):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = {'message': raw}
+        correlation_id = data.get('correlation_id')
+        text = f"You said: {data.get('message', '')}"
+
+        await asyncio.sleep(self.latency)
+        try:
+            if self.chunk_words <= 0:
+                await ws.send_json({'message': text, 'correlation_id': correlation_id})
+                return
+            words = text.split(' ')
+            for start in range(0, len(words), self.chunk_words):
+                piece = ' '.join(words[start:start + self.chunk_words])
+                if start:
+                    piece = ' ' + piece
+                await ws.send_json({'type': 'delta', 'delta': piece, 'correlation_id': correlation_id})
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+            await ws.send_json({'type': 'done', 'correlation_id': correlation_id})
+        except ConnectionResetError:
+            pass
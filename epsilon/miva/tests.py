@@ -1,3 +1,2035 @@
-from django.test import TestCase
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.shortcuts import render
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import assets, chunking, codec, doc_cache, documents, extraction, extractors, history, learner, lessons, metrics, offline, personas, progress, ratelimit, relay, reviews, sessions, stub_engine, upstream, uploads, urls
+from .consumers import ChatConsumer
+from .models import ActivityEvent, ChatMessage, LearnerPreferences, LearnerProgress, Lesson, Question, QuizResult, ReviewItem, UserProfile
+
+
+class FakeRedisServer:
+    """
+    Minimal Redis (RESP2/RESP3) server for tests, running on its own event loop in
+    a background thread. Supports just the commands the session store uses,
+    so no live Redis is needed.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = None
+
+    def start(self):
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, '127.0.0.1', 0), self.loop
+        ).result()
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f'redis://127.0.0.1:{port}/0'
+        return self.url
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def encode(self, value, protocol):
+        if value is None:
+            return b'_\r\n' if protocol == 3 else b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, dict):
+            items = b''.join(self.encode(k, protocol) + self.encode(v, protocol) for k, v in value.items())
+            return b'%%%d\r\n' % len(value) + items
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(self.encode(v, protocol) for v in value)
+        if isinstance(value, str):
+            return f'+{value}\r\n'.encode()
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    async def handle(self, reader, writer):
+        protocol = 2
+        while True:
+            args = await self.read_command(reader)
+            if args is None:
+                break
+            name, args = args[0].decode().upper(), args[1:]
+            if name == 'HELLO':
+                protocol = int(args[0]) if args else protocol
+                reply = {b'server': b'fake-redis', b'proto': protocol}
+                writer.write(self.encode(reply if protocol == 3 else [x for kv in reply.items() for x in kv], protocol))
+                await writer.drain()
+                continue
+            handler = getattr(self, f'cmd_{name.lower()}', None)
+            if handler is None:
+                writer.write(f'-ERR unknown command {name}\r\n'.encode())
+            else:
+                writer.write(self.encode(handler(*args), protocol))
+            await writer.drain()
+        writer.close()
+
+    def cmd_ping(self, *args):
+        return 'PONG'
+
+    def cmd_client(self, *args):
+        return 'OK'
+
+    def cmd_select(self, *args):
+        return 'OK'
+
+    def cmd_expire(self, key, seconds):
+        return int(key in self.data)
+
+    def cmd_hset(self, key, *pairs):
+        bucket = self.data.setdefault(key, {})
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            bucket[field] = value
+        return len(pairs) // 2
+
+    def cmd_hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def cmd_hincrby(self, key, field, amount):
+        bucket = self.data.setdefault(key, {})
+        bucket[field] = str(int(bucket.get(field, b'0')) + int(amount)).encode()
+        return int(bucket[field])
+
+    def cmd_rpush(self, key, *values):
+        items = self.data.setdefault(key, [])
+        items.extend(values)
+        return len(items)
+
+    def cmd_ltrim(self, key, start, stop):
+        items = self.data.get(key, [])
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        self.data[key] = items[start:stop] if start >= 0 else items[max(len(items) + start, 0):stop]
+        return 'OK'
+
+    def cmd_lrange(self, key, start, stop):
+        items = self.data.get(key, [])
+        stop = len(items) if int(stop) == -1 else int(stop) + 1
+        return items[int(start):stop]
+
+
+class SessionStoreTestsMixin:
+    """Behaviour every chat session store must share."""
+
+    async def make_store(self):
+        raise NotImplementedError
+
+    async def test_new_session_then_resume(self):
+        store = await self.make_store()
+        token, resumed = await store.open(None, owner='7')
+        self.assertFalse(resumed)
+        self.assertTrue(sessions.valid_token(token))
+
+        for text in ('a', 'b', 'c'):
+            seq = await store.next_seq(token)
+            await store.append(token, seq, json.dumps({'text': text, 'seq': seq}))
+
+        same, resumed = await store.open(token, owner='7')
+        self.assertEqual(same, token)
+        self.assertTrue(resumed)
+        replayed = await store.replay(token, 1)
+        self.assertEqual([seq for seq, _ in replayed], [2, 3])
+        self.assertEqual(json.loads(replayed[0][1])['text'], 'b')
+
+    async def test_other_owner_gets_new_session(self):
+        store = await self.make_store()
+        token, _ = await store.open(None, owner='7')
+        other, resumed = await store.open(token, owner='8')
+        self.assertFalse(resumed)
+        self.assertNotEqual(other, token)
+
+    async def test_replay_log_is_capped(self):
+        store = await self.make_store()
+        store.max_frames = 3
+        token, _ = await store.open(None, owner='')
+        for _ in range(5):
+            seq = await store.next_seq(token)
+            await store.append(token, seq, '{}')
+        self.assertEqual([seq for seq, _ in await store.replay(token, 0)], [3, 4, 5])
+
+
+class InMemorySessionStoreTests(SessionStoreTestsMixin, SimpleTestCase):
+    async def make_store(self):
+        return sessions.InMemorySessionStore()
+
+
+class RedisSessionStoreTests(SessionStoreTestsMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.redis = FakeRedisServer()
+        cls.redis.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.redis.stop()
+        super().tearDownClass()
+
+    async def make_store(self):
+        return sessions.RedisSessionStore(self.redis.url)
+
+    async def test_two_workers_share_a_session(self):
+        first = await self.make_store()
+        second = await self.make_store()
+        token, _ = await first.open(None, owner='7')
+        seq = await first.next_seq(token)
+        await first.append(token, seq, '{"type": "delta"}')
+
+        same, resumed = await second.open(token, owner='7')
+        self.assertTrue(resumed)
+        self.assertEqual(await second.replay(token, 0), [(1, '{"type": "delta"}')])
+
+
+class UnavailablePool:
+    async def attach(self):
+        raise upstream.UpstreamUnavailable('no engine in tests')
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatSessionResumeTests(SimpleTestCase):
+    def setUp(self):
+        self.store = sessions.InMemorySessionStore()
+        patches = [
+            mock.patch.object(sessions, '_store', self.store),
+            mock.patch.object(upstream, 'get_pool', UnavailablePool),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, json.loads(await communicator.receive_from())
+
+    async def test_reconnect_replays_missed_frames(self):
+        first, hello = await self.connect()
+        self.assertEqual(hello['type'], 'session')
+        self.assertFalse(hello['resumed'])
+        token = hello['session']
+        await first.disconnect()
+
+        # Frames relayed while the browser was away
+        for text in ('Hel', 'lo'):
+            seq = await self.store.next_seq(token)
+            await self.store.append(token, seq, json.dumps({'type': 'delta', 'text': text, 'seq': seq}))
+
+        second, hello = await self.connect(f'?session={token}&last_seq=1')
+        self.assertTrue(hello['resumed'])
+        replayed = json.loads(await second.receive_from())
+        self.assertEqual((replayed['seq'], replayed['text']), (2, 'lo'))
+        self.assertTrue(await second.receive_nothing())
+        await second.disconnect()
+
+    async def test_resume_takes_over_older_socket(self):
+        first, hello = await self.connect()
+        second, resumed = await self.connect(f"?session={hello['session']}&last_seq=0")
+        self.assertTrue(resumed['resumed'])
+        closed = await first.receive_output()
+        self.assertEqual(closed, {'type': 'websocket.close', 'code': 4001})
+        await second.disconnect()
+
+    async def test_oversized_text_frame_is_refused(self):
+        communicator, hello = await self.connect()
+        with override_settings(CHAT_TEXT_FRAME_MAX_BYTES=1024):
+            await communicator.send_to(text_data=json.dumps({'message': 'x' * 2048, 'type': 'chat'}))
+            refused = json.loads(await communicator.receive_from())
+        self.assertEqual(refused['type'], 'frame_too_large')
+        self.assertEqual(refused['max_bytes'], 1024)
+        await communicator.disconnect()
+
+    async def test_unknown_session_starts_fresh(self):
+        communicator, hello = await self.connect('?session=not-a-token&last_seq=5')
+        self.assertFalse(hello['resumed'])
+        self.assertTrue(sessions.valid_token(hello['session']))
+        await communicator.disconnect()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_threshold_then_allows_one_trial(self):
+        breaker = upstream.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())  # only one trial at a time
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_backoff_is_jittered_and_capped(self):
+        delays = [upstream.backoff_delay(attempt, 0.5, 4.0) for attempt in range(10) for _ in range(20)]
+        self.assertTrue(all(0 <= delay <= 4.0 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+class IdleWebSocket:
+    """An upstream WebSocket that records what is sent and never receives anything."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, text):
+        self.sent.append(text)
+
+    async def close(self):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.Event().wait()
+
+
+class UpstreamRoutingTests(SimpleTestCase):
+    """How replies on a multiplexed upstream connection reach their session."""
+
+    @contextlib.asynccontextmanager
+    async def connected(self, sessions=1):
+        pool = upstream.UpstreamPool('ws://engine.invalid')
+        connection = upstream.UpstreamConnection(pool, IdleWebSocket())
+        try:
+            attached = [pool._register(connection, 0, False) for _ in range(sessions)]
+            for session in attached:
+                await session.send_json({'message': 'hi'})
+            yield pool, connection, attached
+        finally:
+            await connection.close()
+
+    def received(self, session):
+        frames = []
+        while not session.inbox.empty():
+            frames.append(json.loads(session.inbox.get_nowait()))
+        return frames
+
+    async def test_tagged_frames_reach_their_session(self):
+        async with self.connected(sessions=2) as (pool, connection, (first, second)):
+            connection.route(json.dumps({'delta': 'for second', 'correlation_id': second.correlation_id}))
+            connection.route(json.dumps({'delta': 'for first', 'correlation_id': first.correlation_id}))
+            connection.route(json.dumps({'delta': 'more', 'correlation_id': second.correlation_id}))
+
+            self.assertEqual([frame['delta'] for frame in self.received(first)], ['for first'])
+            self.assertEqual([frame['delta'] for frame in self.received(second)], ['for second', 'more'])
+            self.assertEqual((first.in_flight, second.in_flight), (0, 0))
+            self.assertEqual(pool.stats()['frames_dropped'], 0)
+
+    async def test_untagged_frames_go_to_a_sole_session(self):
+        async with self.connected() as (pool, connection, (only,)):
+            for piece in ('Hel', 'lo'):
+                connection.route(json.dumps({'type': 'delta', 'delta': piece}))
+            self.assertEqual([frame['delta'] for frame in self.received(only)], ['Hel', 'lo'])
+
+    async def test_sessions_share_no_connection_by_default(self):
+        async with self.connected() as (pool, connection, (only,)):
+            pool.connections.append(connection)
+            self.assertIsNone(pool._least_loaded())
+            await only.close()
+            self.assertIs(pool._least_loaded(), connection)
+
+    async def test_untagged_frames_are_dropped_when_sessions_share_the_connection(self):
+        async with self.connected(sessions=3) as (pool, connection, attached):
+            for piece in ('Hel', 'lo'):
+                connection.route(json.dumps({'type': 'delta', 'delta': piece}))
+            connection.route(json.dumps({'delta': 'stale', 'correlation_id': 'f' * 32}))
+
+            self.assertEqual([self.received(session) for session in attached], [[], [], []])
+            self.assertEqual(pool.stats()['frames_dropped'], 3)
+            self.assertEqual(pool.stats()['frames_received'], 0)
+
+
+class UpstreamClientTests(SimpleTestCase):
+    """UpstreamClient against the local stub engine."""
+
+    @contextlib.asynccontextmanager
+    async def running_engine(self):
+        self.engine = stub_engine.StubEngine()
+        await self.engine.start()
+        self.pool = upstream.UpstreamPool(
+            self.engine.url,
+            breaker=upstream.CircuitBreaker(failure_threshold=3, reset_timeout=0.2),
+        )
+        self.frames = []
+        self.lost = 0
+        self.client = upstream.UpstreamClient(
+            self.pool, self.on_message, on_lost=self.on_lost,
+            max_queue=3, backoff_base=0.01, backoff_max=0.05, reply_timeout=0.3,
+        )
+        try:
+            yield
+        finally:
+            await self.client.close()
+            await self.pool.close()
+            await self.engine.stop()
+
+    async def on_message(self, text):
+        self.frames.append(json.loads(text))
+
+    async def on_lost(self):
+        self.lost += 1
+
+    async def wait_for(self, condition, timeout=3.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not condition():
+            self.assertLess(loop.time(), deadline, 'timed out')
+            await asyncio.sleep(0.01)
+
+    def reply_text(self):
+        return ''.join(frame.get('delta', '') for frame in self.frames)
+
+    async def test_queue_drained_after_engine_recovers(self):
+        async with self.running_engine():
+            self.engine.mode = 'refuse'
+            self.client.start()
+            self.assertFalse(await self.client.send_json({'message': 'hello there'}))
+            await self.wait_for(lambda: self.pool.breaker.state == 'open')
+
+            self.engine.mode = 'normal'
+            await self.wait_for(lambda: any(frame.get('type') == 'done' for frame in self.frames))
+            self.assertEqual(self.reply_text(), 'You said: hello there')
+            self.assertEqual(self.pool.breaker.state, 'closed')
+            self.assertEqual(self.client.stats()['queued_now'], 0)
+
+    async def test_queue_is_bounded(self):
+        async with self.running_engine():
+            self.engine.mode = 'refuse'
+            self.client.start()
+            for _ in range(3):
+                await self.client.send_json({'message': 'hi'})
+            with self.assertRaises(upstream.UpstreamUnavailable):
+                await self.client.send_json({'message': 'one too many'})
+
+    async def test_reconnects_after_drop(self):
+        async with self.running_engine():
+            self.client.start()
+            await self.wait_for(lambda: self.client.connected)
+            self.engine.mode = 'drop'
+            await self.client.send_json({'message': 'lost'})
+            await self.wait_for(lambda: self.lost == 1)
+
+            self.engine.mode = 'normal'
+            await self.wait_for(lambda: self.client.connected)
+            self.assertTrue(await self.client.send_json({'message': 'again'}))
+            await self.wait_for(lambda: any(frame.get('type') == 'done' for frame in self.frames))
+            self.assertEqual(self.reply_text(), 'You said: again')
+            self.assertEqual(self.client.stats()['reconnects'], 1)
+
+    async def test_stalled_request_reports_error_and_reconnects(self):
+        async with self.running_engine():
+            self.client.start()
+            await self.wait_for(lambda: self.client.connected)
+            self.engine.mode = 'stall'
+            await self.client.send_json({'message': 'anyone there?'})
+            await self.wait_for(lambda: self.frames)
+            self.assertIn('error', self.frames[0])
+            self.assertEqual(self.client.stats()['stalls'], 1)
+            self.assertEqual(self.pool.breaker.failures, 1)
+
+            self.engine.mode = 'normal'
+            await self.wait_for(lambda: self.client.connected)
+            await self.client.send_json({'message': 'back'})
+            await self.wait_for(lambda: any(frame.get('type') == 'done' for frame in self.frames))
+            self.assertEqual(self.reply_text(), 'You said: back')
+
+
+# How every route in miva/urls.py is cached: 'public' pages are cached whole
+# for anonymous visitors, 'private' pages revalidate with an ETag (both via
+# miva.httpcache), 'etag' views set their own validators, None are not cached
+ROUTE_CACHING = {
+    'index': 'public',
+    'student_questionnaire': 'public',
+    'adult_questionnaire': 'public',
+    'adventure_math': 'private',
+    'adventure_reading': 'private',
+    'adventure_science': 'private',
+    'adventure_creative': 'private',
+    'micro_lesson': 'private',
+    'break_timer': 'private',
+    'lesson_index': 'etag',
+    'lesson_questions': 'etag',
+    'service_worker': 'etag',
+    'signup': None,
+    'login': None,
+    'logout': None,
+    'profile_setup': None,
+    'path_questionnaire': None,
+    'results': None,
+    'persona_score': None,
+    'dashboard': None,
+    'dashboard_parent': None,
+    'dashboard_adult': None,
+    'dashboard_chidi': None,
+    'dashboard_tunde': None,
+    'dashboard_ngozi': None,
+    'chat': None,
+    'send_message': None,
+    'chat_history': None,
+    'settings': None,
+    'save_settings': None,
+    'update_profile': None,
+    'reset_data': None,
+    'progress_event': None,
+    'progress_batch': None,
+    'reviews_due': None,
+    'reviews_batch': None,
+    'metrics': None,
+}
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=600, LESSON_BANK_CHECK_SECONDS=0)
+class PageCacheHeaderTests(TestCase):
+    """HTTP caching and compression headers of every route."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='secret')
+        cls.other = User.objects.create_user('other', password='secret')
+        lesson = Lesson.objects.create(slug='math-counting', subject=Lesson.SUBJECT_MATH, position=1, title='Counting')
+        Question.objects.create(lesson=lesson, position=1, prompt='2 + 2?', choices=['3', '4'], answer=1)
+
+    def setUp(self):
+        cache.clear()
+        lessons.curriculum_changed()
+
+    def url(self, name):
+        return reverse(name, kwargs={'slug': 'math-counting'} if name == 'lesson_questions' else None)
+
+    def routes(self, policy):
+        return [name for name, expected in ROUTE_CACHING.items() if expected == policy]
+
+    def test_every_route_has_a_policy(self):
+        self.assertEqual({pattern.name for pattern in urls.urlpatterns}, set(ROUTE_CACHING))
+        for pattern in urls.urlpatterns:
+            with self.subTest(route=pattern.name):
+                policy = getattr(pattern.callback, 'page_policy', None)
+                expected = ROUTE_CACHING[pattern.name]
+                self.assertEqual(policy is not None, expected in ('public', 'private'))
+                if policy is not None:
+                    self.assertEqual(policy.public, expected == 'public')
+
+    def test_public_pages_are_cached_for_anonymous_visitors(self):
+        for name in self.routes('public'):
+            with self.subTest(route=name), mock.patch('miva.views.render', wraps=render) as rendered:
+                response = self.client.get(self.url(name), HTTP_ACCEPT_ENCODING='gzip, deflate')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertTrue(response['ETag'].startswith('W/"'))
+                self.assertTrue(response.has_header('Last-Modified'))
+                self.assertIn('no-cache', response['Cache-Control'])
+                self.assertIn('Cookie', response['Vary'])
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+                again = self.client.get(self.url(name))
+                self.assertEqual(again.status_code, 200)
+                self.assertNotIn('Content-Encoding', again)
+                revalidated = self.client.get(self.url(name), HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertEqual(rendered.call_count, 1)
+
+    def test_cached_form_gets_a_fresh_csrf_token(self):
+        url = self.url('adult_questionnaire')
+        Client(enforce_csrf_checks=True).get(url)
+        visitor = Client(enforce_csrf_checks=True)
+        page = visitor.get(url).content.decode()
+        token = page.split('name="csrfmiddlewaretoken" value="', 1)[1].split('"', 1)[0]
+        self.assertEqual(visitor.post(url, {'csrfmiddlewaretoken': token}).status_code, 302)
+
+    def test_signed_in_visitors_bypass_the_public_cache(self):
+        self.client.force_login(self.user)
+        with mock.patch('miva.views.render', wraps=render) as rendered:
+            first = self.client.get(self.url('index'))
+            self.assertEqual(self.client.get(self.url('index')).status_code, 200)
+            self.assertEqual(rendered.call_count, 2)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(self.url('index'), HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_private_pages_revalidate_with_etag(self):
+        for name in self.routes('private'):
+            with self.subTest(route=name):
+                self.client.logout()
+                anonymous = self.client.get(self.url(name))
+                self.assertEqual(anonymous.status_code, 302)
+                self.assertNotIn('ETag', anonymous)
+
+                self.client.force_login(self.user)
+                response = self.client.get(self.url(name), HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('Cookie', response['Vary'])
+                with mock.patch('miva.views.render', wraps=render) as rendered:
+                    revalidated = self.client.get(self.url(name), HTTP_IF_NONE_MATCH=response['ETag'])
+                    self.assertEqual(revalidated.status_code, 304)
+                    self.assertEqual(rendered.call_count, 0)
+
+                self.client.force_login(self.other)
+                self.assertEqual(self.client.get(self.url(name), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        self.client.force_login(self.user)
+        self.assertTrue(self.client.get(self.url('adventure_math')).has_header('Last-Modified'))
+
+    def test_etag_routes_answer_304(self):
+        self.client.force_login(self.user)
+        for name in self.routes('etag'):
+            with self.subTest(route=name):
+                response = self.client.get(self.url(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+                self.assertEqual(self.client.get(self.url(name), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_other_routes_are_not_cached(self):
+        for name in self.routes(None):
+            with self.subTest(route=name):
+                self.client.force_login(self.user)
+                response = self.client.get(self.url(name), HTTP_ACCEPT_ENCODING='gzip')
+                self.assertNotIn('ETag', response)
+                self.assertNotIn('Content-Encoding', response)
+
+
+class SM2Tests(SimpleTestCase):
+    def schedule(self, ease, interval, repetitions, grade):
+        return tuple(int(value) for value in reviews.sm2(ease, interval, repetitions, grade))
+
+    def test_passing_answers_grow_the_interval(self):
+        self.assertEqual(self.schedule(2500, 0, 0, 5), (2600, 1, 1))
+        self.assertEqual(self.schedule(2600, 1, 1, 4), (2600, 6, 2))
+        self.assertEqual(self.schedule(2600, 6, 2, 3), (2460, 16, 3))
+
+    def test_failing_answer_resets_but_keeps_ease(self):
+        self.assertEqual(self.schedule(2300, 40, 5, reviews.PASS_GRADE - 1), (2300, 1, 0))
+        self.assertEqual(self.schedule(2300, 40, 5, 0), (2300, 1, 0))
+
+    def test_ease_has_a_floor(self):
+        self.assertEqual(self.schedule(reviews.MIN_EASE, 6, 2, 3)[0], reviews.MIN_EASE)
+        self.assertEqual(self.schedule(1350, 6, 2, 3)[0], reviews.MIN_EASE)
+
+    def test_interval_is_capped(self):
+        self.assertEqual(self.schedule(2500, 3000, 9, 5)[1], reviews.MAX_INTERVAL)
+
+    def test_works_on_arrays(self):
+        ease, interval, repetitions = reviews.sm2([2500, 2500], [6, 6], [2, 2], [5, 1])
+        self.assertEqual(interval.tolist(), [15, 1])
+        self.assertEqual(repetitions.tolist(), [3, 0])
+
+
+class SpreadTests(SimpleTestCase):
+    def loads(self, learner, due, today):
+        counts = {}
+        for pair in zip(learner.tolist(), np.maximum(due, today).tolist()):
+            counts[pair] = counts.get(pair, 0) + 1
+        return counts
+
+    def test_caps_each_learner_per_day_moving_items_later_in_order(self):
+        rng = np.random.default_rng(1)
+        today = 1000
+        learner = np.repeat(np.arange(20), 60)
+        due = today + rng.integers(-5, 10, len(learner))
+        new = reviews.spread(learner, due, today, 7)
+
+        self.assertLessEqual(max(self.loads(learner, new, today).values()), 7)
+        self.assertTrue((np.maximum(new, today) >= np.maximum(due, today)).all())
+        for one in range(20):
+            mine = learner == one
+            before = np.lexsort((np.maximum(due[mine], today), due[mine]))
+            self.assertTrue((np.diff(np.maximum(new[mine], today)[before]) >= 0).all())
+
+    def test_leaves_items_that_fit_alone(self):
+        learner = np.array([1, 1, 2, 2])
+        due = np.array([98, 103, 100, 100])
+        self.assertEqual(reviews.spread(learner, due, 100, 2).tolist(), [98, 103, 100, 100])
+
+    def test_overdue_backlog_is_spread_from_today(self):
+        learner = np.zeros(5, dtype=np.int64)
+        due = np.array([90, 91, 92, 93, 94])
+        new = reviews.spread(learner, due, 100, 2)
+        self.assertEqual(sorted(np.maximum(new, 100).tolist()), [100, 100, 101, 101, 102])
+        self.assertEqual(reviews.spread(learner[:0], due[:0], 100, 2).tolist(), [])
+
+
+@override_settings(LESSON_BANK_CHECK_SECONDS=0)
+class ReviewSchedulingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reviewer', password='secret')
+        lesson = Lesson.objects.create(slug='math-counting', subject=Lesson.SUBJECT_MATH, position=1, title='Counting')
+        cls.questions = [
+            Question.objects.create(lesson=lesson, position=number, prompt='?', choices=['a', 'b'], answer=0).pk
+            for number in (1, 2)
+        ]
+
+    def setUp(self):
+        lessons.curriculum_changed()
+        self.client.force_login(self.user)
+        self.profile, _ = UserProfile.objects.get_or_create(user=self.user)
+
+    def item(self, question):
+        return ReviewItem.objects.get(profile=self.profile, question_id=question)
+
+    def test_record_answers_creates_then_updates(self):
+        today = date(2026, 3, 1)
+        first, second = self.questions
+        reviews.record_answers(self.profile, [(first, 5), (second, 1)], today=today)
+        self.assertEqual((self.item(first).interval, self.item(first).due), (1, today + timedelta(days=1)))
+        self.assertEqual(self.item(second).repetitions, 0)
+
+        reviews.record_answers(self.profile, [(first, 4)], today=today + timedelta(days=1))
+        reviews.record_answers(self.profile, [(first, 0)], today=today + timedelta(days=7))
+        item = self.item(first)
+        self.assertEqual((item.repetitions, item.interval, item.lapses), (0, 1, 1))
+        self.assertEqual(item.last_reviewed, today + timedelta(days=7))
+
+    def test_answers_older_than_the_last_review_are_skipped(self):
+        first = self.questions[0]
+        today = date(2026, 3, 10)
+        reviews.record_answers(self.profile, [(first, 5)], today=today)
+        self.assertEqual(reviews.record_answers(self.profile, [(first, 0)], today=today - timedelta(days=3)), [])
+        item = self.item(first)
+        self.assertEqual((item.repetitions, item.last_reviewed), (1, today))
+
+    def test_concurrently_created_item_does_not_fail(self):
+        first = self.questions[0]
+        reviews.record_answers(self.profile, [(first, 5)], today=date(2026, 3, 1))
+        # Another request created the row after this one looked for it
+        with mock.patch.object(ReviewItem.objects, 'select_for_update', return_value=ReviewItem.objects.none()):
+            scheduled = reviews.record_answers(self.profile, [(first, 2)], today=date(2026, 3, 1))
+        self.assertEqual([item.question_id for item in scheduled], [first])
+        self.assertEqual(ReviewItem.objects.filter(profile=self.profile).count(), 1)
+
+    def quiz_batch(self, event_id, days_ago, grade):
+        at = int((time.time() - days_ago * 86400) * 1000)
+        return self.client.post(reverse('progress_batch'), json.dumps({'events': [{
+            'id': event_id, 'kind': 'quiz_completed', 'at': at,
+            'answers': [{'question': self.questions[0], 'grade': grade}],
+        }]}), content_type='application/json')
+
+    def test_batch_is_not_recorded_when_scheduling_fails(self):
+        with mock.patch.object(reviews, 'record_answers', side_effect=RuntimeError('db gone')):
+            with self.assertRaises(RuntimeError):
+                self.quiz_batch('offline-1', 1, 5)
+        self.assertFalse(ActivityEvent.objects.filter(client_id='offline-1').exists())
+
+        self.assertEqual(self.quiz_batch('offline-1', 1, 5).json()['recorded'], 1)
+        self.assertEqual(self.item(self.questions[0]).last_reviewed, timezone.localdate() - timedelta(days=1))
+
+    def test_offline_answer_does_not_rewind_a_newer_review(self):
+        reviews.record_answers(self.profile, [(self.questions[0], 5)])
+        self.assertEqual(self.quiz_batch('offline-2', 2, 0).json()['recorded'], 1)
+        item = self.item(self.questions[0])
+        self.assertEqual((item.repetitions, item.last_reviewed), (1, timezone.localdate()))
+
+
+RATE_LIMITS = {'messages': {'per_minute': 60, 'burst': 3}, 'extraction_seconds': {'per_minute': 60, 'burst': 10}}
+
+
+@override_settings(CHAT_RATE_LIMITS=RATE_LIMITS, CHAT_RATE_LIMIT_ADDRESS_SCALE=2)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patch = mock.patch.object(ratelimit.time, 'monotonic', lambda: self.now)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.limiter = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore())
+
+    async def test_refuses_past_the_burst_then_refills(self):
+        for _ in range(3):
+            await self.limiter.take('user:1', 'messages')
+        with self.assertRaises(ratelimit.RateLimited) as refused:
+            await self.limiter.take('user:1', 'messages')
+        self.assertEqual(refused.exception.budget, 'messages')
+        self.assertAlmostEqual(refused.exception.retry_after, 1.0)
+        self.assertEqual(refused.exception.frame()['type'], 'rate_limited')
+        self.assertEqual(self.limiter.stats()['refused'], {'messages': 1})
+
+        await self.limiter.take('user:2', 'messages')  # other learners are unaffected
+        self.now += 2  # one token a second
+        await self.limiter.take('user:1', 'messages')
+        await self.limiter.take('user:1', 'messages')
+        with self.assertRaises(ratelimit.RateLimited):
+            await self.limiter.take('user:1', 'messages')
+
+    async def test_charge_after_the_fact_leaves_a_debt(self):
+        await self.limiter.take('user:1', 'extraction_seconds', 0)
+        await self.limiter.charge('user:1', 'extraction_seconds', 25)
+        with self.assertRaises(ratelimit.RateLimited) as refused:
+            await self.limiter.take('user:1', 'extraction_seconds', 0)
+        self.assertAlmostEqual(refused.exception.retry_after, 15.0)
+        self.now += 15
+        await self.limiter.take('user:1', 'extraction_seconds', 0)
+
+    async def test_unlimited_budget_is_never_refused(self):
+        for _ in range(100):
+            await self.limiter.take('user:1', 'upload_bytes', 10 ** 9)
+
+    async def test_refusal_by_one_bucket_spends_from_none(self):
+        await self.limiter.take(('session:a', 'address:10.0.0.1'), 'messages', 3)
+        await self.limiter.take(('session:b', 'address:10.0.0.1'), 'messages', 3)
+        with self.assertRaises(ratelimit.RateLimited):
+            await self.limiter.take(('session:c', 'address:10.0.0.1'), 'messages')
+        # session:c was refunded when the address bucket refused
+        await self.limiter.take(('session:c', 'address:10.0.0.2'), 'messages', 3)
+
+    async def test_anonymous_sockets_cannot_pick_their_bucket(self):
+        def socket(session, unique_id):
+            consumer = SimpleNamespace(document_owner=None, session_token=session, scope={'client': ('10.0.0.9', 5000)})
+            return ChatConsumer.learner_key(consumer)
+
+        self.assertEqual(socket('s1', 'x'), socket('s1', 'y'))
+        # New sessions from one address share its (twice as large) bucket
+        for session in ('s1', 's2', 's3', 's4', 's5', 's6'):
+            await self.limiter.take(socket(session, session), 'messages')
+        with self.assertRaises(ratelimit.RateLimited):
+            await self.limiter.take(socket('s7', 's7'), 'messages')
+        self.assertEqual(
+            ChatConsumer.learner_key(SimpleNamespace(document_owner='u1', session_token='s', scope={})), 'user:u1',
+        )
+
+
+class CountingBackend:
+    """A PDF backend with numbered pages that counts how often documents are parsed."""
+    name = 'counting'
+    pages = 20
+    opened = 0
+
+    def __init__(self, path):
+        type(self).opened += 1
+
+    def page_count(self):
+        return self.pages
+
+    def page_text(self, index):
+        return f'text of page {index + 1}'
+
+    def close(self):
+        pass
+
+
+class PDFExtractionTests(SimpleTestCase):
+    def setUp(self):
+        for patch in (
+            mock.patch.dict(extraction.BACKENDS, {CountingBackend.name: CountingBackend}),
+            mock.patch.object(extraction, 'available_backends', lambda: [CountingBackend.name]),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        CountingBackend.opened = 0
+        extraction._open_documents.clear()
+        self.addCleanup(extraction._open_documents.clear)
+        # Workers in threads share this process's open documents, like a pool of one
+        self.service = extraction.PDFExtractionService(max_workers=2, batch_pages=8, backend=CountingBackend.name)
+        self.service.executor = ThreadPoolExecutor(2)
+        self.addCleanup(self.service.shutdown)
+
+    async def test_document_is_parsed_once_and_streamed_in_batches(self):
+        batches = [batch async for batch in self.service.iter_batches(io.BytesIO(b'%PDF-'))]
+        self.assertEqual([[page.number for page in batch] for batch in batches],
+                         [list(range(1, 9)), list(range(9, 17)), list(range(17, 21))])
+        self.assertEqual(batches[2][-1], extraction.Page(20, 'text of page 20', 20, 20))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(self.service.stats()['queued_jobs'], 0)
+        self.assertEqual(self.service.stats()['completed'], 1)
+
+    async def test_chat_forwards_each_batch_as_it_is_read(self):
+        frames = []
+
+        async def send(text_data):
+            frames.append(json.loads(text_data))
+
+        consumer = SimpleNamespace(send=send)
+        with mock.patch.object(extraction, 'get_service', lambda: self.service), \
+                mock.patch('miva.consumers.FILE_PROGRESS_EXCERPT_CHARS', 40):
+            text, complete = await ChatConsumer.extract_pdf_text(consumer, io.BytesIO(b'%PDF-'), 'notes.pdf')
+        self.assertTrue(complete)
+        self.assertEqual([(frame['first_page'], frame['page'], frame['pages']) for frame in frames],
+                         [(1, 8, 20), (9, 16, 20), (17, 20, 20)])
+        # Only the start of each batch goes to the browser; the whole text goes to the engine
+        self.assertEqual(frames[1]['excerpt'], '--- Page 9 ---\ntext of page 9\n\n--- Page ')
+        self.assertNotIn('text', frames[1])
+        self.assertEqual(text.count('--- Page'), 20)
+
+    async def test_timed_out_document_holds_its_slot_until_its_jobs_finish(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class SlowBackend(CountingBackend):
+            def page_text(self, index):
+                if index >= 8:
+                    release.wait(5)
+                return super().page_text(index)
+
+        extraction.BACKENDS['slow'] = SlowBackend
+        self.service.backend = 'slow'
+        self.service.timeout = 0.2
+        self.service.max_queue = 1
+        with mock.patch.object(extraction, 'available_backends', lambda: ['slow']):
+            with self.assertRaises(extraction.ExtractionTimeout):
+                async for batch in self.service.iter_batches(io.BytesIO(b'%PDF-')):
+                    pass
+            # Two batches are still running in the pool
+            self.assertEqual(self.service.stats()['documents_in_progress'], 1)
+            with self.assertRaises(extraction.ExtractionBusy):
+                async for batch in self.service.iter_batches(io.BytesIO(b'%PDF-')):
+                    pass
+
+            release.set()
+            for _ in range(100):
+                if not self.service.stats()['documents_in_progress']:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(self.service.stats()['documents_in_progress'], 0)
+            self.assertEqual(self.service.stats()['queued_jobs'], 0)
+            self.assertEqual(self.service.stats()['timeouts'], 1)
+
+    def test_workers_reparse_a_replaced_file(self):
+        with tempfile.NamedTemporaryFile() as pdf:
+            pdf.write(b'%PDF-')
+            pdf.flush()
+            extraction._extract_range(pdf.name, 8, 16, CountingBackend.name)
+            extraction._extract_range(pdf.name, 16, 24, CountingBackend.name)
+            self.assertEqual(CountingBackend.opened, 1)
+            os.utime(pdf.name, ns=(0, 0))
+            self.assertEqual(extraction._extract_range(pdf.name, 19, 24, CountingBackend.name), ['text of page 20'])
+            self.assertEqual(CountingBackend.opened, 2)
+
+    async def test_jobs_finishing_on_worker_threads_are_counted(self):
+        await asyncio.gather(*(self.service._submit([], time.sleep, 0) for _ in range(500)))
+        self.assertEqual(self.service.queued_jobs, 0)
+
+
+def upload_frame(header, payload=b''):
+    encoded = json.dumps(header).encode('utf-8')
+    return uploads.HEADER_LENGTH.pack(len(encoded)) + encoded + payload
+
+
+class UploadAssemblerTests(SimpleTestCase):
+    def setUp(self):
+        self.assembler = uploads.UploadAssembler(max_bytes=100, chunk_bytes=10, spool_bytes=16)
+        self.addCleanup(self.assembler.close)
+
+    def start(self, size=25, upload_id='up-1'):
+        return self.assembler.start({'id': upload_id, 'name': 'notes.txt', 'type': 'text/plain', 'size': size})
+
+    def test_chunks_in_order_are_assembled(self):
+        data = b'0123456789abcdefghijKLMNO'
+        upload = self.start()
+        for offset in range(0, len(data), 10):
+            received = self.assembler.write({'id': 'up-1', 'offset': offset}, data[offset:offset + 10])
+        self.assertEqual(received, 25)
+        finished = self.assembler.finish({'id': 'up-1', 'sha256': hashlib.sha256(data).hexdigest().upper()})
+        self.assertIs(finished, upload)
+        self.assertEqual(finished.file.read(), data)
+        self.assertTrue(finished.file._rolled)  # past spool_bytes, so on disk
+        self.assertEqual(finished.digest, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.assembler.active, {})
+
+    @contextlib.contextmanager
+    def assertAborted(self, upload, message):
+        with self.assertRaisesMessage(uploads.UploadError, message) as raised:
+            yield
+        self.assertEqual(raised.exception.upload_id, upload.id)
+        self.assertNotIn(upload.id, self.assembler.active)
+        self.assertTrue(upload.file.closed)
+
+    def test_out_of_order_chunk_aborts_the_upload(self):
+        upload = self.start()
+        with self.assertAborted(upload, 'Expected chunk at offset 0, got 10'):
+            self.assembler.write({'id': 'up-1', 'offset': 10}, b'x' * 10)
+
+    def test_duplicate_chunk_aborts_the_upload(self):
+        upload = self.start()
+        self.assembler.write({'id': 'up-1', 'offset': 0}, b'x' * 10)
+        with self.assertAborted(upload, 'Expected chunk at offset 10, got 0'):
+            self.assembler.write({'id': 'up-1', 'offset': 0}, b'x' * 10)
+        with self.assertRaisesMessage(uploads.UploadError, 'Unknown upload id'):
+            self.assembler.write({'id': 'up-1', 'offset': 10}, b'x' * 10)
+
+    def test_oversized_uploads_and_chunks_are_refused(self):
+        with self.assertRaisesMessage(uploads.UploadError, 'File is too large'):
+            self.start(size=101)
+        self.assertEqual(self.assembler.active, {})
+
+        upload = self.start()
+        with self.assertAborted(upload, 'Upload chunk is too large'):
+            self.assembler.write({'id': 'up-1', 'offset': 0}, b'x' * 11)
+
+        upload = self.start(size=15)
+        self.assembler.write({'id': 'up-1', 'offset': 0}, b'x' * 10)
+        with self.assertAborted(upload, 'larger than its declared size'):
+            self.assembler.write({'id': 'up-1', 'offset': 10}, b'x' * 10)
+
+    def test_bad_declared_size_is_refused(self):
+        for size in (0, -5, 'lots', None):
+            with self.subTest(size=size), self.assertRaises(uploads.UploadError):
+                self.start(size=size)
+        self.assertEqual(self.assembler.active, {})
+
+    def test_end_before_every_byte_arrived_is_refused(self):
+        upload = self.start()
+        self.assembler.write({'id': 'up-1', 'offset': 0}, b'x' * 10)
+        with self.assertAborted(upload, 'Upload ended after 10 of 25 bytes'):
+            self.assembler.finish({'id': 'up-1'})
+
+    def test_checksum_mismatch_is_refused(self):
+        upload = self.start(size=5)
+        self.assembler.write({'id': 'up-1', 'offset': 0}, b'hello')
+        with self.assertAborted(upload, 'does not match its checksum'):
+            self.assembler.finish({'id': 'up-1', 'sha256': hashlib.sha256(b'hellO').hexdigest()})
+
+    def test_abort_and_close_discard_uploads(self):
+        first, second = self.start(upload_id='up-1'), self.start(upload_id='up-2')
+        with self.assertRaisesMessage(uploads.UploadError, 'Too many uploads in progress'):
+            self.start(upload_id='up-3')
+        with self.assertRaisesMessage(uploads.UploadError, 'Upload id already in use'):
+            self.start(upload_id='up-1')
+
+        self.assembler.abort('up-1')
+        self.assembler.abort('up-1')  # aborting twice is harmless
+        self.assertTrue(first.file.closed)
+        self.assertEqual(list(self.assembler.active), ['up-2'])
+        self.assembler.close()
+        self.assertTrue(second.file.closed)
+        self.assertEqual(self.assembler.active, {})
+
+    def test_parse_frame(self):
+        header, payload = uploads.parse_frame(upload_frame({'op': 'chunk', 'id': 'up-1', 'offset': 0}, b'abc'))
+        self.assertEqual(header, {'op': 'chunk', 'id': 'up-1', 'offset': 0})
+        self.assertEqual(bytes(payload), b'abc')
+        for frame in (b'\x00\x00', uploads.HEADER_LENGTH.pack(0), uploads.HEADER_LENGTH.pack(50) + b'{}',
+                      uploads.HEADER_LENGTH.pack(3) + b'{x}', upload_frame({'op': 'start'}), upload_frame([1])):
+            with self.subTest(frame=frame), self.assertRaises(uploads.UploadError):
+                uploads.parse_frame(frame)
+
+
+def paragraph(topic, words=20):
+    """A paragraph about ``topic`` padded with filler words."""
+    return f'This section is about {topic}. ' + ' '.join(['filler'] * words)
+
+
+BOOK = '\n'.join(
+    f'\n--- Page {page} ---\n{paragraph(topic)}\n\n{paragraph(topic + " again")}\n'
+    for page, topic in enumerate(['volcanoes', 'photosynthesis', 'fractions', 'glaciers', 'electricity'], 1)
+)
+
+
+class ChunkSelectionTests(SimpleTestCase):
+    def test_split_keeps_pages_apart_and_chunks_small(self):
+        chunks = chunking.split(BOOK, chunk_chars=400)
+        self.assertEqual([chunk.index for chunk in chunks], list(range(len(chunks))))
+        self.assertEqual(sorted({chunk.page for chunk in chunks}), [1, 2, 3, 4, 5])
+        self.assertTrue(all(len(chunk.text) <= 400 for chunk in chunks))
+        self.assertTrue(all('--- Page' not in chunk.text for chunk in chunks))
+        self.assertTrue(all('photosynthesis' in chunk.text for chunk in chunks if chunk.page == 2))
+
+    def test_split_breaks_long_paragraphs_on_sentences(self):
+        text = ' '.join(f'Sentence number {n} is here.' for n in range(100))
+        chunks = chunking.split(text, chunk_chars=200)
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual([chunk.page for chunk in chunks], [None] * len(chunks))
+        self.assertTrue(all(len(chunk.text) <= 200 and chunk.text.endswith('here.') for chunk in chunks))
+
+    def test_select_picks_the_most_relevant_chunk_within_the_budget(self):
+        chunks = chunking.split(BOOK, chunk_chars=400)
+        self.assertEqual(len(chunks), 5)  # one per page
+        cost = [chunking.estimate_tokens(chunk.text) for chunk in chunks]
+        chosen = chunking.select(chunks, 'Please explain how glaciers move', max(cost))
+        self.assertEqual([chunk.page for chunk in chosen], [4])
+
+        chosen = chunking.select(chunks, 'glaciers and fractions', cost[2] + cost[3])
+        self.assertEqual([chunk.page for chunk in chosen], [3, 4])
+        chosen = chunking.select(chunks, 'glaciers and fractions', cost[2] + cost[3] - 1)
+        self.assertEqual(len(chosen), 1)
+
+    def test_select_without_query_terms_reads_from_the_start(self):
+        chunks = chunking.split(BOOK, chunk_chars=400)
+        budget = chunking.estimate_tokens(chunks[0].text) + chunking.estimate_tokens(chunks[1].text)
+        chosen = chunking.select(chunks, 'Please read this document', budget)
+        self.assertEqual([chunk.index for chunk in chosen], [0, 1])
+
+    def test_selector_trims_long_documents_and_records_bytes_saved(self):
+        selector = chunking.ContextSelector(max_tokens=100, chunk_chars=400)
+        saved = metrics.DOCUMENT_BYTES_SAVED
+        before = dict(saved.series.get((), {'count': 0, 'sum': 0.0}))
+
+        self.assertEqual(selector.select('A short note.', 'anything'), 'A short note.')
+        trimmed = selector.select(BOOK, 'What makes electricity flow?')
+        self.assertTrue(trimmed.startswith('[Showing '))
+        self.assertIn('electricity', trimmed)
+        self.assertNotIn('volcanoes', trimmed)
+        self.assertLessEqual(chunking.estimate_tokens(trimmed), 100 + 30)
+
+        stats = selector.stats()
+        self.assertEqual((stats['messages'], stats['trimmed_messages']), (2, 1))
+        self.assertEqual(stats['bytes_saved'], len(BOOK.encode('utf-8')) - len(trimmed.encode('utf-8')))
+        after = saved.series[()]
+        self.assertEqual(after['count'] - before['count'], 2)
+        self.assertEqual(after['sum'] - before['sum'], stats['bytes_saved'])
+
+
+class DocumentIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = documents.DocumentIndex(':memory:', chunk_chars=400)
+
+    def test_search_returns_the_relevant_passages_of_the_learners_document(self):
+        document_id = self.index.add('learner-a', 'science.pdf', 'digest-1', BOOK)
+        self.assertTrue(documents.valid_document_id(document_id))
+        found = self.index.search('learner-a', [document_id], 'Why does photosynthesis need light?', 1000)
+        self.assertEqual([name for name, _ in found], ['science.pdf'])
+        self.assertEqual({chunk.page for chunk in found[0][1]}, {2})
+
+    def test_search_respects_the_token_budget(self):
+        document_id = self.index.add('learner-a', 'science.pdf', 'digest-1', BOOK)
+        question = 'volcanoes photosynthesis fractions glaciers electricity'
+        _, everything = self.index.search('learner-a', [document_id], question, 10000)[0]
+        budget = chunking.estimate_tokens(everything[0].text) * 3
+        _, chunks = self.index.search('learner-a', [document_id], question, budget)[0]
+        self.assertLess(len(chunks), len(everything))
+        self.assertLessEqual(sum(chunking.estimate_tokens(chunk.text) for chunk in chunks), budget)
+        self.assertEqual(chunks, sorted(chunks, key=lambda chunk: chunk.index))
+
+    def test_learners_only_see_their_own_documents(self):
+        mine = self.index.add('learner-a', 'science.pdf', 'digest-1', BOOK)
+        theirs = self.index.add('learner-b', 'science.pdf', 'digest-1', BOOK)
+        self.assertNotEqual(mine, theirs)
+        self.assertEqual(self.index.search('learner-b', [mine], 'glaciers', 1000), [])
+        self.assertEqual(self.index.documents('learner-b', [mine, theirs, 'not-an-id']), {theirs: 'science.pdf'})
+
+        self.index.forget('learner-b')
+        self.assertEqual(self.index.documents('learner-b', [theirs]), {})
+        self.assertEqual(len(self.index.search('learner-a', [mine], 'glaciers', 1000)), 1)
+
+    def test_same_upload_keeps_its_id(self):
+        first = self.index.add('learner-a', 'notes.pdf', 'digest-1', BOOK)
+        again = self.index.add('learner-a', 'notes (1).pdf', 'digest-1', BOOK)
+        self.assertEqual(first, again)
+        self.assertEqual(self.index.documents('learner-a', [first]), {first: 'notes (1).pdf'})
+        self.assertEqual(self.index.stats()['documents_reused'], 1)
+
+
+FRAMES = {
+    'ping': {'type': 'ping'},
+    'chat': {'type': 'chat', 'message': 'What is 7 × 8? 🤔', 'unique_id': 'u-1', 'documents': ['a' * 32, 3], 'extra': [1]},
+    'file': {'message': 'Read this', 'unique_id': None, 'file': {'name': 'été.txt', 'type': 'text/plain', 'content': 'aGk='}},
+}
+
+INVALID_FRAMES = {
+    'not json': '{"type": "chat", "message": ',
+    'not an object': '["chat"]',
+    'unknown type': '{"type": "shout", "message": "hi"}',
+    'error frame from the browser': '{"type": "error", "error": "boom"}',
+    'chat without message': '{"type": "chat"}',
+    'untyped without message': '{"error": "boom"}',
+    'chat message not a string': '{"message": 5}',
+    'bad unique_id': '{"message": "hi", "unique_id": [1]}',
+    'documents not a list': '{"message": "hi", "documents": "abc"}',
+    'bad document id': '{"message": "hi", "documents": [{"id": 1}]}',
+    'file not an object': '{"message": "hi", "file": "abc"}',
+    'file without content': '{"file": {"name": "a.txt"}}',
+    'file content not a string': '{"file": {"content": 12}}',
+}
+
+
+class CodecTests(SimpleTestCase):
+    def codecs(self):
+        for each in codec.available_codecs():
+            with self.subTest(codec=each.name), mock.patch.object(codec, '_codec', each):
+                yield each
+
+    def test_frames_round_trip_with_every_codec(self):
+        for each in self.codecs():
+            for kind, frame in FRAMES.items():
+                text = codec.dumps(frame)
+                self.assertIsInstance(text, str)
+                self.assertNotIn('\\u', text)  # non-ASCII is written as it is
+                self.assertEqual(codec.decode_frame(text), (kind, frame))
+                self.assertEqual(codec.loads(text.encode('utf-8')), frame)
+
+    def test_invalid_frames_are_rejected_with_every_codec(self):
+        for each in self.codecs():
+            for reason, text in INVALID_FRAMES.items():
+                with self.subTest(reason), self.assertRaises(codec.FrameError):
+                    codec.decode_frame(text)
+            with self.assertRaises(ValueError):
+                codec.loads('{"a": }')
+
+    def test_ping_detection(self):
+        for each in self.codecs():
+            self.assertTrue(codec.is_ping('{"type":"ping"}'))
+            self.assertTrue(codec.is_ping('{ "type" : "ping" }'))
+            self.assertFalse(codec.is_ping('{"type":"chat","message":"ping"}'))
+            self.assertFalse(codec.is_ping('{"type":"ping","file":{}}'))
+            self.assertFalse(codec.is_ping('{"type":"ping"'))
+            self.assertFalse(codec.is_ping('{"type":"ping","pad":"%s"}' % ('x' * 64)))
+            self.assertEqual(codec.loads(codec.PONG), {'type': 'pong'})
+
+    def test_falls_back_to_the_standard_library(self):
+        with mock.patch.object(codec, 'orjson', None), mock.patch.object(codec, 'msgspec', None), \
+                mock.patch.object(codec, '_codec', None), override_settings(CHAT_JSON_CODEC='auto'):
+            self.assertEqual([each.name for each in codec.available_codecs()], ['json'])
+            self.assertEqual(codec.get_codec().name, 'json')
+            self.assertEqual(codec.decode_frame(codec.dumps(FRAMES['chat'])), ('chat', FRAMES['chat']))
+
+    def test_auto_prefers_the_fastest_codec(self):
+        expected = 'orjson' if codec.orjson else 'msgspec' if codec.msgspec else 'json'
+        with mock.patch.object(codec, '_codec', None), override_settings(CHAT_JSON_CODEC='auto'):
+            self.assertEqual(codec.get_codec().name, expected)
+
+    def test_choosing_a_codec_that_is_not_installed_fails(self):
+        with mock.patch.object(codec, 'msgspec', None), mock.patch.object(codec, '_codec', None), \
+                override_settings(CHAT_JSON_CODEC='msgspec'):
+            with self.assertRaisesMessage(ImportError, "CHAT_JSON_CODEC='msgspec' is not installed"):
+                codec.get_codec()
+        with mock.patch.object(codec, '_codec', None), override_settings(CHAT_JSON_CODEC='json'):
+            self.assertEqual(codec.get_codec().name, 'json')
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.profile = UserProfile.objects.create(user=self.user)
+        start = timezone.now().replace(microsecond=0)
+        # Three messages share each timestamp, so pages must split ties on id
+        self.messages = ChatMessage.objects.bulk_create([
+            ChatMessage(profile=self.profile, role='user', text=f'message {n}', created_at=start + timedelta(seconds=n // 3))
+            for n in range(8)
+        ])
+        other = UserProfile.objects.create(user=User.objects.create(username='other'))
+        ChatMessage.objects.create(profile=other, role='user', text='not yours', created_at=start)
+
+    def test_cursor_round_trip(self):
+        message = self.messages[4]
+        self.assertEqual(history.decode_cursor(history.encode_cursor(message)), (message.created_at, message.pk))
+        self.assertNotIn('=', history.encode_cursor(message))
+
+    def test_pages_walk_back_through_equal_timestamps(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            page, cursor = history.history_page(self.profile, before=cursor, limit=3)
+            pages += 1
+            self.assertEqual(page, sorted(page, key=lambda message: (message.created_at, message.pk)))
+            seen = page + seen
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual([message.text for message in seen], [f'message {n}' for n in range(8)])
+
+    def test_page_ending_exactly_at_the_oldest_message_has_no_cursor(self):
+        page, cursor = history.history_page(self.profile, limit=4)
+        page, cursor = history.history_page(self.profile, before=cursor, limit=4)
+        self.assertEqual([message.text for message in page], [f'message {n}' for n in range(4)])
+        self.assertIsNone(cursor)
+
+    def test_tampered_cursors_are_rejected(self):
+        cursor = history.encode_cursor(self.messages[5])
+        naive = base64.urlsafe_b64encode(b'2026-01-01T00:00:00|5').decode()
+        for tampered in (cursor[:-3], cursor + '!!', 'not-a-cursor', naive, base64.urlsafe_b64encode(b'\xff\xfe').decode()):
+            with self.subTest(cursor=tampered), self.assertRaises(history.InvalidCursor):
+                history.history_page(self.profile, before=tampered)
+
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('chat_history'), {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        response = client.get(reverse('chat_history'), {'before': cursor, 'limit': 2})
+        self.assertEqual([message['text'] for message in response.json()['messages']], ['message 3', 'message 4'])
+
+    def test_a_forged_cursor_only_reaches_the_learners_own_messages(self):
+        far_future = base64.urlsafe_b64encode(b'2999-01-01T00:00:00+00:00|999999').decode()
+        page, cursor = history.history_page(self.profile, before=far_future, limit=100)
+        self.assertEqual(len(page), 8)
+        self.assertNotIn('not yours', [message.text for message in page])
+
+
+class ReplyRelayTests(SimpleTestCase):
+    @contextlib.asynccontextmanager
+    async def relay(self, **options):
+        frames, finished = [], []
+
+        async def send(frame):
+            frames.append(frame)
+
+        async def on_finish(message_id, text):
+            finished.append((message_id, text))
+
+        reply = relay.ReplyRelay(send, on_finish=on_finish, **options)
+        reply.frames, reply.finished = frames, finished
+        try:
+            yield reply
+        finally:
+            await reply.close()
+
+    async def test_fragments_within_the_flush_window_become_one_delta(self):
+        async with self.relay(flush_interval=0.05) as reply:
+            for token in ('Seven ', 'times ', 'eight ', 'is ', '56'):
+                await reply.feed(json.dumps({'type': 'token', 'token': token}))
+            self.assertEqual(reply.frames, [])
+            await asyncio.sleep(0.1)
+            self.assertEqual(reply.frames, [{'type': 'delta', 'id': reply.message_id, 'text': 'Seven times eight is 56'}])
+
+            await reply.feed(json.dumps({'type': 'delta', 'delta': '.'}))
+            await asyncio.sleep(0.1)
+            self.assertEqual([frame['text'] for frame in reply.frames], ['Seven times eight is 56', '.'])
+            self.assertEqual((reply.fragments, reply.frames_sent), (6, 2))
+
+    async def test_done_flushes_what_is_left(self):
+        async with self.relay(flush_interval=10) as reply:
+            await reply.feed(json.dumps({'type': 'chunk', 'text': 'Hello'}))
+            await reply.feed(json.dumps({'type': 'chunk', 'text': ', '}))
+            message_id = reply.message_id
+            await reply.feed(json.dumps({'type': 'done', 'text': 'learner!'}))
+            self.assertEqual(reply.frames, [
+                {'type': 'delta', 'id': message_id, 'text': 'Hello, learner!'},
+                {'type': 'done', 'id': message_id},
+            ])
+            self.assertEqual(reply.finished, [(message_id, 'Hello, learner!')])
+            self.assertFalse(reply.streaming)
+
+            await reply.feed(json.dumps({'type': 'stream', 'token': 'Next', 'done': True}))
+            self.assertEqual(reply.frames[2]['text'], 'Next')
+            self.assertNotEqual(reply.frames[2]['id'], message_id)
+            self.assertEqual(reply.frames[3]['type'], 'done')
+
+    async def test_whole_messages_and_errors(self):
+        async with self.relay(flush_interval=10) as reply:
+            await reply.feed(json.dumps({'type': 'token', 'token': 'Half a'}))
+            await reply.feed(json.dumps({'response': 'A whole answer'}))
+            await reply.feed('not json at all')
+            await reply.feed(json.dumps({'type': 'token', 'token': 'cut off'}))
+            await reply.feed(json.dumps({'error': 'engine failed'}))
+            self.assertEqual([(frame.get('type'), frame.get('text')) for frame in reply.frames], [
+                ('delta', 'Half a'), ('done', None),
+                ('delta', 'A whole answer'), ('done', None),
+                ('delta', 'not json at all'), ('done', None),
+                ('delta', 'cut off'), ('done', None),
+                (None, None),
+            ])
+            self.assertEqual(reply.frames[-1], {'error': 'engine failed'})
+            self.assertEqual([text for _, text in reply.finished], ['Half a', 'A whole answer', 'not json at all', 'cut off'])
+
+    async def test_silent_stream_is_closed(self):
+        async with self.relay(flush_interval=0.01, idle_timeout=0.05) as reply:
+            await reply.feed(json.dumps({'type': 'token', 'token': 'And then'}))
+            await asyncio.sleep(0.15)
+            self.assertEqual([frame['type'] for frame in reply.frames], ['delta', 'done'])
+            self.assertFalse(reply.streaming)
+
+
+def make_docx(paragraphs):
+    """A minimal DOCX holding ``paragraphs`` (lists of runs; '\t' is a tab)."""
+    w = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    body = ''.join(
+        '<w:p>%s</w:p>' % ''.join('<w:r><w:tab/></w:r>' if run == '\t' else f'<w:r><w:t>{run}</w:t></w:r>' for run in runs)
+        for runs in paragraphs
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{w}"><w:body>{body}</w:body></w:document>')
+    buffer.seek(0)
+    return buffer
+
+
+class ExtractorTests(SimpleTestCase):
+    def test_detects_by_magic_bytes_then_mime_then_extension(self):
+        self.assertEqual(extractors.detect(io.BytesIO(b'%PDF-1.7'), 'text/plain', 'a.txt'), 'pdf')
+        self.assertEqual(extractors.detect(make_docx([['hi']]), '', 'upload.bin'), 'docx')
+        self.assertEqual(extractors.detect(io.BytesIO(b'a,b'), 'text/csv; charset=utf-8', 'a.txt'), 'csv')
+        self.assertEqual(extractors.detect(io.BytesIO(b'# Hi'), 'application/octet-stream', 'notes.MD'), 'markdown')
+        self.assertIsNone(extractors.detect(io.BytesIO(b'\x00\x01'), '', 'photo.heic'))
+
+    def test_text(self):
+        self.assertEqual(extractors.extract('text', io.BytesIO('\ufeffCafé au lait'.encode('utf-8'))), 'Café au lait')
+
+    @override_settings(DOCUMENT_EXTRACTION_MAX_CHARS=10)
+    def test_long_text_is_truncated(self):
+        text = extractors.extract('text', io.BytesIO(b'x' * 50))
+        self.assertEqual(text, 'x' * 10 + '\n[Only the first 10 characters were read]')
+
+    def test_markdown(self):
+        source = b'# Title\n<!-- hidden -->See ![a cat](cat.png) and [the docs](https://example.com).'
+        self.assertEqual(extractors.extract('markdown', io.BytesIO(source)),
+                         '# Title\nSee [Image: a cat] and the docs (https://example.com).')
+
+    def test_html(self):
+        source = b'<html><head><title>x</title><style>p{}</style></head><body><h1>Plants</h1>' \
+                 b'<p>Need   light &amp; water.</p><ul><li>Roots</li></ul><script>alert(1)</script></body></html>'
+        self.assertEqual(extractors.extract('html', io.BytesIO(source)), 'Plants\n\nNeed light & water.\n\n- Roots')
+
+    @override_settings(CSV_EXTRACTION_MAX_ROWS=2)
+    def test_csv(self):
+        text = extractors.extract('csv', io.BytesIO(b'name;score\nAda; 9\nBo;7\n'))
+        self.assertEqual(text, 'name | score\nAda | 9\n[Only the first 2 rows were read]')
+
+    def test_docx(self):
+        docx = make_docx([['Chapter', ' one'], [], ['a', '\t', 'b']])
+        self.assertEqual(extractors.extract('docx', docx), 'Chapter one\na\tb')
+
+    @override_settings(DOCX_MAX_XML_BYTES=1000)
+    def test_docx_that_inflates_too_far_is_refused(self):
+        # Compresses to a few hundred bytes, inflates to tens of kilobytes
+        docx = make_docx([['x' * 100]] * 500)
+        self.assertLess(len(docx.getvalue()), 1000)
+        with self.assertRaises(extractors.DocumentTooLarge):
+            extractors.extract('docx', docx)
+
+    @override_settings(DOCUMENT_EXTRACTION_MAX_CHARS=50)
+    def test_docx_parsing_stops_at_the_character_limit(self):
+        parsed = []
+        iterparse = extractors.ElementTree.iterparse
+
+        def counting_iterparse(source):
+            for event in iterparse(source):
+                parsed.append(event)
+                yield event
+
+        with mock.patch.object(extractors.ElementTree, 'iterparse', counting_iterparse):
+            text = extractors.extract('docx', make_docx([[f'paragraph {n}'] for n in range(1000)]))
+        self.assertTrue(text.endswith('[Only the first 50 characters were read]'))
+        self.assertLess(len(parsed), 30)
+
+
+class HistoryWriterTests(TestCase):
+    def setUp(self):
+        self.profile = UserProfile.objects.create(user=User.objects.create(username='writer'))
+        self.writer = history.HistoryWriter(batch_size=3, flush_interval=0.01, max_retries=2)
+
+    def texts(self):
+        return list(ChatMessage.objects.filter(profile=self.profile).order_by('id').values_list('text', flat=True))
+
+    async def settle(self):
+        while self.writer.tasks:
+            await asyncio.gather(*self.writer.tasks)
+
+    def failing_writes(self, failures):
+        """Patch bulk_create to fail ``failures`` times, then write for real."""
+        bulk_create = ChatMessage.objects.bulk_create
+        calls = []
+
+        def flaky(batch):
+            calls.append(len(batch))
+            if len(calls) <= failures:
+                raise RuntimeError('database is down')
+            return bulk_create(batch)
+
+        return mock.patch.object(ChatMessage.objects, 'bulk_create', flaky), calls
+
+    async def test_full_batch_is_written_by_a_task_the_writer_keeps(self):
+        for n in range(3):
+            self.writer.add(self.profile.pk, 'user', f'message {n}')
+        self.assertEqual(len(self.writer.tasks), 2)  # the timer and the full-batch flush
+        await self.settle()
+        self.assertEqual(await database_sync_to_async(self.texts)(), ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(self.writer.stats()['batches_written'], 1)
+        self.assertEqual(self.writer.tasks, set())
+
+    async def test_failed_batch_is_retried_in_order(self):
+        patch, calls = self.failing_writes(2)
+        with patch, self.assertLogs('miva.history', 'ERROR'):
+            self.writer.add(self.profile.pk, 'user', 'first')
+            await self.writer.flush()
+            self.writer.add(self.profile.pk, 'assistant', 'second')
+            await self.settle()
+        self.assertEqual(calls, [1, 2, 2])
+        self.assertEqual(await database_sync_to_async(self.texts)(), ['first', 'second'])
+        stats = self.writer.stats()
+        self.assertEqual((stats['write_failures'], stats['messages_dropped'], stats['pending']), (2, 0, 0))
+
+    async def test_batch_is_dropped_after_max_retries(self):
+        patch, calls = self.failing_writes(10)
+        with patch, self.assertLogs('miva.history', 'ERROR'):
+            self.writer.add(self.profile.pk, 'user', 'lost')
+            await self.settle()
+        self.assertEqual(calls, [1, 1, 1])
+        self.assertEqual(self.writer.stats()['messages_dropped'], 1)
+        self.assertEqual(self.writer.pending, [])
+
+    def test_close_writes_what_is_queued(self):
+        async def queue():
+            self.writer.flush_interval = 60
+            self.writer.add(self.profile.pk, 'user', 'last words')
+            for task in self.writer.tasks:
+                task.cancel()
+
+        asyncio.run(queue())
+        self.writer.close()
+        self.assertEqual(self.texts(), ['last words'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatDisconnectTests(SimpleTestCase):
+    async def test_disconnect_flushes_chat_history(self):
+        writer = mock.Mock(flush=mock.AsyncMock())
+        with mock.patch.object(upstream, 'get_pool', UnavailablePool), \
+                mock.patch.object(sessions, '_store', sessions.InMemorySessionStore()), \
+                mock.patch.object(history, 'get_writer', lambda: writer):
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.disconnect()
+        writer.flush.assert_awaited_once()
+
+
+SETTINGS = {
+    'voice_guidance': True, 'break_reminders': False, 'reduce_motion': True, 'daily_reminders': True,
+    'achievement_alerts': False, 'high_contrast': False, 'color_theme': 'ocean',
+}
+
+PATH_ANSWERS = {'learningStyle': 'slow-steady', 'focusTime': '30', 'readingLevel': 'slow', 'learningGoal': 'catch-up'}
+
+
+class LearnerCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create(username='settings')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def save_settings(self, values):
+        return self.client.post(reverse('save_settings'), json.dumps(values), content_type='application/json')
+
+    def test_unchanged_preferences_are_not_written(self):
+        learner.update_preferences(self.profile, {'color_theme': 'ocean', 'age': '12'})
+        learner.get_preferences(self.profile)
+        with self.assertNumQueries(0):
+            self.assertEqual(learner.update_preferences(self.profile, {'color_theme': 'ocean', 'age': 12}), [])
+        with self.assertNumQueries(2):
+            self.assertEqual(learner.update_preferences(self.profile, {'color_theme': 'forest', 'bogus': 1}),
+                             ['color_theme'])
+
+    def test_saving_the_same_settings_again_issues_no_write(self):
+        self.assertEqual(self.save_settings(SETTINGS).json(), {'success': True})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.save_settings(SETTINGS).status_code, 200)
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT', 'UPDATE')) and 'learnerpreferences' in q['sql']]
+        self.assertEqual(writes, [])
+        self.assertEqual(LearnerPreferences.objects.get(profile=self.profile).color_theme, 'ocean')
+
+    def test_writes_invalidate_the_cached_preferences(self):
+        self.assertEqual(learner.get_preferences(self.profile)['color_theme'], 'default')
+        self.save_settings(dict(SETTINGS, color_theme='sunset'))
+        with self.assertNumQueries(1):
+            self.assertEqual(learner.get_preferences(self.profile)['color_theme'], 'sunset')
+        with self.assertNumQueries(0):
+            learner.get_preferences(self.profile)
+
+    def test_quiz_from_post_scores_the_answers(self):
+        answers = learner.quiz_from_post(dict(PATH_ANSWERS, persona='chidi'), 'path')
+        self.assertEqual(answers['persona'], 'tunde')
+        self.assertEqual(answers['flow'], 'path')
+        self.assertEqual(learner.quiz_from_post({'persona': 'ngozi'}, 'adult')['persona'], 'ngozi')
+        self.assertEqual(learner.quiz_from_post({'persona': 'admin'}, 'adult')['persona'], '')
+
+    def test_new_quiz_invalidates_the_cached_quiz(self):
+        self.assertIsNone(learner.latest_quiz(self.profile))
+        with self.assertNumQueries(0):
+            self.assertIsNone(learner.latest_quiz(self.profile))  # a miss is cached too
+
+        self.client.post(reverse('path_questionnaire'), PATH_ANSWERS)
+        self.assertEqual(learner.latest_quiz(self.profile)['persona'], 'tunde')
+
+        # Re-scoring writes behind the cache's back; forget_quizzes drops it
+        self.profile.quiz_results.update(persona='ngozi')
+        self.assertEqual(learner.latest_quiz(self.profile)['persona'], 'tunde')
+        learner.forget_quizzes([self.profile.pk])
+        self.assertEqual(learner.latest_quiz(self.profile)['persona'], 'ngozi')
+
+
+class ProgressTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='progress')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def event(self, event_id, day, kind=ActivityEvent.KIND_LESSON_COMPLETED, **extra):
+        at = timezone.make_aware(datetime(day.year, day.month, day.day, 12))
+        return dict({'id': event_id, 'kind': kind, 'at': at, 'xp': progress.XP_BY_KIND[kind]}, **extra)
+
+    def test_apply_event_rolls_the_streak_over_days(self):
+        row = LearnerProgress(profile=self.profile)
+        day = date(2026, 3, 1)
+        for offset in (0, 0, 1, 2):
+            progress.apply_event(row, ActivityEvent.KIND_LESSON_COMPLETED, 25, day + timedelta(days=offset))
+        self.assertEqual((row.streak_days, row.longest_streak, row.last_active_date), (3, 3, date(2026, 3, 3)))
+        self.assertEqual((row.total_xp, row.lessons_completed), (100, 4))
+
+        progress.apply_event(row, ActivityEvent.KIND_VISIT, 0, date(2026, 3, 5))  # missed the 4th
+        self.assertEqual((row.streak_days, row.longest_streak), (1, 3))
+        # An older day adds XP but does not rewind the streak
+        progress.apply_event(row, ActivityEvent.KIND_QUIZ_COMPLETED, 15, date(2026, 3, 4))
+        self.assertEqual((row.streak_days, row.last_active_date, row.total_xp), (1, date(2026, 3, 5), 115))
+        # first_lesson, three_day_streak, xp_100
+        self.assertEqual(row.badges_earned, 3)
+        self.assertEqual(progress.current_streak(row, today=date(2026, 3, 6)), 1)
+        self.assertEqual(progress.current_streak(row, today=date(2026, 3, 7)), 0)
+
+    def test_replaying_a_batch_records_it_once(self):
+        day = timezone.localdate() - timedelta(days=2)
+        batch = [self.event('a', day), self.event('b', day + timedelta(days=1))]
+        first, recorded = progress.record_batch(self.profile, batch)
+        self.assertEqual(sorted(recorded), ['a', 'b'])
+        again, recorded = progress.record_batch(self.profile, batch + [self.event('a', day)])
+        self.assertEqual(recorded, [])
+        self.assertEqual((again.total_xp, again.lessons_completed, again.streak_days), (50, 2, 2))
+        self.assertEqual(ActivityEvent.objects.filter(profile=self.profile).count(), 2)
+
+    def test_rebuild_reproduces_the_incremental_rows(self):
+        other = UserProfile.objects.create(user=User.objects.create(username='other'))
+        start = timezone.localdate() - timedelta(days=10)
+        kinds = [ActivityEvent.KIND_LESSON_STARTED, ActivityEvent.KIND_LESSON_COMPLETED, ActivityEvent.KIND_QUIZ_COMPLETED]
+        for number, offset in enumerate((0, 1, 2, 4, 5, 9)):
+            kind = kinds[number % 3]
+            progress.record_batch(self.profile, [self.event(f'p{number}', start + timedelta(days=offset), kind)])
+            progress.record_batch(other, [self.event(f'o{number}', start + timedelta(days=offset * 2 % 10))])
+        fields = ['profile_id', 'total_xp', 'lessons_completed', 'streak_days', 'longest_streak',
+                  'last_active_date', 'badges_earned']
+        incremental = list(LearnerProgress.objects.order_by('profile_id').values(*fields))
+
+        LearnerProgress.objects.filter(profile=self.profile).update(total_xp=0, streak_days=0)
+        call_command('rebuild_progress', '--user', 'progress', stdout=io.StringIO())
+        self.assertEqual(list(LearnerProgress.objects.order_by('profile_id').values(*fields)), incremental)
+        self.assertEqual(progress.rebuild(chunk_size=2), 2)
+        self.assertEqual(list(LearnerProgress.objects.order_by('profile_id').values(*fields)), incremental)
+
+    def test_client_xp_is_clamped_to_the_kind(self):
+        most = progress.XP_BY_KIND[ActivityEvent.KIND_QUIZ_COMPLETED]
+        for reported, expected in [(10, 10), (10_000, most), (-5, 0), (float('inf'), most),
+                                   (float('nan'), most), (True, most), ('999', most), (None, most)]:
+            self.assertEqual(progress.client_xp(ActivityEvent.KIND_QUIZ_COMPLETED, reported), expected, reported)
+
+    def test_views_clamp_reported_xp(self):
+        response = self.client.post(reverse('progress_event'), json.dumps({'kind': 'lesson_completed', 'xp': 10_000}),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['total_points'], progress.XP_BY_KIND[ActivityEvent.KIND_LESSON_COMPLETED])
+
+        at = int(time.time() * 1000)
+        response = self.client.post(reverse('progress_batch'), json.dumps({'events': [
+            {'id': 'x1', 'kind': 'quiz_completed', 'at': at, 'xp': 10 ** 9},
+            {'id': 'x2', 'kind': 'quiz_completed', 'at': at, 'xp': 5},
+        ]}), content_type='application/json')
+        self.assertEqual(response.json()['total_points'], 25 + 15 + 5)
+        self.assertEqual(ActivityEvent.objects.get(client_id='x1').xp, 15)
+
+
+PERSONAS_JS = os.path.join(settings.ASSET_SOURCE_DIR, 'personas.js')
+
+# Answer sets whose scores tie, in form field names
+TIED_ANSWERS = [
+    {},
+    {'learningStyle': 'mixed'},
+    {'readingLevel': 'slow'},
+    {'learningGoal': 'school'},
+    {'focusTime': '15', 'readingLevel': 'slow', 'learningGoal': 'confidence'},
+    {'learningStyle': 'visual-active', 'readingLevel': 'struggle', 'learningGoal': 'life-skills'},
+    {'learningStyle': 'constructor', 'focusTime': 'flex'},
+]
+
+
+class PersonaWeightTests(SimpleTestCase):
+    def js_weights(self):
+        """PERSONA_WEIGHTS from assets/personas.js as {(question, answer): points}."""
+        with open(PERSONAS_JS, encoding='utf-8') as f:
+            table = re.search(r'const PERSONA_WEIGHTS = \{(.*?)\n\};', f.read(), re.S).group(1)
+        weights = {}
+        for field, body in re.findall(r'(\w+): \{(.*?)\}', table, re.S):
+            for answer, points in re.findall(r"'([^']+)': \[([\d, ]+)\]", body):
+                weights[personas.FORM_FIELDS[field], answer] = tuple(int(n) for n in points.split(','))
+        return weights
+
+    def answer_sets(self):
+        choices = [[''] + [answer for question, answer in personas.SCORING_TABLE if question == name]
+                   for name in personas.QUESTIONS]
+        fields = list(personas.FORM_FIELDS)
+        return [dict(zip(fields, combo)) for combo in itertools.product(*choices)] + TIED_ANSWERS
+
+    def test_js_weights_match_the_scoring_table(self):
+        self.assertEqual(self.js_weights(), personas.SCORING_TABLE)
+
+    def test_ties_go_to_the_first_persona(self):
+        self.assertEqual(personas.detect(personas.from_form({'learningStyle': 'mixed'})), 'chidi')
+        self.assertEqual(personas.detect(personas.from_form({'readingLevel': 'slow'})), 'ngozi')
+        self.assertEqual(personas.detect(personas.from_form({'learningGoal': 'confidence'})), 'ngozi')
+        self.assertIsNone(personas.detect(personas.from_form({})))
+
+    @skipUnless(shutil.which('node'), 'needs node')
+    def test_browser_and_server_score_the_same(self):
+        answer_sets = self.answer_sets()
+        script = (
+            'const fs = require("fs"); eval(fs.readFileSync(process.argv[1], "utf8") + `;'
+            'console.log(JSON.stringify(JSON.parse(process.argv[2]).map(a => [scorePersonas(a), detectPersona(a)])))`);'
+        )
+        output = subprocess.run(
+            ['node', '-e', script, PERSONAS_JS, json.dumps(answer_sets)],
+            capture_output=True, text=True, check=True, timeout=30,
+        ).stdout
+        for answers, (scores, persona) in zip(answer_sets, json.loads(output)):
+            form = personas.from_form(answers)
+            self.assertEqual(scores, personas.score(form), answers)
+            # The browser shows the first persona when no answer is recognised
+            self.assertEqual(persona, personas.detect(form) or personas.PERSONAS[0], answers)
+
+
+class RescorePersonasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def quiz(self, username, persona, **answers):
+        profile = UserProfile.objects.create(user=User.objects.create(username=username))
+        learner.record_quiz(profile, dict(answers, persona=persona))
+        return profile
+
+    def test_rescore_updates_stored_profiles(self):
+        stale = self.quiz('stale', 'chidi', learning_style='audio-patient', reading_level='struggle')
+        current = self.quiz('current', 'tunde', learning_style='slow-steady')
+        unanswered = self.quiz('unanswered', 'ngozi')
+        self.assertEqual(learner.latest_quiz(stale)['persona'], 'chidi')
+
+        out = io.StringIO()
+        call_command('rescore_personas', '--dry-run', stdout=out)
+        self.assertIn('1 persona(s) would change', out.getvalue())
+        self.assertEqual(QuizResult.objects.get(profile=stale).persona, 'chidi')
+
+        call_command('rescore_personas', '--chunk-size', '2', stdout=out)
+        personas_by_user = dict(QuizResult.objects.values_list('profile__user__username', 'persona'))
+        self.assertEqual(personas_by_user, {'stale': 'ngozi', 'current': 'tunde', 'unanswered': 'ngozi'})
+        # The cached quiz is dropped along with the change
+        self.assertEqual(learner.latest_quiz(stale)['persona'], 'ngozi')
+        self.assertEqual(learner.latest_quiz(current)['persona'], 'tunde')
+        self.assertEqual(learner.latest_quiz(unanswered)['persona'], 'ngozi')
+
+
+class DocumentTextCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def make_cache(self, memory_bytes=10, disk_bytes=15):
+        return doc_cache.DocumentTextCache(self.directory, memory_bytes=memory_bytes, disk_bytes=disk_bytes)
+
+    def on_disk(self):
+        return sorted(path.stem for path in Path(self.directory).glob('*/*.txt'))
+
+    async def test_entry_pushed_out_of_memory_is_promoted_back_from_disk(self):
+        cache = self.make_cache()
+        await cache.put('aa', 'first!')
+        await cache.put('bb', 'second')
+        self.assertEqual(list(cache.memory), ['bb'])
+        self.assertEqual(cache.stats()['memory_evictions'], 1)
+
+        self.assertEqual(await cache.get('aa'), 'first!')
+        self.assertEqual(list(cache.memory), ['aa'])
+        self.assertEqual(await cache.get('aa'), 'first!')
+        self.assertIsNone(await cache.get('cc'))
+        stats = cache.stats()
+        self.assertEqual((stats['disk_hits'], stats['memory_hits'], stats['misses']), (1, 1, 1))
+
+    async def test_least_recently_used_file_is_evicted_at_the_byte_limit(self):
+        cache = self.make_cache(memory_bytes=0)
+        await cache.put('aa', 'aaaaaa')
+        await cache.put('bb', 'bbbbbb')
+        await cache.get('aa')  # now bb is the oldest
+        with mock.patch.object(Path, 'glob', side_effect=AssertionError('rescanned the directory')):
+            await cache.put('cc', 'cccccc')
+            await cache.put('cc', 'ccc')
+        self.assertEqual(self.on_disk(), ['aa', 'cc'])
+        stats = cache.stats()
+        self.assertEqual((stats['disk_entries'], stats['disk_bytes'], stats['disk_evictions']), (2, 9, 1))
+
+        # Too big for the disk tier at all: not written, nothing evicted
+        await cache.put('dd', 'd' * 16)
+        self.assertEqual(self.on_disk(), ['aa', 'cc'])
+
+    async def test_restart_indexes_existing_files_oldest_first(self):
+        cache = self.make_cache(memory_bytes=0)
+        for age, key in enumerate(['cc', 'bb', 'aa']):
+            await cache.put(key, 'xxxx')
+            os.utime(cache._path(key), (1000 - age, 1000 - age))
+
+        restarted = self.make_cache(memory_bytes=0)
+        await restarted.put('dd', 'yyyy')
+        self.assertEqual(self.on_disk(), ['bb', 'cc', 'dd'])
+        self.assertEqual(restarted.stats()['disk_bytes'], 12)
+        self.assertEqual(await restarted.get('bb'), 'xxxx')
+
+    async def test_file_written_by_another_process_is_read_and_counted(self):
+        cache = self.make_cache(memory_bytes=0)
+        await cache.put('aa', 'aaaaaa')
+        await self.make_cache(memory_bytes=0).put('bb', 'bbbbbb')
+        self.assertEqual(await cache.get('bb'), 'bbbbbb')
+        self.assertEqual(cache.stats()['disk_bytes'], 12)
+        await cache.put('cc', 'cccccc')
+        self.assertEqual(self.on_disk(), ['bb', 'cc'])
+
+
+@override_settings(METRICS_TOKEN='scrape-me')
+class MetricsViewTests(TestCase):
+    def test_anonymous_request_is_refused(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(b'chat_', response.content)
+
+    def test_learner_without_the_token_is_refused(self):
+        self.client.force_login(User.objects.create(username='learner'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        for header in ('Bearer wrong', 'scrape-me', 'Bearer scrape-me '):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=header).status_code, 403, header)
+
+    def test_token_or_staff_user_gets_the_metrics(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_setting_accepts_no_bearer(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class DashboardFragmentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def dashboard_for(self, first_name):
+        self.client.force_login(User.objects.create(username=first_name.lower(), first_name=first_name))
+        return self.client.get(reverse('dashboard')).content.decode()
+
+    def main_fragment_key(self):
+        return make_template_fragment_key(
+            'dashboard_default_main', [settings.DASHBOARD_FRAGMENT_VERSION, settings.LANGUAGE_CODE],
+        )
+
+    def test_learners_share_fragments_but_not_the_header(self):
+        ada = self.dashboard_for('Ada')
+        self.assertIn('Good afternoon, Ada!', ada)
+        self.assertIn('My Progress', cache.get(self.main_fragment_key()))
+        cache.set(self.main_fragment_key(), '<p>cached main</p>')
+
+        bayo = self.dashboard_for('Bayo')
+        self.assertIn('Good afternoon, Bayo!', bayo)
+        self.assertNotIn('Ada', bayo)
+        self.assertIn('<p>cached main</p>', bayo)
+
+    def test_new_version_renders_fresh_fragments(self):
+        self.dashboard_for('Ada')
+        cache.set(self.main_fragment_key(), '<p>old deploy</p>')
+        with override_settings(DASHBOARD_FRAGMENT_VERSION='2'):
+            page = self.dashboard_for('Bayo')
+        self.assertNotIn('old deploy', page)
+        self.assertIn('My Progress', page)
+
+
+def curriculum(*lessons):
+    return {'lessons': [
+        {'slug': slug, 'subject': 'math', 'position': position, 'title': slug.title(), 'questions': [
+            {'prompt': f'{slug} {number}?', 'choices': ['a', 'b'], 'answer': number % 2}
+            for number in range(count)
+        ]}
+        for position, (slug, count) in enumerate(lessons, start=1)
+    ]}
+
+
+class CurriculumImportTests(TestCase):
+    def setUp(self):
+        lessons.curriculum_changed()
+        self.addCleanup(lessons.curriculum_changed)
+        with self.captureOnCommitCallbacks(execute=True):
+            lessons.import_curriculum(curriculum(('math-counting', 2)))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, data):
+        path = os.path.join(self.directory, 'curriculum.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+    def snapshot(self):
+        return (
+            list(Lesson.objects.order_by('slug').values_list('slug', 'title', 'updated_at')),
+            list(Question.objects.order_by('pk').values_list('pk', 'lesson__slug', 'prompt')),
+        )
+
+    def test_bad_question_file_imports_nothing(self):
+        before = self.snapshot()
+        data = curriculum(('math-counting', 3), ('math-adding', 2), ('math-shapes', 1))
+        data['lessons'][2]['questions'][0]['answer'] = 5
+        with self.assertRaisesMessage(CommandError, 'lessons[2].questions[0].answer must index into choices'):
+            call_command('import_curriculum', self.write(data), '--replace', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_failure_while_writing_rolls_back_the_whole_import(self):
+        before = self.snapshot()
+        bank = lessons.get_bank()
+        data = curriculum(('math-counting', 3), ('math-adding', 2))
+        with mock.patch.object(Question.objects, 'bulk_create', side_effect=IntegrityError('disk full')):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with self.assertRaises(IntegrityError):
+                    call_command('import_curriculum', self.write(data), stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(callbacks, [])
+        self.assertIs(lessons.get_bank(), bank)
+
+    def test_bank_reflects_a_new_import(self):
+        bank = lessons.get_bank()
+        self.assertEqual([question_set.slug for question_set in bank.lessons('math')], ['math-counting'])
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_curriculum', self.write(curriculum(('math-counting', 3), ('math-adding', 1))),
+                         stdout=io.StringIO())
+        bank = lessons.get_bank()
+        self.assertEqual([question_set.slug for question_set in bank.lessons('math')], ['math-counting', 'math-adding'])
+        counting = bank.get('math-counting')
+        self.assertEqual(len(counting.question_ids), 3)
+        self.assertIn('math-counting 2?', counting.body.decode())
+
+    @override_settings(LESSON_BANK_CHECK_SECONDS=0)
+    def test_other_processes_notice_an_import(self):
+        bank = lessons.get_bank()
+        # Imported by another process: this one's on_commit hook never runs
+        lessons.import_curriculum(curriculum(('math-counting', 2), ('math-adding', 1)), replace=True)
+        self.assertIsNot(lessons.get_bank(), bank)
+        self.assertIsNotNone(lessons.get_bank().get('math-adding'))
+
+
+class OfflineBuildTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        root = Path(directory.name)
+        cls.static_root = root / 'static'
+        built = override_settings(
+            STATIC_ROOT=cls.static_root, ASSET_BUNDLE_DIR=root / 'bundles',
+            OFFLINE_PRECACHE_MANIFEST=cls.static_root / 'precache.json',
+        )
+        built.enable()
+        cls.addClassCleanup(built.disable)
+        call_command('build_assets', '--json', stdout=io.StringIO())
+        cls.paths = json.loads((cls.static_root / 'staticfiles.json').read_text())['paths']
+
+    def setUp(self):
+        # Serve the hashed names build_assets wrote, as in production
+        served = override_settings(DEBUG=False, STATIC_ASSETS_BUILT=True, STORAGES={
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'},
+        })
+        served.enable()
+        self.addCleanup(served.disable)
+        offline._manifest = None
+        self.addCleanup(setattr, offline, '_manifest', None)
+        call_command('build_precache', stdout=io.StringIO())
+        self.manifest = json.loads((self.static_root / 'precache.json').read_text())
+
+    def test_precache_lists_exactly_the_built_files(self):
+        self.assertTrue(self.manifest['hashed'])
+        templates = {}
+        for _, name in offline.LESSON_PAGES + offline.DASHBOARD_PAGES:
+            offline.template_files(name, templates)
+        loaded = {name for path in templates.values() for name in offline.STATIC_TAG.findall(path.read_text())}
+        self.assertIn('bundles/app.js', loaded)
+        self.assertIn('bundles/persona-dashboard.js', loaded)
+
+        expected = {settings.STATIC_URL + self.paths[name] for name in loaded}
+        self.assertEqual(len(self.manifest['assets']), len(expected))
+        self.assertEqual(set(self.manifest['assets']), expected)
+        for url in self.manifest['assets']:
+            built = self.static_root / url[len(settings.STATIC_URL):]
+            # The name carries the hash of exactly the bytes build_assets wrote
+            content_hash = built.suffixes[-2].lstrip('.')
+            self.assertEqual(hashlib.md5(built.read_bytes()).hexdigest()[:12], content_hash, url)
+            self.assertTrue(built.with_name(built.name + '.gz').exists(), url)
+
+    def test_build_assets_hashes_and_compresses_every_bundle(self):
+        for name in assets.BUNDLES:
+            built = self.static_root / self.paths[f'{assets.BUNDLE_PREFIX}/{name}']
+            self.assertEqual(built.read_text(encoding='utf-8'), (
+                assets.minify_js if name.endswith('.js') else assets.minify_css
+            )(assets.bundle_source(name)), name)
+            self.assertTrue(built.with_name(built.name + '.gz').exists(), name)
+
+        out = io.StringIO()
+        call_command('build_assets', '--json', stdout=out)
+        page = json.loads(out.getvalue())['pages']['student.html']
+        # site.css (styles.css) and student.js (personas.js, app.js, persona-detection.js)
+        self.assertEqual((page['requests_before'], page['requests_after']), (4, 2))
+        self.assertLess(page['gzip'], page['minified'])
+        self.assertLess(page['minified'], page['before'])
+
+    def test_service_worker_serves_the_manifest_uncached(self):
+        response = self.client.get(reverse('service_worker'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertEqual(response['ETag'], f'"{self.manifest["version"]}"')
+        first_line, _, source = response.content.decode().partition('\n')
+        self.assertEqual(json.loads(first_line.removeprefix('const PRECACHE = ').removesuffix(';')), self.manifest)
+        self.assertEqual(source, assets.source_path(offline.WORKER_SOURCE).read_text(encoding='utf-8'))
+
+        revalidated = self.client.get(reverse('service_worker'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
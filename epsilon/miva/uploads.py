@@ -0,0 +1,177 @@
+"""
+Chunked binary file uploads over the chat WebSocket.
+
+The browser sends a file as a series of binary frames instead of one huge
+base64 JSON message. Every frame is laid out as::
+
+    [4-byte big-endian header length][UTF-8 JSON header][payload bytes]
+
+and the header's ``op`` is one of:
+
+    start  {"op": "start", "id", "name", "type", "size"}
+    chunk  {"op": "chunk", "id", "offset"} + raw file bytes
+    end    {"op": "end", "id", "message", "unique_id", "sha256"}
+    abort  {"op": "abort", "id"}
+
+Chunks are written to a SpooledTemporaryFile as they arrive, so the
+consumer never holds more than one chunk of the file as a Python object
+and can hand the text extractor a file-like object when the upload ends.
+When the end frame carries the file's SHA-256 (optional: browsers only
+compute it in a secure context) the upload is refused unless it matches.
+"""
+import hashlib
+import struct
+import tempfile
+
+from django.conf import settings
+
+from . import codec
+
+
+HEADER_LENGTH = struct.Struct('>I')
+
+
+class UploadError(Exception):
+    """Raised when an upload frame is malformed or breaks the upload rules."""
+
+    def __init__(self, message, upload_id=None):
+        super().__init__(message)
+        self.upload_id = upload_id
+
+
+def parse_frame(data):
+    """Split a binary upload frame into its JSON header and payload."""
+    if len(data) < HEADER_LENGTH.size:
+        raise UploadError('Upload frame too short')
+    (header_length,) = HEADER_LENGTH.unpack_from(data)
+    header_end = HEADER_LENGTH.size + header_length
+    if header_length == 0 or header_end > len(data):
+        raise UploadError('Invalid upload frame header length')
+    try:
+        header = codec.loads(data[HEADER_LENGTH.size:header_end])
+    except ValueError:
+        raise UploadError('Invalid upload frame header')
+    if not isinstance(header, dict) or not header.get('id'):
+        raise UploadError('Upload frame header must include an id')
+    return header, memoryview(data)[header_end:]
+
+
+class Upload:
+    """A single in-progress upload spooled to memory, then disk."""
+
+    def __init__(self, upload_id, name, mime, size, spool_bytes):
+        self.id = upload_id
+        self.name = name
+        self.mime = mime
+        self.size = size
+        self.received = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+        # Hashed as chunks arrive so the text cache can be checked for free
+        self.hasher = hashlib.sha256()
+
+    @property
+    def digest(self):
+        return self.hasher.hexdigest()
+
+    def write(self, offset, payload):
+        if offset != self.received:
+            raise UploadError(
+                f'Expected chunk at offset {self.received}, got {offset}', self.id
+            )
+        if self.received + len(payload) > self.size:
+            raise UploadError('Upload is larger than its declared size', self.id)
+        self.file.write(payload)
+        self.hasher.update(payload)
+        self.received += len(payload)
+        return self.received
+
+    def close(self):
+        self.file.close()
+
+
+class UploadAssembler:
+    """
+    Tracks the uploads in progress on one WebSocket and enforces the size
+    limit, chunk size and number of concurrent uploads.
+    """
+
+    def __init__(self, max_bytes=None, chunk_bytes=None, spool_bytes=None, max_active=2):
+        self.max_bytes = max_bytes or settings.CHAT_UPLOAD_MAX_BYTES
+        self.chunk_bytes = chunk_bytes or settings.CHAT_UPLOAD_CHUNK_BYTES
+        self.spool_bytes = spool_bytes or settings.CHAT_UPLOAD_SPOOL_BYTES
+        self.max_active = max_active
+        self.active = {}
+
+    def start(self, header):
+        upload_id = header['id']
+        if upload_id in self.active:
+            raise UploadError('Upload id already in use', upload_id)
+        if len(self.active) >= self.max_active:
+            raise UploadError('Too many uploads in progress', upload_id)
+        try:
+            size = int(header.get('size', 0))
+        except (TypeError, ValueError):
+            raise UploadError('Invalid upload size', upload_id)
+        if size <= 0:
+            raise UploadError('Upload size is required', upload_id)
+        if size > self.max_bytes:
+            limit_mb = self.max_bytes // (1024 * 1024)
+            raise UploadError(f'File is too large (limit {limit_mb}MB)', upload_id)
+
+        upload = Upload(
+            upload_id,
+            str(header.get('name') or 'unknown'),
+            str(header.get('type') or ''),
+            size,
+            self.spool_bytes,
+        )
+        self.active[upload_id] = upload
+        return upload
+
+    def write(self, header, payload):
+        """Append a chunk and return the number of bytes received so far."""
+        upload = self._get(header)
+        if len(payload) > self.chunk_bytes:
+            self.abort(upload.id)
+            raise UploadError('Upload chunk is too large', upload.id)
+        try:
+            offset = int(header.get('offset', -1))
+        except (TypeError, ValueError):
+            offset = -1
+        try:
+            return upload.write(offset, payload)
+        except UploadError:
+            self.abort(upload.id)
+            raise
+
+    def finish(self, header):
+        """Complete an upload and return it with its file rewound."""
+        upload = self._get(header)
+        del self.active[upload.id]
+        if upload.received != upload.size:
+            upload.close()
+            raise UploadError(
+                f'Upload ended after {upload.received} of {upload.size} bytes', upload.id
+            )
+        expected = header.get('sha256')
+        if expected and str(expected).lower() != upload.digest:
+            upload.close()
+            raise UploadError('Upload does not match its checksum', upload.id)
+        upload.file.seek(0)
+        return upload
+
+    def abort(self, upload_id):
+        upload = self.active.pop(upload_id, None)
+        if upload is not None:
+            upload.close()
+
+    def close(self):
+        """Discard every unfinished upload (e.g. on disconnect)."""
+        for upload_id in list(self.active):
+            self.abort(upload_id)
+
+    def _get(self, header):
+        upload = self.active.get(header['id'])
+        if upload is None:
+            raise UploadError('Unknown upload id', header['id'])
+        return upload
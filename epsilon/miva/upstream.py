@@ -0,0 +1,634 @@
+"""
+Shared, pooled connections to the external AI engine.
+
+Instead of every ChatConsumer opening its own aiohttp session and WebSocket,
+the process keeps one ClientSession and a bounded set of upstream WebSockets.
+Many browser sockets are multiplexed over each upstream connection; every
+outbound frame is stamped with a ``correlation_id`` so replies can be routed
+back to the consumer that sent the request.
+
+Each consumer talks to the pool through an UpstreamClient, which reconnects
+with jittered exponential backoff when its connection is lost and queues a
+bounded number of outbound frames until it is back. Connection attempts are
+gated by the pool's CircuitBreaker, so after repeated failures a whole
+worker's consumers back off together instead of hammering a recovering
+engine.
+"""
+import asyncio
+import collections
+import logging
+import random
+import time
+import uuid
+
+import aiohttp
+from django.conf import settings
+
+from . import codec, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when no upstream connection to the AI engine can be obtained."""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised instead of connecting while the circuit breaker is open."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops connection attempts to an engine that keeps failing.
+
+    ``closed``: attempts allowed. After ``failure_threshold`` consecutive
+    failures the breaker is ``open`` and refuses attempts for
+    ``reset_timeout`` seconds, then ``half_open``: a single trial attempt is
+    let through, which closes the breaker on success or re-opens it on
+    failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    def retry_after(self):
+        """Seconds until the breaker will let a trial attempt through."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """True if a connection attempt may be made now."""
+        if self.state == self.OPEN and self.retry_after() == 0:
+            self.state = self.HALF_OPEN
+            self.trial_running = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected_attempts': self.rejected,
+            'retry_after_seconds': round(self.retry_after(), 3),
+        }
+
+
+class UpstreamSession:
+    """
+    A single consumer's handle on the pool.
+
+    ``send_json`` stamps the session's correlation id on the frame and writes
+    it to the shared upstream connection. Iterating the session yields the
+    raw text of every reply routed to it; iteration stops when the session is
+    closed or the underlying connection is lost.
+    """
+
+    def __init__(self, pool, connection):
+        self.pool = pool
+        self.connection = connection
+        self.correlation_id = uuid.uuid4().hex
+        self.inbox = asyncio.Queue()
+        self.in_flight = 0
+        self.closed = False
+
+    async def send_json(self, data):
+        """Send a JSON frame upstream on behalf of this session."""
+        if self.closed:
+            raise UpstreamUnavailable('Upstream session is closed')
+        frame = dict(data)
+        frame['correlation_id'] = self.correlation_id
+        await self.connection.send(self, frame)
+
+    def deliver(self, text):
+        """Queue a reply frame for this session (called by the connection)."""
+        if not self.closed:
+            self.inbox.put_nowait(text)
+
+    def end(self):
+        """Stop iteration for anyone listening on this session."""
+        self.closed = True
+        self.inbox.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        text = await self.inbox.get()
+        if text is None:
+            raise StopAsyncIteration
+        return text
+
+    async def close(self):
+        """Detach from the pool, freeing a stream slot on the connection."""
+        if self.closed:
+            return
+        self.end()
+        await self.pool.release(self)
+
+
+class UpstreamConnection:
+    """
+    One multiplexed WebSocket to the AI engine.
+
+    A background reader routes each reply to the session named by its
+    ``correlation_id``. A reply without one (an engine that does not echo the
+    id) can only go to the connection's sole session: with several sessions
+    attached there is no telling whose reply it is, so it is logged and
+    dropped rather than risk showing one learner another's answer.
+    """
+
+    def __init__(self, pool, ws):
+        self.pool = pool
+        self.ws = ws
+        self.sessions = {}
+        self.send_lock = asyncio.Lock()
+        self.reader_task = asyncio.create_task(self.read())
+
+    @property
+    def load(self):
+        return len(self.sessions)
+
+    @property
+    def in_flight(self):
+        return sum(session.in_flight for session in self.sessions.values())
+
+    async def send(self, session, frame):
+        text = codec.dumps(frame)
+        metrics.UPSTREAM_PAYLOAD_BYTES.observe(len(text))
+        async with self.send_lock:
+            with metrics.UPSTREAM_SEND_SECONDS.time():
+                await self.ws.send_str(text)
+        session.in_flight += 1
+        self.pool.sent += 1
+
+    def route(self, text):
+        """Deliver one upstream reply frame to the session that asked for it."""
+        correlation_id = None
+        if '"correlation_id"' in text:
+            try:
+                correlation_id = codec.loads(text).get('correlation_id')
+            except (ValueError, AttributeError):
+                correlation_id = None
+
+        if correlation_id is None:
+            if len(self.sessions) != 1:
+                logger.warning(
+                    "Dropping upstream frame without a correlation id (%d sessions on the connection): %.200s",
+                    len(self.sessions), text,
+                )
+                self.pool.dropped += 1
+                return
+            correlation_id = next(iter(self.sessions))
+
+        session = self.sessions.get(correlation_id)
+        if session is None:
+            logger.warning("Dropping upstream frame for unknown correlation id %r", correlation_id)
+            self.pool.dropped += 1
+            return
+
+        if session.in_flight:
+            # First reply to an outstanding request: it is no longer in flight
+            session.in_flight -= 1
+        self.pool.received += 1
+        session.deliver(text)
+
+    async def read(self):
+        try:
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    self.route(msg.data)
+                elif msg.type == aiohttp.WSMsgType.ERROR:
+                    logger.warning('AI WebSocket error: %s', self.ws.exception())
+                    break
+                elif msg.type == aiohttp.WSMsgType.CLOSED:
+                    logger.info('AI WebSocket closed')
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("Error in upstream reader")
+        finally:
+            await self.pool.connection_lost(self)
+
+    async def close(self):
+        self.reader_task.cancel()
+        try:
+            await self.ws.close()
+        except Exception:
+            pass
+
+
+class UpstreamPool:
+    """
+    Process-wide pool of multiplexed upstream connections.
+
+    At most ``max_connections`` WebSockets are opened, each carrying up to
+    ``streams_per_connection`` consumer sessions. When every slot is taken,
+    ``attach`` waits (up to ``acquire_timeout`` seconds) for one to free up.
+    By default every session gets a connection of its own, which is safe with
+    an engine that does not echo ``correlation_id``.
+    """
+
+    def __init__(self, url, max_connections=256, streams_per_connection=1,
+                 acquire_timeout=10.0, heartbeat=30.0, breaker=None):
+        self.url = url
+        self.max_connections = max_connections
+        self.streams_per_connection = streams_per_connection
+        self.acquire_timeout = acquire_timeout
+        self.heartbeat = heartbeat
+        self.breaker = breaker or CircuitBreaker()
+
+        self.connections = []
+        self.connecting = 0
+        self.http = None
+        self.loop = None
+        self.capacity = None
+
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.acquire_waits = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+
+    def _bind_loop(self):
+        """
+        Tie pool state to the running event loop. aiohttp sessions and
+        asyncio primitives cannot be shared across loops, so a new loop
+        (e.g. a fresh test run) starts from an empty pool.
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.connections = []
+            self.connecting = 0
+            self.http = None
+            self.capacity = asyncio.Condition()
+
+    def _least_loaded(self):
+        candidates = [c for c in self.connections if c.load < self.streams_per_connection]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: c.load)
+
+    async def _open(self):
+        if not self.breaker.allow():
+            raise CircuitOpen('AI engine circuit breaker is open', self.breaker.retry_after())
+        if self.http is None or self.http.closed:
+            self.http = aiohttp.ClientSession()
+        try:
+            ws = await self.http.ws_connect(self.url, heartbeat=self.heartbeat)
+        except Exception as e:
+            self.breaker.record_failure()
+            raise UpstreamUnavailable(f'Failed to connect to AI engine: {e}') from e
+        self.breaker.record_success()
+        logger.info("Opened upstream connection to %s", self.url)
+        return UpstreamConnection(self, ws)
+
+    async def attach(self):
+        """Return a new UpstreamSession on the least loaded connection."""
+        self._bind_loop()
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        waited = False
+        connection = None
+
+        async with self.capacity:
+            while True:
+                connection = self._least_loaded()
+                if connection is not None:
+                    break
+                if len(self.connections) + self.connecting < self.max_connections:
+                    self.connecting += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise UpstreamUnavailable('Timed out waiting for an upstream connection')
+                waited = True
+                try:
+                    await asyncio.wait_for(self.capacity.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise UpstreamUnavailable('Timed out waiting for an upstream connection')
+
+            if connection is not None:
+                return self._register(connection, started, waited)
+
+        # Open the new connection outside the lock so other attaches can proceed
+        try:
+            connection = await self._open()
+        finally:
+            async with self.capacity:
+                self.connecting -= 1
+                if connection is not None:
+                    self.connections.append(connection)
+                self.capacity.notify_all()
+
+        async with self.capacity:
+            return self._register(connection, started, waited)
+
+    def _register(self, connection, started, waited):
+        session = UpstreamSession(self, connection)
+        connection.sessions[session.correlation_id] = session
+        if waited:
+            elapsed = time.monotonic() - started
+            self.acquire_waits += 1
+            self.acquire_wait_total += elapsed
+            self.acquire_wait_max = max(self.acquire_wait_max, elapsed)
+        return session
+
+    async def release(self, session):
+        """Remove a session from its connection and wake any waiters."""
+        connection = session.connection
+        connection.sessions.pop(session.correlation_id, None)
+        if self.capacity is not None:
+            async with self.capacity:
+                self.capacity.notify_all()
+
+    async def connection_lost(self, connection):
+        """Drop a dead connection and end every session riding on it."""
+        if connection in self.connections:
+            self.connections.remove(connection)
+        for session in list(connection.sessions.values()):
+            session.end()
+        connection.sessions.clear()
+        if self.capacity is not None:
+            async with self.capacity:
+                self.capacity.notify_all()
+
+    async def close(self):
+        """Close every upstream connection and the shared HTTP session."""
+        for connection in list(self.connections):
+            await connection.close()
+        self.connections = []
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
+
+    def stats(self):
+        """Snapshot of pool size, load and acquire wait times."""
+        return {
+            'pool_size': len(self.connections),
+            'connecting': self.connecting,
+            'max_connections': self.max_connections,
+            'sessions': sum(c.load for c in self.connections),
+            'in_flight': sum(c.in_flight for c in self.connections),
+            'frames_sent': self.sent,
+            'frames_received': self.received,
+            'frames_dropped': self.dropped,
+            'acquire_waits': self.acquire_waits,
+            'acquire_wait_seconds_total': round(self.acquire_wait_total, 6),
+            'acquire_wait_seconds_max': round(self.acquire_wait_max, 6),
+            'breaker': self.breaker.stats(),
+        }
+
+
+class UpstreamClient:
+    """
+    A consumer's resilient link to the AI engine.
+
+    A background task keeps an UpstreamSession attached to the pool, passing
+    every reply frame to ``on_message``. When the session ends (the shared
+    connection dropped) ``on_lost`` is awaited and the client reattaches after
+    a jittered exponential backoff, never sooner than the circuit breaker
+    allows. Frames sent while detached wait in a queue of at most
+    ``max_queue`` frames that is drained, in order, once reattached.
+
+    A request that gets no reply within ``reply_timeout`` seconds counts as
+    a failure of the engine: ``on_message`` is given an error frame and the
+    client reattaches.
+    """
+
+    def __init__(self, pool, on_message, on_lost=None, on_state=None, max_queue=20,
+                 backoff_base=0.5, backoff_max=30.0, reply_timeout=60.0):
+        self.pool = pool
+        self.on_message = on_message
+        self.on_lost = on_lost
+        self.on_state = on_state
+        self.max_queue = max_queue
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reply_timeout = reply_timeout
+
+        self.session = None
+        self.queue = collections.deque()
+        self.task = None
+        self.closed = False
+        self.attempt = 0
+        self.waiting_since = None
+        self.sent_at = collections.deque()  # send times of requests awaiting a first reply
+
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.queued = 0
+        self.rejected = 0
+        self.stalls = 0
+
+    @property
+    def connected(self):
+        return self.session is not None and not self.session.closed
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            while not self.closed:
+                try:
+                    self.session = await self.pool.attach()
+                except UpstreamUnavailable as e:
+                    self.failed_attempts += 1
+                    metrics.ERRORS.inc(stage='upstream_connect')
+                    delay = backoff_delay(self.attempt, self.backoff_base, self.backoff_max)
+                    delay = max(delay, getattr(e, 'retry_after', 0))
+                    self.attempt += 1
+                    logger.warning("AI engine unavailable (%s); retrying in %.1fs", e, delay)
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.attempt = 0
+                await self._set_state('connected')
+                try:
+                    await self._drain()
+                    await self._listen()
+                except Exception:
+                    logger.exception("Error in AI upstream client")
+                finally:
+                    session, self.session = self.session, None
+                    self.waiting_since = None
+                    self.sent_at.clear()
+                    await session.close()
+                if self.closed:
+                    break
+                self.reconnects += 1
+                if self.on_lost is not None:
+                    await self.on_lost()
+                await self._set_state('reconnecting')
+        except asyncio.CancelledError:
+            pass
+
+    async def _set_state(self, state):
+        if self.on_state is not None:
+            await self.on_state(state)
+
+    async def _listen(self):
+        """Relay reply frames until the session ends or a request stalls."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.waiting_since is None:
+                timeout = self.reply_timeout
+            else:
+                timeout = max(0.0, self.waiting_since + self.reply_timeout - loop.time())
+            try:
+                text = await asyncio.wait_for(self.session.__anext__(), timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                if self.waiting_since is None:
+                    continue
+                self.stalls += 1
+                metrics.ERRORS.inc(stage='upstream_stall')
+                self.pool.breaker.record_failure()
+                logger.warning('AI engine did not reply in time; reconnecting')
+                await self.on_message(codec.dumps({'error': 'The AI engine did not respond in time'}))
+                return
+            # Still waiting on a later request: its clock restarts now
+            self.waiting_since = loop.time() if self.session.in_flight else None
+            now = time.perf_counter()
+            while len(self.sent_at) > self.session.in_flight:
+                metrics.UPSTREAM_TTFB_SECONDS.observe(now - self.sent_at.popleft())
+            with metrics.RELAY_FEED_SECONDS.time():
+                await self.on_message(text)
+
+    async def _send(self, data):
+        await self.session.send_json(data)
+        self.sent_at.append(time.perf_counter())
+        if self.waiting_since is None:
+            self.waiting_since = asyncio.get_running_loop().time()
+
+    async def _drain(self):
+        while self.queue and self.connected:
+            data = self.queue[0]
+            await self._send(data)
+            self.queue.popleft()
+
+    async def send_json(self, data):
+        """
+        Send a frame to the engine, or queue it while reconnecting. Returns
+        True if it was sent now, False if it was queued; raises
+        UpstreamUnavailable if the queue is full.
+        """
+        if self.closed:
+            raise UpstreamUnavailable('Upstream client is closed')
+        if self.connected and not self.queue:
+            try:
+                await self._send(data)
+                return True
+            except Exception as e:
+                logger.warning("Error sending to AI engine, queueing: %s", e)
+        if len(self.queue) >= self.max_queue:
+            self.rejected += 1
+            raise UpstreamUnavailable('Too many messages waiting for the AI engine')
+        self.queue.append(data)
+        self.queued += 1
+        return False
+
+    async def close(self):
+        """Stop reconnecting, drop queued frames and release the session."""
+        self.closed = True
+        self.queue.clear()
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def stats(self):
+        return {
+            'connected': self.connected,
+            'queued_now': len(self.queue),
+            'queued': self.queued,
+            'rejected': self.rejected,
+            'reconnects': self.reconnects,
+            'failed_attempts': self.failed_attempts,
+            'stalls': self.stalls,
+        }
+
+
+_pool = None
+
+
+def get_client(on_message, on_lost=None, on_state=None):
+    """An UpstreamClient on the process-wide pool, configured from settings."""
+    return UpstreamClient(
+        get_pool(),
+        on_message,
+        on_lost=on_lost,
+        on_state=on_state,
+        max_queue=settings.AI_ENGINE_QUEUE_LIMIT,
+        backoff_base=settings.AI_ENGINE_RECONNECT_BASE,
+        backoff_max=settings.AI_ENGINE_RECONNECT_MAX,
+        reply_timeout=settings.AI_ENGINE_REPLY_TIMEOUT,
+    )
+
+
+def get_pool():
+    """Return the process-wide UpstreamPool, creating it from settings."""
+    global _pool
+    if _pool is None:
+        _pool = UpstreamPool(
+            settings.AI_ENGINE_URL,
+            max_connections=settings.AI_ENGINE_POOL_SIZE,
+            streams_per_connection=settings.AI_ENGINE_STREAMS_PER_CONNECTION,
+            acquire_timeout=settings.AI_ENGINE_ACQUIRE_TIMEOUT,
+            breaker=CircuitBreaker(
+                failure_threshold=settings.AI_ENGINE_BREAKER_THRESHOLD,
+                reset_timeout=settings.AI_ENGINE_BREAKER_RESET_SECONDS,
+            ),
+        )
+    return _pool
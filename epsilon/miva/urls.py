@@ -14,24 +14,40 @@ urlpatterns = [
     path('adult/', views.adult_questionnaire, name='adult_questionnaire'),
     path('student/', views.student_questionnaire, name='student_questionnaire'),
     path('results/', views.results_view, name='results'),
+    path('api/persona/score/', views.persona_score, name='persona_score'),
     
     # Dashboards
     path('dashboard/', views.dashboard, name='dashboard'),
     path('dashboard/parent/', views.dashboard_parent, name='dashboard_parent'),
     path('dashboard/adult/', views.dashboard_adult, name='dashboard_adult'),
-    path('dashboard/chidi/', views.dashboard_chidi, name='dashboard_chidi'),
-    path('dashboard/tunde/', views.dashboard_tunde, name='dashboard_tunde'),
-    path('dashboard/ngozi/', views.dashboard_ngozi, name='dashboard_ngozi'),
+    path('dashboard/chidi/', views.dashboard, {'persona': 'chidi'}, name='dashboard_chidi'),
+    path('dashboard/tunde/', views.dashboard, {'persona': 'tunde'}, name='dashboard_tunde'),
+    path('dashboard/ngozi/', views.dashboard, {'persona': 'ngozi'}, name='dashboard_ngozi'),
     
     # Chat
     path('chat/', views.chat_view, name='chat'),
     path('api/send-message/', views.send_message, name='send_message'),
+    path('api/chat-history/', views.chat_history, name='chat_history'),
     
     # Settings
     path('settings/', views.settings_view, name='settings'),
     path('api/save-settings/', views.save_settings, name='save_settings'),
     path('api/update-profile/', views.update_profile, name='update_profile'),
     path('api/reset-data/', views.reset_data, name='reset_data'),
+    path('api/progress/', views.progress_event, name='progress_event'),
+    path('api/progress/batch/', views.progress_batch, name='progress_batch'),
+    
+    # Lesson content
+    path('api/lessons/', views.lesson_index, name='lesson_index'),
+    path('api/lessons/<slug:slug>/questions/', views.lesson_questions, name='lesson_questions'),
+    path('api/reviews/due/', views.reviews_due, name='reviews_due'),
+    path('api/reviews/batch/', views.reviews_batch, name='reviews_batch'),
+    
+    # Monitoring
+    path('metrics/', views.metrics_view, name='metrics'),
+    
+    # Offline mode
+    path('sw.js', views.service_worker, name='service_worker'),
     
     # Learning Adventures
     path('adventure/math/', views.adventure_math, name='adventure_math'),
@@ -3,12 +3,23 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils import timezone, translation
+from django.views.decorators.http import condition, etag, require_POST
+import hmac
 import json
-from .models import UserProfile
+import logging
+import time
+from . import documents, history, learner, lessons, metrics, offline, personas, progress, reviews
+from .httpcache import page_cache
+from .models import ActivityEvent, Lesson, UserProfile
 
+logger = logging.getLogger(__name__)
 
+
+@page_cache('index.html', public=True)
 def index(request):
     """
     Landing page view - shows role selection
@@ -16,6 +27,7 @@ def index(request):
     return render(request, 'index.html')
 
 
+@page_cache('student.html', public=True)
 def student_questionnaire(request):
     """
     Public student questionnaire page (no login required).
@@ -99,7 +111,8 @@ def signup_view(request):
             )
             
             # Create UserProfile with unique ID
-            UserProfile.objects.create(user=user)
+            profile = UserProfile.objects.create(user=user)
+            learner.claim_session_quiz(request, profile)
             
             # Log the user in
             login(request, user)
@@ -171,6 +184,8 @@ def login_view(request):
             
             # Log the user in
             login(request, user)
+            profile, created = UserProfile.objects.get_or_create(user=user)
+            learner.claim_session_quiz(request, profile)
             
             # Set session expiry based on remember me
             if remember:
@@ -216,20 +231,19 @@ def profile_setup(request):
         reduced_motion = request.POST.get('reduced-motion') == 'on'
         break_reminders = request.POST.get('break-reminders') == 'on'
         
-        # Update user profile (you might want to create a Profile model for this)
+        # Update user profile
         if name:
             request.user.first_name = name
             request.user.save()
         
-        # Store preferences in session for now
-        # (In a real app, you'd want to create a UserProfile model)
-        request.session['preferences'] = {
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
+        learner.update_preferences(profile, {
             'age': age,
             'voice_guidance': voice_guidance,
             'reading_support': reading_support,
             'reduced_motion': reduced_motion,
             'break_reminders': break_reminders,
-        }
+        })
         
         return redirect('path_questionnaire')
     
@@ -240,65 +254,12 @@ def profile_setup(request):
 def path_questionnaire(request):
     """Learning path questionnaire page"""
     if request.method == 'POST':
-        # Get form data
-        learning_style = request.POST.get('learningStyle', '')
-        focus_time = request.POST.get('focusTime', '')
-        reading_level = request.POST.get('readingLevel', '')
-        learning_goal = request.POST.get('learningGoal', '')
-        persona = request.POST.get('persona', '')
-        
-        # Map values to friendly labels
-        style_labels = {
-            'visual-active': 'Pictures, Games & Videos',
-            'audio-patient': 'Listening & Repeating',
-            'slow-steady': 'Step-by-Step & Slow',
-            'mixed': 'A Mix of Everything'
-        }
-        
-        focus_labels = {
-            '5': '5-10 minutes',
-            '15': '10-20 minutes',
-            '30': '20-30 minutes',
-            'flex': 'It Depends'
-        }
-        
-        reading_labels = {
-            'struggle': 'I Find It Very Hard',
-            'slow': 'I Can Read But It Takes Time',
-            'ok': "I'm Okay with Reading",
-            'confident': 'I Love Reading!'
-        }
+        answers = learner.quiz_from_post(request.POST, 'path')
+        persona = answers['persona']
         
-        goal_labels = {
-            'school': 'Help with School Subjects',
-            'life-skills': 'Real Life Skills',
-            'catch-up': 'Catch Up at My Own Speed',
-            'confidence': 'Build Confidence'
-        }
-        
-        # Create quiz results
-        quiz_results = [
-            {
-                'question': 'How do you learn best?',
-                'answer': style_labels.get(learning_style, learning_style)
-            },
-            {
-                'question': 'How long can you usually focus on one thing?',
-                'answer': focus_labels.get(focus_time, focus_time)
-            },
-            {
-                'question': 'How do you feel about reading?',
-                'answer': reading_labels.get(reading_level, reading_level)
-            },
-            {
-                'question': 'What do you want to learn most?',
-                'answer': goal_labels.get(learning_goal, learning_goal)
-            }
-        ]
-        
-        # Save to session
-        request.session['quiz_results'] = quiz_results
-        request.session['persona'] = persona
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
+        learner.record_quiz(profile, answers)
+        progress.record_event(profile, ActivityEvent.KIND_QUIZ_COMPLETED)
         
         # Redirect based on persona to appropriate dashboard
         # All personas should go to the main dashboard route by default
@@ -311,7 +272,7 @@ def path_questionnaire(request):
         dashboard_route = persona_dashboards.get(persona, 'dashboard')
         # Debug logging to help trace unexpected redirects (will appear in server console)
         try:
-            print(f"Path questionnaire submitted. persona={persona!r} -> redirecting to route: {dashboard_route}")
+            logger.info("Path questionnaire submitted. persona=%r -> redirecting to route: %s", persona, dashboard_route)
         except Exception:
             pass
         return redirect(dashboard_route)
@@ -319,50 +280,19 @@ def path_questionnaire(request):
     return render(request, 'path2.html')
 
 
+@page_cache('adult.html', public=True, csrf=True)
 def adult_questionnaire(request):
-    """Adult onboarding questionnaire (public). On POST save quiz results to session and redirect to adult dashboard."""
+    """Adult onboarding questionnaire (public). On POST save quiz results (to the session until the visitor signs in) and redirect to adult dashboard."""
     if request.method == 'POST':
-        learning_style = request.POST.get('learningStyle', '')
-        focus_time = request.POST.get('focusTime', '')
-        reading_level = request.POST.get('readingLevel', '')
-        learning_goal = request.POST.get('learningGoal', '')
-        persona = request.POST.get('persona', '')
-
-        # Map labels (reuse same mappings as path_questionnaire)
-        style_labels = {
-            'visual-active': 'Pictures, Games & Videos',
-            'audio-patient': 'Listening & Repeating',
-            'slow-steady': 'Step-by-Step & Slow',
-            'mixed': 'A Mix of Everything'
-        }
-        focus_labels = {
-            '5': '5-10 minutes',
-            '15': '10-20 minutes',
-            '30': '20-30 minutes',
-            'flex': 'It Depends'
-        }
-        reading_labels = {
-            'struggle': 'I Find It Very Hard',
-            'slow': 'I Can Read But It Takes Time',
-            'ok': "I'm Okay with Reading",
-            'confident': 'I Love Reading!'
-        }
-        goal_labels = {
-            'school': 'Help with School Subjects',
-            'life-skills': 'Real Life Skills',
-            'catch-up': 'Catch Up at My Own Speed',
-            'confidence': 'Build Confidence'
-        }
-
-        quiz_results = [
-            {'question': 'How do you learn best?', 'answer': style_labels.get(learning_style, learning_style)},
-            {'question': 'How long can you usually focus on one thing?', 'answer': focus_labels.get(focus_time, focus_time)},
-            {'question': 'How do you feel about reading?', 'answer': reading_labels.get(reading_level, reading_level)},
-            {'question': 'What do you want to learn most?', 'answer': goal_labels.get(learning_goal, learning_goal)}
-        ]
-
-        request.session['quiz_results'] = quiz_results
-        request.session['persona'] = persona
+        answers = learner.quiz_from_post(request.POST, 'adult')
+        
+        if request.user.is_authenticated:
+            profile, created = UserProfile.objects.get_or_create(user=request.user)
+            learner.record_quiz(profile, answers)
+            progress.record_event(profile, ActivityEvent.KIND_QUIZ_COMPLETED)
+        else:
+            # Saved on the profile when the visitor signs up or logs in
+            request.session['quiz'] = answers
 
         # For adult flow, redirect to adult dashboard
         return redirect('dashboard_adult')
@@ -375,8 +305,8 @@ def results_view(request):
     """
     Learning path results view
     """
-    # Get quiz results from session
-    quiz_results = request.session.get('quiz_results', [])
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    quiz_results = learner.quiz_answers(learner.latest_quiz(profile))
     
     # Determine learning path based on responses
     # This is simplified - you'd want more complex logic
@@ -395,28 +325,42 @@ def results_view(request):
     return render(request, 'results.html', context)
 
 
+# Personas with their own dashboard fragments (templates/dashboards/<persona>.html)
+DASHBOARD_PERSONAS = ('default', 'chidi', 'tunde', 'ngozi')
+
+
 @login_required
-def dashboard(request):
+def dashboard(request, persona='default'):
     """
-    Main dashboard view
+    Dashboard for every persona.
+    The static parts of each persona's page are cached as template fragments
+    per persona, locale and DASHBOARD_FRAGMENT_VERSION; only the learner's own bits (name, streak,
+    points) are rendered on each request. The render time is reported in a
+    Server-Timing header so cached and uncached renders can be compared.
     """
+    started = time.perf_counter()
+    if persona not in DASHBOARD_PERSONAS:
+        raise Http404('Unknown dashboard')
     user = request.user
     
     # Get user preferences
-    preferences = request.session.get('preferences', {})
-    
-    # Calculate streak and points (mock data for now)
-    streak_days = 0
-    total_points = 0
+    profile, created = UserProfile.objects.get_or_create(user=user)
+    preferences = learner.get_preferences(profile)
     
+    # Streak and points come from the precomputed progress row
     context = {
         'user': user,
-        'streak_days': streak_days,
-        'total_points': total_points,
         'preferences': preferences,
+        'persona': persona,
+        'locale': translation.get_language(),
+        'fragment_timeout': settings.DASHBOARD_FRAGMENT_TIMEOUT,
+        'fragment_version': settings.DASHBOARD_FRAGMENT_VERSION,
+        **progress.dashboard_stats(progress.record_visit(profile)),
     }
     
-    return render(request, 'dashboard.html', context)
+    response = render(request, f'dashboards/{persona}.html', context)
+    response['Server-Timing'] = f'dashboard;dur={(time.perf_counter() - started) * 1000:.1f}'
+    return response
 
 
 @login_required
@@ -436,77 +380,256 @@ def dashboard_adult(request):
 
 
 @login_required
-def dashboard_chidi(request):
-    """Chidi-specific dashboard view"""
+def chat_view(request):
+    """
+    Chat with Tega view
+    """
     user = request.user
-    preferences = request.session.get('preferences', {})
-    streak_days = 0
-    total_points = 0
-
+    
+    # Get or create UserProfile
+    profile, created = UserProfile.objects.get_or_create(user=user)
+    streak_days = progress.current_streak(progress.record_visit(profile))
+    
     context = {
         'user': user,
         'streak_days': streak_days,
-        'total_points': total_points,
-        'preferences': preferences,
+        'unique_id': profile.unique_id,
     }
+    
+    return render(request, 'chat.html', context)
 
-    return render(request, 'dashboard-chidi.html', context)
+
+@login_required
+def chat_history(request):
+    """
+    One page of the user's chat history, newest page first.
+    Pass ?before=<next_cursor> from the previous page to load older messages.
+    """
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    
+    try:
+        limit = int(request.GET.get('limit', 0)) or None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    if limit is not None and limit < 0:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    try:
+        messages_page, next_cursor = history.history_page(
+            profile, before=request.GET.get('before'), limit=limit
+        )
+    except history.InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'messages': [
+            {
+                'id': message.pk,
+                'role': message.role,
+                'text': message.text,
+                'created_at': message.created_at.isoformat(),
+            }
+            for message in messages_page
+        ],
+        'next_cursor': next_cursor,
+    })
 
 
 @login_required
-def dashboard_tunde(request):
-    """Tunde-specific dashboard view"""
-    user = request.user
-    preferences = request.session.get('preferences', {})
-    streak_days = 0
-    total_points = 0
+@require_POST
+def progress_event(request):
+    """
+    Record a learning event reported by the browser (e.g. a finished
+    micro-lesson) and return the updated progress stats.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    kind = data.get('kind')
+    if kind not in progress.CLIENT_KINDS:
+        return JsonResponse({'error': 'Unknown event kind'}, status=400)
+    
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    learner_progress = progress.record_event(profile, kind, progress.client_xp(kind, data.get('xp')))
+    return JsonResponse({'success': True, **progress.dashboard_stats(learner_progress)})
+
+
+@login_required
+@require_POST
+def progress_batch(request):
+    """
+    Record learning events the browser queued while offline, sent in one
+    batch by the service worker (see miva.offline). Accepts
+    {"events": [{"id", "kind", "at"}, ...]} and returns the ids it has
+    recorded now or before ("accepted") and those it never will ("rejected"),
+    so the browser can drop both from its queue.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    items = data.get('events') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'events must be a list'}, status=400)
+    if len(items) > progress.MAX_BATCH_EVENTS:
+        return JsonResponse({'error': f'At most {progress.MAX_BATCH_EVENTS} events per request'}, status=400)
+    
+    events, rejected = progress.client_events(items)
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    known_questions = lessons.get_bank().question_lessons
+    # One transaction, so a batch whose reviews fail to schedule is not
+    # recorded either and the browser's retry gets another go
+    with transaction.atomic():
+        learner_progress, recorded = progress.record_batch(profile, events)
+        
+        # Quizzes answered offline are scheduled for review as of the day they were taken
+        recorded = set(recorded)
+        for event in sorted(events, key=lambda event: event['at']):
+            if event['id'] in recorded and event.get('answers'):
+                answers, _ = reviews.parse_answers(event['answers'][:reviews.MAX_BATCH_ANSWERS], known_questions)
+                reviews.record_answers(profile, answers, today=timezone.localdate(event['at']))
+    return JsonResponse({
+        'success': True,
+        'accepted': [event['id'] for event in events],
+        'rejected': rejected,
+        'recorded': len(recorded),
+        **progress.dashboard_stats(learner_progress),
+    })
+
+
+def _question_set(request, slug):
+    return lessons.get_bank().get(slug)
 
-    context = {
-        'user': user,
-        'streak_days': streak_days,
-        'total_points': total_points,
-        'preferences': preferences,
-    }
 
-    return render(request, 'dashboard-tunde.html', context)
+def _lesson_index(request):
+    return lessons.get_bank().index(request.GET.get('subject'))
 
 
 @login_required
-def dashboard_ngozi(request):
-    """Ngozi-specific dashboard view"""
-    user = request.user
-    preferences = request.session.get('preferences', {})
-    streak_days = 0
-    total_points = 0
+@condition(etag_func=lambda request: _lesson_index(request)[0])
+def lesson_index(request):
+    """
+    Lessons (optionally of one ?subject=) with the ETag of each question set,
+    so a client can tell which sets have changed without fetching them.
+    """
+    etag, summaries = _lesson_index(request)
+    response = JsonResponse({'lessons': summaries})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
-    context = {
-        'user': user,
-        'streak_days': streak_days,
-        'total_points': total_points,
-        'preferences': preferences,
-    }
 
-    return render(request, 'dashboard-ngozi.html', context)
+@login_required
+@condition(
+    etag_func=lambda request, slug: getattr(_question_set(request, slug), 'etag', None),
+    last_modified_func=lambda request, slug: getattr(_question_set(request, slug), 'last_modified', None),
+)
+def lesson_questions(request, slug):
+    """
+    A lesson's question set, served from the in-memory question bank as
+    pre-encoded JSON. Browsers revalidate it on every use (no-cache) and get
+    a 304 while their copy's strong ETag is current.
+    """
+    question_set = _question_set(request, slug)
+    if question_set is None:
+        raise Http404('Unknown lesson')
+    response = HttpResponse(question_set.body, content_type='application/json')
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @login_required
-def chat_view(request):
+def reviews_due(request):
     """
-    Chat with Tega view
+    The learner's next spaced-repetition reviews (?limit=, default 20), most
+    overdue first, and how many are due in all.
     """
-    user = request.user
-    streak_days = 0  # You can calculate actual streak here
+    try:
+        limit = int(request.GET.get('limit', 20))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
     
-    # Get or create UserProfile
-    profile, created = UserProfile.objects.get_or_create(user=user)
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    bank = lessons.get_bank()
+    return JsonResponse({
+        'items': [reviews.item_dict(item, bank) for item in reviews.due_items(profile, limit)],
+        'due_count': reviews.due_count(profile),
+    })
+
+
+@login_required
+@require_POST
+def reviews_batch(request):
+    """
+    Grade many review answers at once. Accepts
+    {"answers": [{"question": id, "grade": 0-5}, ...]}, schedules them with
+    SM-2 in one transaction and returns each question's new schedule.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
     
-    context = {
-        'user': user,
-        'streak_days': streak_days,
-        'unique_id': profile.unique_id,
-    }
+    items = data.get('answers') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'answers must be a list'}, status=400)
+    if len(items) > reviews.MAX_BATCH_ANSWERS:
+        return JsonResponse({'error': f'At most {reviews.MAX_BATCH_ANSWERS} answers per request'}, status=400)
     
-    return render(request, 'chat.html', context)
+    bank = lessons.get_bank()
+    answers, rejected = reviews.parse_answers(items, bank.question_lessons)
+    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    scheduled = reviews.record_answers(profile, answers)
+    return JsonResponse({
+        'success': True,
+        'scheduled': [reviews.item_dict(item, bank) for item in scheduled],
+        'rejected': rejected,
+        'due_count': reviews.due_count(profile),
+    })
+
+
+@etag(lambda request: offline.get_manifest()['version'])
+def service_worker(request):
+    """
+    The offline service worker, served from the site root so it can control
+    every page. Browsers recheck it on each navigation; the ETag (the
+    precache manifest version) answers them with a 304 until a deploy
+    changes something it caches.
+    """
+    response = HttpResponse(offline.worker_script(), content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_POST
+def persona_score(request):
+    """
+    Score questionnaire answers against every persona.
+    Accepts {"answers": {...}} for one learner or {"answers": [{...}, ...]}
+    for a batch, using the questionnaire form field names.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    answers = data.get('answers') if isinstance(data, dict) else None
+    batch = isinstance(answers, list)
+    answer_sets = answers if batch else [answers]
+    if not answer_sets or not all(isinstance(a, dict) for a in answer_sets):
+        return JsonResponse({'error': 'answers must be an object or a list of objects'}, status=400)
+    if len(answer_sets) > personas.MAX_BATCH:
+        return JsonResponse({'error': f'At most {personas.MAX_BATCH} answer sets per request'}, status=400)
+    
+    answer_sets = [personas.from_form(a) for a in answer_sets]
+    scores = personas.score_many(answer_sets).tolist()
+    results = [
+        {'persona': persona, 'scores': dict(zip(personas.PERSONAS, row))}
+        for persona, row in zip(personas.detect_many(answer_sets), scores)
+    ]
+    return JsonResponse({'results': results} if batch else results[0])
 
 
 @login_required
@@ -519,8 +642,8 @@ def settings_view(request):
     # Get or create UserProfile
     profile, created = UserProfile.objects.get_or_create(user=user)
     
-    # Get preferences from session or defaults
-    preferences = request.session.get('preferences', {})
+    preferences = learner.get_preferences(profile)
+    stats = progress.dashboard_stats(progress.get_progress(profile))
     
     context = {
         'user': user,
@@ -532,10 +655,10 @@ def settings_view(request):
         'achievement_alerts': preferences.get('achievement_alerts', True),
         'high_contrast': preferences.get('high_contrast', False),
         'color_theme': preferences.get('color_theme', 'default'),
-        'streak_days': 0,  # Calculate actual streak
-        'lessons_completed': 0,  # Get from DB
-        'badges_earned': 0,  # Get from DB
-        'total_points': 12,  # Get from DB
+        'streak_days': stats['streak_days'],
+        'lessons_completed': stats['lessons_completed'],
+        'badges_earned': stats['badges_earned'],
+        'total_points': stats['total_points'],
     }
     
     return render(request, 'settings.html', context)
@@ -545,14 +668,13 @@ def settings_view(request):
 @require_POST
 def save_settings(request):
     """
-    Save user settings to session
+    Save user settings. Only values that actually changed are written.
     """
     try:
         data = json.loads(request.body)
         
-        # Update preferences in session
-        preferences = request.session.get('preferences', {})
-        preferences.update({
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
+        changes = {
             'voice_guidance': data.get('voice_guidance', False),
             'break_reminders': data.get('break_reminders', False),
             'reduced_motion': data.get('reduce_motion', False),
@@ -560,8 +682,8 @@ def save_settings(request):
             'achievement_alerts': data.get('achievement_alerts', True),
             'high_contrast': data.get('high_contrast', False),
             'color_theme': data.get('color_theme', 'default'),
-        })
-        request.session['preferences'] = preferences
+        }
+        learner.update_preferences(profile, changes)
         
         return JsonResponse({'success': True})
     except Exception as e:
@@ -588,9 +710,8 @@ def update_profile(request):
             user.email = value
             user.save()
         elif field == 'age':
-            preferences = request.session.get('preferences', {})
-            preferences['age'] = value
-            request.session['preferences'] = preferences
+            profile, created = UserProfile.objects.get_or_create(user=user)
+            learner.update_preferences(profile, {'age': value})
         
         return JsonResponse({'success': True})
     except Exception as e:
@@ -604,17 +725,33 @@ def reset_data(request):
     Reset all user data (progress, preferences, etc.)
     """
     try:
+        # Delete saved preferences and questionnaire results
+        profile, created = UserProfile.objects.get_or_create(user=request.user)
+        learner.reset(profile)
+        progress.reset(profile)
+        documents.get_index().forget(str(profile.unique_id))
+        
         # Clear session data
         request.session.flush()
         
-        # In a real app, you'd delete progress records, badges, etc.
-        # For now, just clear session
-        
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
+def metrics_view(request):
+    """
+    Chat path metrics in the Prometheus text format, for staff users or a
+    scraper presenting ``Authorization: Bearer <METRICS_TOKEN>``.
+    """
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    if not authorized and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @login_required
 @require_POST
 def send_message(request):
@@ -645,14 +782,24 @@ def send_message(request):
 
 
 @login_required
+@page_cache(
+    'adventure-math.html',
+    # The curriculum version: (lessons, last import)
+    key=lambda request: lessons.get_bank().version,
+    last_modified=lambda request: lessons.get_bank().version[1],
+)
 def adventure_math(request):
     """
-    Math Adventures lesson page
+    Math Adventures lesson page (?lesson=<slug>, the first lesson by default).
+    The page is a shell: its questions come from the question API, so only a
+    changed question set is downloaded again.
     """
-    return render(request, 'adventure-math.html')
+    context = lessons.adventure_context(Lesson.SUBJECT_MATH, request.GET.get('lesson'))
+    return render(request, 'adventure-math.html', context)
 
 
 @login_required
+@page_cache('adventure-reading.html')
 def adventure_reading(request):
     """
     Reading Quest lesson page
@@ -661,6 +808,7 @@ def adventure_reading(request):
 
 
 @login_required
+@page_cache('adventure-science.html')
 def adventure_science(request):
     """
     Science Lab lesson page
@@ -669,6 +817,7 @@ def adventure_science(request):
 
 
 @login_required
+@page_cache('adventure-creative.html')
 def adventure_creative(request):
     """
     Creative Studio lesson page
@@ -677,6 +826,7 @@ def adventure_creative(request):
 
 
 @login_required
+@page_cache('micro-lesson.html')
 def micro_lesson(request):
     """Micro lesson page (short interactive lesson)"""
     # allow optional query params like ?practice=1 and pass to template
@@ -688,6 +838,7 @@ def micro_lesson(request):
 
 
 @login_required
+@page_cache('break-timer.html')
 def break_timer(request):
     """Simple break timer page. Accepts optional ?duration= (minutes)"""
     duration = request.GET.get('duration', '2')